@@ -5,28 +5,168 @@ Created on Thu Jun 10 09:07:07 2021
 @author: assela.pathirana
 """
 import logging
+import math
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
 
 
 import pandas as pd
 import numpy as np
 
-from readExchangeRates import get_rate, currencylist
+import dataBundle
+import metrics
+from readExchangeRates import get_rate, lookup_rates, rate_matrix, currencylist
 
 # define Python user-defined exceptions
 class DataNotAvailableError(Exception):
     """Base class for other exceptions"""
     pass
 
-spdf = pd.read_csv('./data/s_and_p_500.csv', index_col="Year", 
-                   converters={"Value": float})
-spdf['endvalue']=np.nan
+SANDP_CSV = './data/s_and_p_500.csv'
+SANDP_COLUMNS = ['DividendYield_percent', 'Value', 'CPI']
+
+def read_sandp(path=SANDP_CSV):
+    myspdf = pd.read_csv(path, index_col="Year", 
+                         converters={"Value": float})
+    myspdf['endvalue']=np.nan
+    return myspdf
+
+_spdf = None
+_sandp_arrays = None
+_spdf_lock = threading.RLock()
+# incremented by reload_sandp, see data_version
+_sandp_generation = 0
+
+SandPArrays = namedtuple('SandPArrays', ['years', 'dividend', 'value', 'cpi', 'log_cpi'])
+
+def sandp_arrays():
+    """Year, DividendYield_percent, Value and CPI as arrays: zero-copy views into the data 
+    bundle when there is an up to date one (see dataBundle), else the columns of spdf. 
+    log_cpi is the natural log of CPI, for inflation_ratio."""
+    global _sandp_arrays
+    if _sandp_arrays is None:
+        with _spdf_lock:
+            if _sandp_arrays is None:
+                bundle = dataBundle.load_bundle()
+                if bundle is not None:
+                    columns = (bundle['sandp_year'], bundle['sandp_dividend'], 
+                               bundle['sandp_value'], bundle['sandp_cpi'])
+                else:
+                    spdf = get_spdf()
+                    columns = (spdf.index.to_numpy(), *[spdf[c].to_numpy(dtype=float) for c in SANDP_COLUMNS])
+                log_cpi = np.log(columns[3])
+                log_cpi.setflags(write=False)
+                _sandp_arrays = SandPArrays(*columns, log_cpi)
+    return _sandp_arrays
+
+def _year_pos(year):
+    # position of year in sandp_arrays(), KeyError if it is not there
+    # (sorted, but there may be gaps, e.g. after update_sandp adds a later year)
+    years = sandp_arrays().years
+    pos = int(np.searchsorted(years, int(year)))
+    if pos < len(years) and years[pos] == int(year):
+        return pos
+    raise KeyError(year)
+
+def get_spdf():
+    """The S&P 500 table, read from SANDP_CSV on first use."""
+    global _spdf
+    if _spdf is None:
+        with _spdf_lock:
+            if _spdf is None:
+                _spdf = read_sandp()
+    return _spdf
+
+def __getattr__(name):
+    # SandPCalc.spdf still works, but the csv is only read when it is first needed
+    if name == "spdf":
+        return get_spdf()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def update_sandp(new_rows, path=SANDP_CSV):
+    """Add new years (or corrected values for existing years) to the S&P 500 csv file. 
+    
+    new_rows is a DataFrame with a Year column (or index) and SANDP_COLUMNS. Only the lines 
+    of changed years are rewritten, new years are appended. spdf and the caches built from 
+    it are reloaded. Returns the number of lines added or changed."""
+    if 'Year' in new_rows:
+        new_rows = new_rows.set_index('Year')
+    with open(path) as f:
+        lines = f.read().splitlines()
+    current = read_sandp(path)
+    position = {year: i+1 for i, year in enumerate(current.index)} # line 0 is the header
+    changed = 0
+    for year, row in new_rows[SANDP_COLUMNS].iterrows():
+        year = int(year)
+        if year in current.index and np.allclose(current.loc[year, SANDP_COLUMNS].to_numpy(dtype=float), 
+                                                 row.to_numpy(dtype=float)):
+            continue
+        line = ",".join([str(year)]+[str(float(row[c])) for c in SANDP_COLUMNS])
+        if year in position:
+            lines[position[year]] = line
+        else:
+            lines.append(line)
+        changed += 1
+    if changed:
+        tmp = path+".tmp"
+        with open(tmp, "w") as f:
+            f.write("\n".join(lines)+"\n")
+        os.replace(tmp, path)
+        if os.path.abspath(path) == os.path.abspath(SANDP_CSV):
+            reload_sandp()
+    return changed
+
+def reload_sandp():
+    global _spdf, _sandp_arrays, _sandp_generation
+    with _spdf_lock:
+        _spdf = read_sandp()
+        _sandp_arrays = None
+        _sandp_generation += 1
+    accumulation_cache.clear()
+    _holding_period_matrix.cache_clear()
+
+def data_version():
+    """Changes whenever the data behind the results does: the exchange rate database (its 
+    mtime, as rate_matrix sees it) or the S&P 500 table (reload_sandp). For cache keys."""
+    return f"{rate_matrix().mtime}/{_sandp_generation}"
 
 def inflation_calc(startyear, endyear):
-    initial_inf=spdf.loc[startyear]['CPI']
-    final_inf = spdf.loc[endyear]['CPI'] 
-    factor_to_old_dollars=initial_inf/final_inf
-    logging.debug("CPI1 {}, CPI2 {}, factor_to_old_dollars {}".format(initial_inf, final_inf, factor_to_old_dollars))    
-    return factor_to_old_dollars
+    return inflation_ratio(startyear, endyear)
+
+def inflation_ratio(startyear, endyear):
+    """CPI(startyear)/CPI(endyear), the factor that brings endyear USD to startyear USD. 
+    KeyError for a year without data."""
+    log_cpi=sandp_arrays().log_cpi
+    return math.exp(log_cpi[_year_pos(startyear)]-log_cpi[_year_pos(endyear)])
+
+def _log_inflation_batch(startyears, endyears):
+    log_cpi=sandp_arrays().log_cpi
+    istart, iend=_year_positions(startyears), _year_positions(endyears)
+    return np.where((istart >= 0) & (iend >= 0), log_cpi[istart]-log_cpi[iend], np.nan)
+
+def inflation_ratio_batch(startyears, endyears):
+    """inflation_ratio over arrays of years (nan where a year has no data)."""
+    return np.exp(_log_inflation_batch(startyears, endyears))
+
+def local_inflation_ratio(currency, startyear, endyear, adjust_inflation=True):
+    """ratio_to_older_local of get_return_value_in_local: the factor that brings endyear 
+    local currency to startyear local currency via USD, (CPI ratio) x (exchange rate ratio). 
+    KeyError for a year without data."""
+    matrix=rate_matrix()
+    log_ratio=matrix.log_rate(currency, startyear)-matrix.log_rate(currency, endyear)
+    if adjust_inflation:
+        log_cpi=sandp_arrays().log_cpi
+        log_ratio+=log_cpi[_year_pos(startyear)]-log_cpi[_year_pos(endyear)]
+    return math.exp(log_ratio)
+
+def local_inflation_ratio_batch(currencies, startyears, endyears, adjust_inflation=True):
+    """local_inflation_ratio over arrays (nan where there is no data)."""
+    matrix=rate_matrix()
+    log_ratio=matrix.log_lookup(currencies, startyears)-matrix.log_lookup(currencies, endyears)
+    log_ratio+=np.where(adjust_inflation, _log_inflation_batch(startyears, endyears), 0.0)
+    return np.exp(log_ratio)
 
 def calc_interest(buy_price, sell_price, buy_year, sell_year):
     grossreturn=(1+(sell_price-buy_price)/buy_price)**(1/(sell_year-buy_year))-1
@@ -43,32 +183,120 @@ def xrate_check(df, year):
     if not (len(months) and set(df['Month'])==set([ '{}/{}'.format(x,year) for x in months])):
         raise DataNotAvailableError
 
+def _sandp_columns(myspdf=None):
+    if myspdf is None:
+        arrays = sandp_arrays()
+        return arrays.dividend, arrays.value
+    return (myspdf['DividendYield_percent'].to_numpy(dtype=float),
+            myspdf['Value'].to_numpy(dtype=float))
+
+def accumulation_index(annual_cost_frac=0.0, dividend_tax=0.0, myspdf=None):
+    """Index units held per USD invested in the first year, with after-tax dividends
+    reinvested and the expense ratio charged annually (the ``endvalue`` column of
+    calc_ret). Returns a new array; spdf is not modified."""
+    dyper, value = _sandp_columns(myspdf)
+    growth = (1+dyper*(1-dividend_tax))*(1-annual_cost_frac)
+    growth[0] = 1./value[0]
+    return np.cumprod(growth)
+
+def accumulation_index_batch(annual_cost_fracs, dividend_taxes, myspdf=None):
+    """accumulation_index for arrays of expense ratios and dividend taxes (broadcast
+    against each other). Returns a 2-D array, one row per (cost, tax) pair."""
+    dyper, value = _sandp_columns(myspdf)
+    cost, tax = np.broadcast_arrays(np.atleast_1d(np.asarray(annual_cost_fracs, dtype=float)),
+                                    np.atleast_1d(np.asarray(dividend_taxes, dtype=float)))
+    growth = (1+dyper[np.newaxis, :]*(1-tax[:, np.newaxis]))*(1-cost[:, np.newaxis])
+    growth[:, 0] = 1./value[0]
+    return np.cumprod(growth, axis=1)
+
+class AccumulationCache:
+    """Bounded LRU cache of total-return index series (accumulation_index * Value),
+    keyed by (annual_cost_frac, dividend_tax). Safe to share between threads."""
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._series = OrderedDict()
+        self._generation = 0 # bumped by clear(), so series computed before a reload are dropped
+        self._lock = threading.Lock()
+
+    def get(self, annual_cost_frac=0.0, dividend_tax=0.0):
+        key = (float(annual_cost_frac), float(dividend_tax))
+        with self._lock:
+            series = self._series.get(key)
+            if series is not None:
+                self._series.move_to_end(key)
+                self.hits += 1
+                return series
+            self.misses += 1
+            generation = self._generation
+        series = accumulation_index(*key)*sandp_arrays().value
+        series.setflags(write=False) # shared between callers
+        with self._lock:
+            if generation != self._generation:
+                return series
+            self._series[key] = series
+            self._series.move_to_end(key)
+            while len(self._series) > self.maxsize:
+                self._series.popitem(last=False)
+        return series
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+            self._generation += 1
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self._series), "maxsize": self.maxsize}
+
+ACCUMULATION_CACHE_SIZE = 32
+accumulation_cache = AccumulationCache(maxsize=ACCUMULATION_CACHE_SIZE)
+metrics.register_cache("accumulation", lambda: accumulation_cache.stats())
+
 def calc_ret(myspdf, annual_cost_frac=0, dividend_tax=0.0):
+    # writes the endvalue column of myspdf; request handlers use accumulation_cache instead, 
+    # so the shared spdf is never modified while serving
     EVCOL=myspdf.columns.get_loc('endvalue')
-    DYPER=myspdf.columns.get_loc('DividendYield_percent')
-    iv_=myspdf.iloc[0, myspdf.columns.get_loc('Value')]
-    myspdf.iloc[0,EVCOL] = 1./iv_
-    for index in range(len(myspdf))[1:]:
-        myspdf.iloc[index, EVCOL]=myspdf.iloc[index-1, EVCOL]*(1+myspdf.iloc[index, DYPER]*(1-dividend_tax))*(1-annual_cost_frac)
+    myspdf.iloc[:, EVCOL] = accumulation_index(annual_cost_frac, dividend_tax, myspdf)
     return myspdf
 
 def get_property_return(buy_price, sell_price, buy_year, sell_year, 
                         rental_income_frac=0.03, cost_fraction=0.25, selling_cost_fraction=0.05):
-    exvalue=0.0
-    
     returnonappreciation_nosalescost = calc_interest(buy_price, sell_price, buy_year, sell_year)
     returnonappreciation = calc_interest(buy_price, sell_price*(1-selling_cost_fraction), buy_year, sell_year)
-    cv=buy_price
-    exvalue=cv*rental_income_frac # first year rent calculated as end of year 
-    cv*=(1+returnonappreciation_nosalescost)
-    for yy in range(buy_year+1,sell_year):   
-        exvalue += cv*rental_income_frac*(1-cost_fraction) # add rent
-        exvalue *=(1+returnonappreciation_nosalescost) # bring to next year
-        cv *= (1+returnonappreciation_nosalescost) # bring to next year
-    print(cv)
+    # Rent grows with the property value and is reinvested at the same appreciation rate, 
+    # so every year's rent compounds to the same amount by the time of selling:
+    # first year rent (no costs) + (years-1) equal terms of net rent. 
+    growth=1+returnonappreciation_nosalescost
+    rent_years=max(sell_year-buy_year-1, 0)
+    exvalue=buy_price*rental_income_frac*growth**rent_years \
+        + rent_years*buy_price*rental_income_frac*(1-cost_fraction)*growth**(rent_years+1)
     totalreturn=calc_interest(buy_price, sell_price*(1-selling_cost_fraction)+exvalue, buy_year, sell_year)
     return returnonappreciation, totalreturn, exvalue # first return value appreciation, amount from rental income
 
+def get_property_return_batch(buy_price, sell_price, buy_year, sell_year, 
+                              rental_income_frac=0.03, cost_fraction=0.25, selling_cost_fraction=0.05):
+    """get_property_return over NumPy arrays (all arguments broadcast against each other).
+    Returns arrays (returnonappreciation, totalreturn, exvalue)."""
+    buy_price=np.asarray(buy_price, dtype=float)
+    sell_price=np.asarray(sell_price, dtype=float)
+    buy_year=np.asarray(buy_year, dtype=float)
+    sell_year=np.asarray(sell_year, dtype=float)
+    selling_cost_fraction=np.asarray(selling_cost_fraction, dtype=float)
+    returnonappreciation_nosalescost = calc_interest(buy_price, sell_price, buy_year, sell_year)
+    returnonappreciation = calc_interest(buy_price, sell_price*(1-selling_cost_fraction), buy_year, sell_year)
+    growth=1+returnonappreciation_nosalescost
+    rent_years=np.maximum(sell_year-buy_year-1, 0)
+    exvalue=buy_price*rental_income_frac*growth**rent_years \
+        + rent_years*buy_price*rental_income_frac*(1-cost_fraction)*growth**(rent_years+1)
+    totalreturn=calc_interest(buy_price, sell_price*(1-selling_cost_fraction)+exvalue, buy_year, sell_year)
+    return returnonappreciation, totalreturn, exvalue
+
 
 
 
@@ -82,15 +310,8 @@ def sap500_end_value(investment,
                   annual_cost_frac=0.0, 
                   adjust_inflation=False, dividend_tax=.0 ):
     
-    myspdf=spdf
-    myspdf=calc_ret(myspdf, annual_cost_frac=annual_cost_frac, dividend_tax=dividend_tax)
-    final_n=myspdf.loc[endyear]['endvalue']
-    initial_n=myspdf.loc[startyear]['endvalue']
-    initial_v=myspdf.loc[startyear]['Value']
-    final_v=myspdf.loc[endyear]['Value']
-
-    
-    fiv=(final_n*final_v)/(initial_n*initial_v)*investment
+    total_return_index=accumulation_cache.get(annual_cost_frac, dividend_tax)
+    fiv=total_return_index[_year_pos(endyear)]/total_return_index[_year_pos(startyear)]*investment
     ret=(fiv-investment)/investment
     
     if adjust_inflation:
@@ -116,22 +337,156 @@ def get_xrate_direct(year, currency):
 
 
 
+def holding_period_matrix(currency, annual_cost_frac=0.0, dividend_tax=0.0, 
+                          conversion_cost_frac=0.02, adjust_inflation=True):
+    """get_return_value_in_local for every (buy year, sell year) pair of a currency at once. 
+    
+    Returns (years, total_stock_return_rate, ratio_to_older_local): the two matrices are 
+    indexed [buy year, sell year] along years (the years with both S&P 500 and exchange rate 
+    data) and are nan where the sell year is not after the buy year. 
+    The arrays are cached and read-only."""
+    return _holding_period_matrix(currency, float(annual_cost_frac), float(dividend_tax), 
+                                  float(conversion_cost_frac), bool(adjust_inflation), 
+                                  rate_matrix().mtime)
+
+@lru_cache(maxsize=64)
+def _holding_period_matrix(currency, annual_cost_frac, dividend_tax, 
+                           conversion_cost_frac, adjust_inflation, mtime):
+    sandp=sandp_arrays()
+    allyears=sandp.years
+    xrates=lookup_rates(np.full(len(allyears), currency), allyears)
+    keep=~np.isnan(xrates)
+    years=allyears[keep]
+    xrates=xrates[keep]
+    total_return_index=accumulation_cache.get(annual_cost_frac, dividend_tax)[keep]
+    cpi=sandp.cpi[keep]
+    
+    ratio_to_older_dollars=cpi[:, np.newaxis]/cpi[np.newaxis, :] if adjust_inflation else np.ones((len(years),)*2)
+    ratio_to_older_local=ratio_to_older_dollars*xrates[:, np.newaxis]/xrates[np.newaxis, :]
+    # value in local currency at the end, per unit of local currency invested
+    usd_end_value=(1-conversion_cost_frac)/xrates[:, np.newaxis]*total_return_index[np.newaxis, :]/total_return_index[:, np.newaxis]
+    local_currency_end_value=usd_end_value*xrates[np.newaxis, :]*(1-conversion_cost_frac)*ratio_to_older_local
+    holding=(years[np.newaxis, :]-years[:, np.newaxis]).astype(float)
+    holding[holding <= 0]=np.nan
+    total_stock_return_rate=local_currency_end_value**(1/holding)-1
+    ratio_to_older_local[np.isnan(holding)]=np.nan
+    for array in (years, total_stock_return_rate, ratio_to_older_local):
+        array.setflags(write=False)
+    return years, total_stock_return_rate, ratio_to_older_local
+
+metrics.register_cache("holding_period_matrix", metrics.lru_stats(_holding_period_matrix))
+
+def rolling_returns(currency, holding_years, annual_cost_frac=0.0, dividend_tax=0.0, 
+                    conversion_cost_frac=0.02, adjust_inflation=True):
+    """get_return_value_in_local for every start year with the same holding period. 
+    
+    Returns a DataFrame indexed by start year with the columns 
+    total_stock_return_rate ("inflation" adjusted annual return in local currency) and 
+    ratio_to_older_local, for every start year where S&P 500 and exchange rate data 
+    cover both ends of the period."""
+    sandp=sandp_arrays()
+    years=sandp.years
+    n=int(holding_years)
+    if n < 1 or n >= len(years):
+        return pd.DataFrame({'total_stock_return_rate': [], 'ratio_to_older_local': []}, 
+                            index=pd.Index([], name='Year', dtype=years.dtype))
+    xrates=lookup_rates(np.full(len(years), currency), years)
+    total_return_index=accumulation_cache.get(annual_cost_frac, dividend_tax)
+    # start and end of every window as two shifted views of the same arrays
+    ratio_to_older_dollars=sandp.cpi[:-n]/sandp.cpi[n:] if adjust_inflation else np.ones(len(years)-n)
+    ratio_to_older_local=ratio_to_older_dollars*xrates[:-n]/xrates[n:]
+    # per unit invested; the exchange rates cancel, see get_return_value_in_local
+    local_currency_end_value=(1-conversion_cost_frac)**2*total_return_index[n:]/total_return_index[:-n]*ratio_to_older_dollars
+    total_stock_return_rate=local_currency_end_value**(1/n)-1
+    keep=~np.isnan(ratio_to_older_local) & (years[n:]-years[:-n] == n)
+    return pd.DataFrame({'total_stock_return_rate': total_stock_return_rate[keep], 
+                         'ratio_to_older_local': ratio_to_older_local[keep]}, 
+                        index=pd.Index(years[:-n][keep], name='Year'))
+
+def _break_even_growth(target, years, rental_income_frac, rental_cost_fraction, selling_cost_fraction, 
+                       iterations=100):
+    # sell/buy price ratio x**n at which get_property_return's end value (rent and sale, per 
+    # unit of buy price) is target: rf*x**(n-1) + ((n-1)*rf*(1-cf) + 1 - scf)*x**n = target, 
+    # with x the annual appreciation factor. nan where there is no positive solution.
+    target, n, rf, cf, scf=np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in 
+                                                 (target, years, rental_income_frac, rental_cost_fraction, 
+                                                  selling_cost_fraction)])
+    c=np.maximum(n-1, 0)*rf*(1-cf)+1-scf
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # closed forms: one year (linear) and no rent (a power)
+        x=np.where(n == 1, (target-rf)/c, (target/c)**(1/n))
+        newton=(n > 1) & (rf > 0)
+        if newton.any():
+            t, m, r, cc=target[newton], n[newton], rf[newton], c[newton]
+            # the polynomial is increasing and convex for x > 0, so Newton from an upper bound of 
+            # the root (each term alone reaches the target) converges from above
+            xn=np.minimum((t/cc)**(1/m), (t/r)**(1/(m-1)))
+            for _ in range(iterations):
+                f=r*xn**(m-1)+cc*xn**m-t
+                step=f/(r*(m-1)*xn**(m-2)+cc*m*xn**(m-1))
+                xn=xn-step
+                if np.all(np.abs(step) <= 1e-13*xn):
+                    break
+            x[newton]=xn
+        ok=(x > 0) & (c > 0) & (n >= 1) & np.isfinite(x)
+        return np.where(ok, x**n, np.nan)
+
+def break_even_sell_price(curr, bval, byr, syr, 
+                          rental_income_frac=0.03, 
+                          rental_cost_fraction=0.25,
+                          conversion_cost_frac=0.02,
+                          annual_stock_cost_frac=0.0015, 
+                          adjust_inflation=True, dividend_tax=0.15, 
+                          selling_cost_fraction=0.05):
+    """The sval at which compare_investment's property_inflation_adjusted_annual_return equals 
+    stock_annual_rate_in_local_currency (nan if no positive price does)."""
+    ret=get_return_value_in_local(bval, curr, byr, syr, annual_stock_cost_frac, 
+                                  adjust_inflation, dividend_tax, conversion_cost_frac)
+    return float(break_even_price(bval, syr-byr, ret[1], ret[3], rental_income_frac, 
+                                  rental_cost_fraction, selling_cost_fraction))
+
+def break_even_price(bval, years, stock_annual_rate_in_local_currency, ratio_to_older_local, 
+                     rental_income_frac=0.03, rental_cost_fraction=0.25, selling_cost_fraction=0.05):
+    """break_even_sell_price from the stock side results of compare_investment (arrays broadcast)."""
+    years=np.asarray(years, dtype=float)
+    with np.errstate(invalid='ignore'):
+        target=(1+np.asarray(stock_annual_rate_in_local_currency))**years/ratio_to_older_local
+    return bval*_break_even_growth(target, years, rental_income_frac, rental_cost_fraction, 
+                                   selling_cost_fraction)
+
+def break_even_surface(currency, bval, 
+                       rental_income_frac=0.03, 
+                       rental_cost_fraction=0.25,
+                       conversion_cost_frac=0.02,
+                       annual_stock_cost_frac=0.0015, 
+                       adjust_inflation=True, dividend_tax=0.15, 
+                       selling_cost_fraction=0.05):
+    """break_even_sell_price for every (buy year, sell year) pair of a currency at once. 
+    Returns (years, prices) with prices indexed [buy year, sell year] like holding_period_matrix."""
+    years, stock_rates, ratios=holding_period_matrix(currency, annual_stock_cost_frac, dividend_tax, 
+                                                     conversion_cost_frac, adjust_inflation)
+    holding=years[np.newaxis, :]-years[:, np.newaxis]
+    return years, break_even_price(bval, holding, stock_rates, ratios, rental_income_frac, 
+                                   rental_cost_fraction, selling_cost_fraction)
+
 """Convert local currency to USD, invest it, then convert back at the end of the period"""
 def get_return_value_in_local(investment, currency="LKR",  
                   startyear=2001, endyear=2021, 
                   annual_cost_frac=0.0, 
                   adjust_inflation=False, dividend_tax=.0, conversion_cost_frac=.02 ):
-    xrate1=get_xrate(startyear,currency)
+    with metrics.timer("xrate"):
+        xrate1=get_xrate(startyear,currency)
+        xrate2=get_xrate(endyear,currency)
     usd_value=investment/xrate1*(1-conversion_cost_frac)
-    ret=sap500_end_value(usd_value, 
-                  startyear, endyear, 
-                  annual_cost_frac, 
-                  adjust_inflation, dividend_tax)
+    with metrics.timer("sandp"):
+        ret=sap500_end_value(usd_value, 
+                      startyear, endyear, 
+                      annual_cost_frac, 
+                      adjust_inflation, dividend_tax)
     usd_end_value=ret[0]
     #total_retun_frac=ret[1]
-    ratio_to_older_dollars = ret[2]
+    ratio_to_older_dollars = ret[2] # from the precomputed log CPI (see inflation_ratio)
     
-    xrate2=get_xrate(endyear,currency)
     ratio_to_older_local=ratio_to_older_dollars*xrate1/xrate2
     logging.debug(f"ratio_to_older_dollars{ratio_to_older_dollars}, xrate1 {xrate1}, xrate2 {xrate2}, xrate1/xrate2={xrate1/xrate2}")
     local_currency_end_value = usd_end_value*xrate2*(1-conversion_cost_frac)*ratio_to_older_local
@@ -170,13 +525,14 @@ def compare_investment(curr, bval, sval, byr, syr,
                                                                     dividend_tax,  
                                                                     conversion_cost_frac)
     
-    return_only_property_appreciation, \
-        totalreturn_property, \
-        value_from_property_income = get_property_return(
-            bval, sval, byr, syr, 
-            rental_income_frac=rental_income_frac, 
-            cost_fraction=rental_cost_fraction, 
-            selling_cost_fraction=selling_cost_fraction)
+    with metrics.timer("property"):
+        return_only_property_appreciation, \
+            totalreturn_property, \
+            value_from_property_income = get_property_return(
+                bval, sval, byr, syr, 
+                rental_income_frac=rental_income_frac, 
+                cost_fraction=rental_cost_fraction, 
+                selling_cost_fraction=selling_cost_fraction)
     
     propertyendvalue=value_from_property_income+sval*(1-selling_cost_fraction)
     propertyendvalue_inflation_adjusted=propertyendvalue*ratio_to_older_local
@@ -186,7 +542,37 @@ def compare_investment(curr, bval, sval, byr, syr,
     # FIX mistake (hack!)
     stock_local_currency_end_value=stock_usd_end_value*(1-conversion_cost_frac)*xrate2    
     
-    results=f"""
+    with metrics.timer("markdown"):
+        results=results_markdown(curr, bval, sval, byr, syr, 
+                                 rental_income_frac, rental_cost_fraction, conversion_cost_frac, 
+                                 annual_stock_cost_frac, dividend_tax, selling_cost_fraction, 
+                                 return_only_property_appreciation, totalreturn_property, 
+                                 value_from_property_income, propertyendvalue, 
+                                 propertyendvalue_inflation_adjusted, 
+                                 property_inflation_adjusted_annual_return, stock_local_currency_end_value, 
+                                 stock_annual_rate_in_local_currency, stock_usd_end_value, 
+                                 ratio_to_older_local, xrate1, xrate2)
+
+    return results, return_only_property_appreciation, totalreturn_property, \
+           value_from_property_income, propertyendvalue, \
+           propertyendvalue_inflation_adjusted, \
+           property_inflation_adjusted_annual_return, stock_local_currency_end_value, \
+           stock_annual_rate_in_local_currency, stock_usd_end_value,\
+           ratio_to_older_local,\
+           xrate1, xrate2       
+
+
+def results_markdown(curr, bval, sval, byr, syr, 
+                     rental_income_frac, rental_cost_fraction, conversion_cost_frac, 
+                     annual_stock_cost_frac, dividend_tax, selling_cost_fraction, 
+                     return_only_property_appreciation, totalreturn_property, 
+                     value_from_property_income, propertyendvalue, 
+                     propertyendvalue_inflation_adjusted, 
+                     property_inflation_adjusted_annual_return, stock_local_currency_end_value, 
+                     stock_annual_rate_in_local_currency, stock_usd_end_value, 
+                     ratio_to_older_local, xrate1, xrate2):
+    cpi=sandp_arrays().cpi
+    return f"""
     ## Property Investment
     
     1. Bought in {byr} for {bval} {curr}. (Assume no expenses at buying.)
@@ -201,7 +587,7 @@ def compare_investment(curr, bval, sval, byr, syr,
     * The total investment build-up upon selling the property {value_from_property_income+sval:.0f} {curr}. ({propertyendvalue:.0f} {curr} after selling cost.)
     * Total 'return on investment' (before "inflation" adjustment) is {totalreturn_property:.2%}
     * The USD.{curr}=x rate in {byr}={xrate1:.2f}, in {syr}={xrate2:.2f}.     
-    * The USD (in USA) consumer price index: {byr}={spdf.loc[byr]['CPI']}, {syr}={spdf.loc[syr]['CPI']}.
+    * The USD (in USA) consumer price index: {byr}={cpi[_year_pos(byr)]}, {syr}={cpi[_year_pos(syr)]}.
     * The factor to bring {syr} {curr} to {byr} {curr} is x{ratio_to_older_local:0.5f} (See 'small print' for the method)
     * The total return of {propertyendvalue:.0f} {curr} (Before adjusting for "inflation".) 
     * Ajusted for "inflation" (in {byr} {curr}) {propertyendvalue_inflation_adjusted:.0f} {curr}. Important Note: See 'small print' below. 
@@ -218,71 +604,323 @@ def compare_investment(curr, bval, sval, byr, syr,
     * Which will be (at USD.{curr}=x of {xrate2:.2f}), {stock_local_currency_end_value:.0f} {curr}, gross.
     * The 'inflation' adjsuted value is {stock_local_currency_end_value*ratio_to_older_local:.0f} {curr}.
     * This represents an net annual ("inflation" adjusted) return {curr} of {stock_annual_rate_in_local_currency:.2%}"""  
-   
 
-    return results, return_only_property_appreciation, totalreturn_property, \
-           value_from_property_income, propertyendvalue, \
-           propertyendvalue_inflation_adjusted, \
-           property_inflation_adjusted_annual_return, stock_local_currency_end_value, \
-           stock_annual_rate_in_local_currency, stock_usd_end_value,\
-           ratio_to_older_local,\
-           xrate1, xrate2       
 
+# names of the numeric values returned by compare_investment (after the Markdown)
+RESULT_COLUMNS = ['return_only_property_appreciation', 'totalreturn_property', 
+                  'value_from_property_income', 'propertyendvalue', 
+                  'propertyendvalue_inflation_adjusted', 
+                  'property_inflation_adjusted_annual_return', 'stock_local_currency_end_value', 
+                  'stock_annual_rate_in_local_currency', 'stock_usd_end_value', 
+                  'ratio_to_older_local', 'xrate1', 'xrate2']
+
+# compare_investment keyword arguments and their defaults, used for missing batch columns
+SCENARIO_DEFAULTS = {'rental_income_frac': 0.03, 
+                     'rental_cost_fraction': 0.25,
+                     'conversion_cost_frac': 0.02,
+                     'annual_stock_cost_frac': 0.0015, 
+                     'adjust_inflation': True, 
+                     'dividend_tax': 0.15, 
+                     'selling_cost_fraction': 0.05}
 
+def _year_positions(years):
+    # positions of years in sandp_arrays(), -1 where a year is missing
+    allyears=sandp_arrays().years
+    years=np.asarray(years, dtype=float)
+    years=np.where(np.isfinite(years), years, -1).astype(int)
+    pos=np.clip(np.searchsorted(allyears, years), 0, len(allyears)-1)
+    return np.where(allyears[pos] == years, pos, -1)
+
+def _compare_arrays(bval, sval, byr, years, ibyr, isyr, xrate1, xrate2, log_xrate_ratio, 
+                    rental_income_frac, rental_cost_fraction, conversion_cost_frac, 
+                    annual_stock_cost_frac, adjust_inflation, dividend_tax, selling_cost_fraction):
+    # the model of compare_investment on arrays (scalars broadcast), RESULT_COLUMNS as a dict; 
+    # ibyr, isyr are positions in sandp_arrays() and log_xrate_ratio is log(xrate1/xrate2)
+
+    # stock side: one cached total return index per distinct (expense ratio, dividend tax)
+    # (as complex numbers, a 1-d unique is much cheaper than one over the rows of a 2-d array)
+    costs, inverse=np.unique(np.asarray(annual_stock_cost_frac, dtype=float)+1j*np.asarray(dividend_tax, dtype=float), 
+                             return_inverse=True)
+    log_cpi=sandp_arrays().log_cpi
+    tri=np.vstack([accumulation_cache.get(cost.real, cost.imag) for cost in costs]) if len(costs) else np.empty((0, len(log_cpi)))
+    stock_usd_end_value=bval/xrate1*(1-conversion_cost_frac)*tri[inverse, isyr]/tri[inverse, ibyr]
+    # see local_inflation_ratio
+    ratio_to_older_local=np.exp(log_xrate_ratio+np.where(adjust_inflation, log_cpi[ibyr]-log_cpi[isyr], 0.0))
+    local_currency_end_value=stock_usd_end_value*xrate2*(1-conversion_cost_frac)*ratio_to_older_local
+    stock_annual_rate_in_local_currency=(local_currency_end_value/bval)**(1/years)-1
+    stock_local_currency_end_value=stock_usd_end_value*(1-conversion_cost_frac)*xrate2
+
+    # property side
+    return_only_property_appreciation, totalreturn_property, value_from_property_income = \
+        get_property_return_batch(bval, sval, byr, byr+years, 
+                                  rental_income_frac=rental_income_frac, 
+                                  cost_fraction=rental_cost_fraction, 
+                                  selling_cost_fraction=selling_cost_fraction)
+    propertyendvalue=value_from_property_income+sval*(1-selling_cost_fraction)
+    propertyendvalue_inflation_adjusted=propertyendvalue*ratio_to_older_local
+    property_inflation_adjusted_annual_return=(propertyendvalue_inflation_adjusted/bval)**(1/years)-1
+
+    return {'return_only_property_appreciation': return_only_property_appreciation, 
+            'totalreturn_property': totalreturn_property, 
+            'value_from_property_income': value_from_property_income, 
+            'propertyendvalue': propertyendvalue, 
+            'propertyendvalue_inflation_adjusted': propertyendvalue_inflation_adjusted, 
+            'property_inflation_adjusted_annual_return': property_inflation_adjusted_annual_return, 
+            'stock_local_currency_end_value': stock_local_currency_end_value, 
+            'stock_annual_rate_in_local_currency': stock_annual_rate_in_local_currency, 
+            'stock_usd_end_value': stock_usd_end_value, 
+            'ratio_to_older_local': ratio_to_older_local, 
+            'xrate1': xrate1, 
+            'xrate2': xrate2}
+
+def compare_investment_batch(scenarios, render_markdown=False, errors="raise"):
+    """compare_investment for many scenarios at once. 
+    
+    scenarios is a DataFrame (or dict of arrays) with the columns curr, bval, sval, byr, syr 
+    and optionally any keyword argument of compare_investment (see SCENARIO_DEFAULTS). 
+    Returns a DataFrame with RESULT_COLUMNS, one row per scenario (same index), 
+    plus a 'results' Markdown column when render_markdown is True. 
+    With errors="raise" a scenario without data raises DataNotAvailableError, with 
+    errors="coerce" its results are nan and the reason is given in an 'error' column."""
+    scenarios=pd.DataFrame(scenarios)
+    n=len(scenarios)
+    params={k: scenarios[k].to_numpy() if k in scenarios else np.full(n, v) 
+            for k, v in SCENARIO_DEFAULTS.items()}
+    curr=scenarios['curr'].astype(str).to_numpy()
+    bval=scenarios['bval'].to_numpy(dtype=float)
+    sval=scenarios['sval'].to_numpy(dtype=float)
+    byr=scenarios['byr'].to_numpy(dtype=float)
+    syr=scenarios['syr'].to_numpy(dtype=float)
+    rental_income_frac=params['rental_income_frac'].astype(float)
+    rental_cost_fraction=params['rental_cost_fraction'].astype(float)
+    conversion_cost_frac=params['conversion_cost_frac'].astype(float)
+    annual_stock_cost_frac=params['annual_stock_cost_frac'].astype(float)
+    adjust_inflation=params['adjust_inflation'].astype(bool)
+    dividend_tax=params['dividend_tax'].astype(float)
+    selling_cost_fraction=params['selling_cost_fraction'].astype(float)
+
+    error=np.full(n, None, dtype=object)
+    error[~(syr > byr)]="sell year must be after buy year"
+    ibyr=_year_positions(byr)
+    isyr=_year_positions(syr)
+    error[(ibyr < 0) | (isyr < 0)]="no S&P 500 data for these years"
+    matrix=rate_matrix()
+    cells1=matrix.cells(curr, byr)
+    cells2=matrix.cells(curr, syr)
+    xrate1=matrix.take(matrix.rates, cells1)
+    xrate2=matrix.take(matrix.rates, cells2)
+    no_rate=np.flatnonzero(np.isnan(xrate1) | np.isnan(xrate2))
+    error[no_rate]="no exchange rate for these years"
+    for i in no_rate:
+        if curr[i] not in matrix.code_index:
+            error[i]=f"unknown currency {curr[i]}"
+    bad=pd.notna(error)
+    if bad.any() and errors == "raise":
+        first=np.flatnonzero(bad)[0]
+        raise DataNotAvailableError(f"{error[first]}: {curr[first]} {byr[first]}-{syr[first]}")
+    ibyr[bad]=0
+    isyr[bad]=0
+    years=np.where(bad, np.nan, syr-byr)
+    log_xrate_ratio=matrix.take(matrix.log_rates, cells1)-matrix.take(matrix.log_rates, cells2)
+    out=pd.DataFrame(_compare_arrays(bval, sval, byr, years, ibyr, isyr, xrate1, xrate2, log_xrate_ratio, 
+                                     rental_income_frac=rental_income_frac, 
+                                     rental_cost_fraction=rental_cost_fraction, 
+                                     conversion_cost_frac=conversion_cost_frac, 
+                                     annual_stock_cost_frac=annual_stock_cost_frac, 
+                                     adjust_inflation=adjust_inflation, 
+                                     dividend_tax=dividend_tax, 
+                                     selling_cost_fraction=selling_cost_fraction), index=scenarios.index)
+    if bad.any():
+        out.loc[bad, :]=np.nan
+    if errors != "raise":
+        out['error']=error
+    if render_markdown:
+        inputs=pd.DataFrame({'curr': curr, 'bval': scenarios['bval'].to_numpy(), 
+                             'sval': scenarios['sval'].to_numpy(), 
+                             'byr': scenarios['byr'].to_numpy(), 'syr': scenarios['syr'].to_numpy(), 
+                             **params}, index=scenarios.index).drop(columns='adjust_inflation')
+        out['results']=[None if bad_ else results_markdown(**row_in, **row_out) 
+                         for bad_, row_in, row_out in zip(bad, inputs.to_dict('records'), 
+                                                          out[RESULT_COLUMNS].to_dict('records'))]
+    return out
+
+def currency_leaderboard(byr, syr, property_appreciation, bval=100000, **costs):
+    """One scenario for every currency with exchange rates in both years: a property bought 
+    for bval in byr that appreciates by property_appreciation (annual fraction, in local 
+    currency) until syr, against stocks. costs are keyword arguments of compare_investment 
+    (see SCENARIO_DEFAULTS). 
+    
+    Returns a DataFrame indexed by currency code with the currency name, 
+    property_inflation_adjusted_annual_return, stock_annual_rate_in_local_currency, 
+    ratio_to_older_local, xrate1, xrate2 and property_advantage (property minus stock 
+    annual return), best property first."""
+    matrix=rate_matrix()
+    columns=[int(year)-matrix.first_year for year in (byr, syr)]
+    if int(syr) <= int(byr) or not all(0 <= c < len(matrix.years) for c in columns) \
+            or _year_positions([byr, syr]).min() < 0:
+        raise DataNotAvailableError(f"no data for {byr}-{syr}")
+    # currencies with a rate in both years, straight from the currency x year matrix
+    covered=matrix.mask[:, columns[0]] & matrix.mask[:, columns[1]]
+    codes=np.asarray(matrix.codes)[covered]
+    scenarios=pd.DataFrame({'curr': codes, 'bval': float(bval), 
+                            'sval': bval*(1+property_appreciation)**(int(syr)-int(byr)), 
+                            'byr': int(byr), 'syr': int(syr), **costs})
+    out=compare_investment_batch(scenarios, errors="coerce").set_index(codes)
+    out=out[np.isfinite(out['ratio_to_older_local'].to_numpy(dtype=float))]
+    names={code: name for name, code in currencylist.items()}
+    board=pd.DataFrame({'currency': [names.get(code, code) for code in out.index]}, index=out.index)
+    for column in ('property_inflation_adjusted_annual_return', 'stock_annual_rate_in_local_currency', 
+                   'ratio_to_older_local', 'xrate1', 'xrate2'):
+        board[column]=out[column]
+    board['property_advantage']=board['property_inflation_adjusted_annual_return']-board['stock_annual_rate_in_local_currency']
+    board.index.name='code'
+    return board.sort_values('property_advantage', ascending=False)
+
+# change of each compare_investment keyword argument for sensitivity(); adjust_inflation 
+# is switched off and on instead
+SENSITIVITY_DELTAS = {'selling_cost_fraction': 0.01, 
+                      'rental_income_frac': 0.01, 
+                      'rental_cost_fraction': 0.05, 
+                      'annual_stock_cost_frac': 0.001, 
+                      'dividend_tax': 0.05, 
+                      'conversion_cost_frac': 0.01, 
+                      'adjust_inflation': None}
+
+SENSITIVITY_COLUMNS = pd.Index(['low', 'high', 'property_low', 'property_high', 'stocks_low', 'stocks_high'])
+
+@lru_cache(maxsize=8)
+def _parameter_index(names):
+    return pd.Index(names, name='parameter')
+
+def sensitivity(curr, bval, sval, byr, syr, deltas=SENSITIVITY_DELTAS, **params):
+    """Change of the annual returns of a compare_investment scenario when each keyword argument 
+    in deltas is moved down and up by its delta (not below 0), the others kept as in params 
+    (see SCENARIO_DEFAULTS). The base and all the changed scenarios are evaluated together by 
+    the array model of compare_investment_batch, without its DataFrames. 
+    
+    Returns a DataFrame indexed by parameter with the low and high values (0 and 1 for a 
+    switch) and the changes (low minus base, high minus base) of 
+    property_inflation_adjusted_annual_return (property_low, property_high) and 
+    stock_annual_rate_in_local_currency (stocks_low, stocks_high), largest total change 
+    first. Raises DataNotAvailableError when the scenario has no data."""
+    if not int(syr) > int(byr):
+        raise DataNotAvailableError(f"sell year must be after buy year: {curr} {byr}-{syr}")
+    try:
+        ibyr, isyr=_year_pos(byr), _year_pos(syr)
+        matrix=rate_matrix()
+        log_xrate1, log_xrate2=matrix.log_rate(curr, byr), matrix.log_rate(curr, syr)
+    except KeyError:
+        raise DataNotAvailableError(f"no data for these years: {curr} {byr}-{syr}")
+    base={**SCENARIO_DEFAULTS, **params}
+    names=list(deltas)
+    n=1+2*len(names)
+    # row 0 is the base, rows 2i+1 and 2i+2 move parameter i down and up
+    columns=list(base)
+    values=np.tile(np.array([float(v) for v in base.values()]), (n, 1))
+    low, high=[], []
+    for i, name in enumerate(names):
+        if deltas[name] is None: # a switch
+            low.append(False), high.append(True)
+        else:
+            low.append(max(base[name]-deltas[name], 0.0)), high.append(base[name]+deltas[name])
+        values[2*i+1:2*i+3, columns.index(name)]=low[-1], high[-1]
+    p=dict(zip(columns, values.T))
+    p['adjust_inflation']=p['adjust_inflation'].astype(bool)
+    out=_compare_arrays(float(bval), float(sval), int(byr), int(syr)-int(byr), ibyr, isyr, 
+                        math.exp(log_xrate1), math.exp(log_xrate2), log_xrate1-log_xrate2, **p)
+    prop, stocks=out['property_inflation_adjusted_annual_return'], out['stock_annual_rate_in_local_currency']
+
+    returns=np.array([prop, stocks])
+    # changes[side, parameter, low/high]
+    changes=(returns[:, 1:]-returns[:, :1]).reshape(2, len(names), 2)
+    order=np.argsort(-np.abs(changes[:, :, 1]-changes[:, :, 0]).sum(axis=0), kind='stable')
+    table=np.column_stack([low, high, changes.transpose(1, 0, 2).reshape(len(names), 4)])
+    # one float block, building a DataFrame column by column costs more than the computation
+    return pd.DataFrame(table[order], columns=SENSITIVITY_COLUMNS, index=_parameter_index(tuple(names)).take(order))
+
+
+def currency_payload(currency):
+    """The yearly data compare_investment needs for a currency, as lists for JSON: the S&P 500 
+    years, DividendYield_percent, Value and CPI, and the exchange rates of currency for the 
+    same years (None where there is none), from the first to the last year with a rate. 
+    assets/clientside.js computes the results from it in the browser. Raises 
+    DataNotAvailableError for a currency without exchange rates."""
+    sandp=sandp_arrays()
+    xrates=lookup_rates(np.full(len(sandp.years), currency), sandp.years)
+    known=np.flatnonzero(~np.isnan(xrates))
+    if not len(known):
+        raise DataNotAvailableError(f"no exchange rates for {currency}")
+    span=slice(known[0], known[-1]+1) # only the years with exchange rates can be used
+    return {'currency': currency, 
+            'years': [int(y) for y in sandp.years[span]], 
+            'dividend': sandp.dividend[span].tolist(), 
+            'value': sandp.value[span].tolist(), 
+            'cpi': sandp.cpi[span].tolist(), 
+            'xrate': [None if np.isnan(x) else float(x) for x in xrates[span]]}
        
     
     
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Update the S&P 500 table, or print an example comparison")
+    parser.add_argument("--sandp", metavar="CSV", 
+                        help="new or corrected rows (Year,DividendYield_percent,Value,CPI) for s_and_p_500.csv, "
+                             "the data bundle is rebuilt")
+    args = parser.parse_args()
     logging.basicConfig(level=logging.DEBUG)
-    #ret=get_return_value_in_local(1000, "LKR", 2001, 2021, 
-    #                                  annual_cost_frac=0.15/100, 
-    #                                  dividend_tax=0.15,
-    #                                  conversion_cost_frac=.02)    
-    #print(ret)
-    curr='LKR'
-    bval=23000000
-    sval=46000000
-    byr=2005
-    syr=2021
-    rental_income_frac=0.03
-    rental_cost_fraction=0.25
-    annual_stock_cost_frac=0.0015
-    dividend_tax=0.15
-    conversion_cost_frac=0.02
-    selling_cost_fraction=0.05
-    results, return_only_property_appreciation, \
-        totalreturn_property, \
-        value_from_property_income,\
-        total_property_value, \
-        propertyendvalue_inflation_adjusted, \
-        property_inflation_adjusted_annual_return, \
-        stock_local_currency_end_value, \
-        stock_annual_rate_in_local_currency, \
-        stock_usd_end_value,\
-        ratio_to_older_local,\
-        xrate1, xrate2 = compare_investment(curr, bval, sval, byr, syr, rental_income_frac=rental_income_frac, 
-                    rental_cost_fraction=rental_cost_fraction,
-                    annual_stock_cost_frac=annual_stock_cost_frac, dividend_tax=dividend_tax, conversion_cost_frac=conversion_cost_frac,
-                    selling_cost_fraction=selling_cost_fraction)
-
-    print(results)
+    if args.sandp:
+        print(update_sandp(pd.read_csv(args.sandp)))
+        dataBundle.build_bundle()
+    else:
+        #ret=get_return_value_in_local(1000, "LKR", 2001, 2021, 
+        #                                  annual_cost_frac=0.15/100, 
+        #                                  dividend_tax=0.15,
+        #                                  conversion_cost_frac=.02)    
+        #print(ret)
+        curr='LKR'
+        bval=23000000
+        sval=46000000
+        byr=2005
+        syr=2021
+        rental_income_frac=0.03
+        rental_cost_fraction=0.25
+        annual_stock_cost_frac=0.0015
+        dividend_tax=0.15
+        conversion_cost_frac=0.02
+        selling_cost_fraction=0.05
+        results, return_only_property_appreciation, \
+            totalreturn_property, \
+            value_from_property_income,\
+            total_property_value, \
+            propertyendvalue_inflation_adjusted, \
+            property_inflation_adjusted_annual_return, \
+            stock_local_currency_end_value, \
+            stock_annual_rate_in_local_currency, \
+            stock_usd_end_value,\
+            ratio_to_older_local,\
+            xrate1, xrate2 = compare_investment(curr, bval, sval, byr, syr, rental_income_frac=rental_income_frac, 
+                        rental_cost_fraction=rental_cost_fraction,
+                        annual_stock_cost_frac=annual_stock_cost_frac, dividend_tax=dividend_tax, conversion_cost_frac=conversion_cost_frac,
+                        selling_cost_fraction=selling_cost_fraction)
+
+        print(results)
     
-    #ret=get_property_return(1000,2000,2001,2011,)
-    # ret=get_return_value_in_local(1000, "LKR", 2001, 2021, 
-    #                               annual_cost_frac=0.15/100, 
-    #                               dividend_tax=0.15,
-    #                               conversion_cost_frac=.02)
-    # print(ret)
-    # ev = sap500_end_value(1000, adjust_inflation=False)
-    # print("Final value: {}, return on invstment {:.2%}".format(*ev))
-    # ev = get_end_value(1000, adjust_inflation=True)
-    # print("Final value: {}, return on invstment {:.2%}".format(*ev))
-    # ev = get_end_value(1000, adjust_inflation=True, 
-    #                    annual_cost_frac=0.25/100)
-    # print("Final value: {}, return on invstment {:.2%}".format(*ev))
-    # ev = get_end_value(1000, startyear=2001, endyear=2021, 
-    #                    adjust_inflation=True, annual_cost_frac=0.25/100, dividend_tax=0.15)
-    # print("Final value: {}, return on invstment {:.2%}".format(*ev))
-    # ret=get_xrate(2021,'LKR')
-    # print(ret)
\ No newline at end of file
+        #ret=get_property_return(1000,2000,2001,2011,)
+        # ret=get_return_value_in_local(1000, "LKR", 2001, 2021, 
+        #                               annual_cost_frac=0.15/100, 
+        #                               dividend_tax=0.15,
+        #                               conversion_cost_frac=.02)
+        # print(ret)
+        # ev = sap500_end_value(1000, adjust_inflation=False)
+        # print("Final value: {}, return on invstment {:.2%}".format(*ev))
+        # ev = get_end_value(1000, adjust_inflation=True)
+        # print("Final value: {}, return on invstment {:.2%}".format(*ev))
+        # ev = get_end_value(1000, adjust_inflation=True, 
+        #                    annual_cost_frac=0.25/100)
+        # print("Final value: {}, return on invstment {:.2%}".format(*ev))
+        # ev = get_end_value(1000, startyear=2001, endyear=2021, 
+        #                    adjust_inflation=True, annual_cost_frac=0.25/100, dividend_tax=0.15)
+        # print("Final value: {}, return on invstment {:.2%}".format(*ev))
+        # ret=get_xrate(2021,'LKR')
+        # print(ret)
\ No newline at end of file
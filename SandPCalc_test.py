@@ -1,7 +1,10 @@
 import pytest
+import numpy as np
 
 from SandPCalc import *
-from readExchangeRates import get_rates
+from SandPCalc import spdf # loaded on first use, not part of import *
+import readExchangeRates
+from readExchangeRates import get_rates, get_range, lookup_rates
 
 def test_currency_list():
     assert currencylist['Afghani']  == 'AFN'
@@ -9,6 +12,13 @@ def test_currency_list():
     assert currencylist['CFA Franc BCEAO']  == 'XOF'
     assert currencylist['US Dollar'] == 'USD'
 
+def test_lazy_loading():
+    import subprocess, sys
+    code=("import sys, SandPCalc, readExchangeRates as rer; "
+          "print(SandPCalc._spdf is None, rer.currencylist._data is None, rer._con is None, rer._rate_matrix is None)")
+    out=subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert out.split() == ["True"]*4
+
 def test_no_inflation():
     ret=sap500_end_value(1000, startyear=2001, endyear=2021, adjust_inflation=False)
     print(ret)
@@ -29,6 +39,39 @@ def test_with_inflation_cost_and_dividend_tax():
     print(ret)
     assert ret == pytest.approx([3738.37, 148.23/100., 0.664], rel=.001)
 
+def test_accumulation_index_matches_calc_ret():
+    # the original per-year loop of calc_ret
+    myspdf=spdf.copy()
+    endvalue=[1./myspdf['Value'].iloc[0]]
+    for dividend in myspdf['DividendYield_percent'].iloc[1:]:
+        endvalue.append(endvalue[-1]*(1+dividend*(1-0.15))*(1-0.25/100))
+    ret=accumulation_index(annual_cost_frac=0.25/100, dividend_tax=0.15)
+    assert ret == pytest.approx(endvalue, rel=1e-12)
+    calc_ret(myspdf, annual_cost_frac=0.25/100, dividend_tax=0.15)
+    assert myspdf['endvalue'].to_numpy() == pytest.approx(endvalue, rel=1e-12)
+    assert spdf['endvalue'].isna().all() # sap500_end_value no longer writes into spdf
+
+def test_accumulation_index_batch():
+    costs=[0.0, 0.15/100, 0.25/100]
+    taxes=[0.0, 0.15, 0.30]
+    ret=accumulation_index_batch(costs, taxes)
+    assert ret.shape == (3, len(spdf))
+    for row, cost, tax in zip(ret, costs, taxes):
+        assert row == pytest.approx(accumulation_index(cost, tax), rel=1e-12)
+    assert accumulation_index_batch([0.0, 0.01], 0.15).shape == (2, len(spdf))
+
+def test_accumulation_cache():
+    cache=AccumulationCache(maxsize=2)
+    first=cache.get(0.25/100, 0.15)
+    assert cache.get(0.25/100, 0.15) is first
+    assert first == pytest.approx(accumulation_index(0.25/100, 0.15)*spdf['Value'].to_numpy(), rel=1e-12)
+    cache.get(0.0, 0.0)
+    cache.get(0.0, 0.15) # evicts (0.0025, 0.15), the least recently used
+    assert cache.stats() == {"hits": 1, "misses": 3, "size": 2, "maxsize": 2}
+    assert cache.get(0.25/100, 0.15) is not first
+    with pytest.raises(ValueError):
+        first[0] = 0.0
+
 @pytest.mark.xrate 
 def test_get_xrate():
     ret=get_xrate(2005,'LKR')
@@ -53,6 +96,19 @@ def test_gross_return():
 def test_rental():
     ret=get_property_return(1000,2000,2001,2011, rental_income_frac=0.03, cost_fraction=0.25)
     assert ret == pytest.approx ((0.06629, 0.08970, 460.9819), rel=0.001)
+
+@pytest.mark.trent
+def test_rental_batch():
+    bval=np.array([1000., 23000000., 500., 1000.])
+    sval=np.array([2000., 50000000., 400., 1100.])
+    byr=np.array([2001, 2005, 1990, 2020])
+    syr=np.array([2011, 2021, 2020, 2021])
+    rfrac=np.array([0.03, 0.03, 0.05, 0.0])
+    rcost=np.array([0.25, 0.25, 0.4, 0.25])
+    ret=get_property_return_batch(bval, sval, byr, syr, rental_income_frac=rfrac, cost_fraction=rcost)
+    for i in range(len(bval)):
+        expected=get_property_return(bval[i], sval[i], byr[i], syr[i], rental_income_frac=rfrac[i], cost_fraction=rcost[i])
+        assert [r[i] for r in ret] == pytest.approx(expected, rel=1e-9)
     
 @pytest.mark.trent
 def test_exchange_and_invest():
@@ -97,11 +153,211 @@ def test_compare_investment():
     assert propertyendvalue == pytest.approx(65803938, rel=0.001)
     assert len(results) > 1000
     
+@pytest.mark.integrated
+def test_compare_investment_batch():
+    scenarios=pd.DataFrame({'curr': ['LKR', 'LKR', 'EUR', 'INR'], 
+                            'bval': [23000000, 100000, 100000, 5000000], 
+                            'sval': [50000000, 200000, 150000, 9000000], 
+                            'byr': [2005, 2001, 2002, 1990], 
+                            'syr': [2021, 2021, 2020, 2015], 
+                            'annual_stock_cost_frac': [0.015, 0.0015, 0.0015, 0.0025], 
+                            'adjust_inflation': [True, True, False, True]})
+    ret=compare_investment_batch(scenarios, render_markdown=True)
+    assert list(ret.columns) == RESULT_COLUMNS+['results']
+    for i, row in scenarios.iterrows():
+        expected=compare_investment(**row)
+        assert ret.loc[i, RESULT_COLUMNS].to_numpy(dtype=float) == pytest.approx(expected[1:], rel=1e-9)
+        assert ret.loc[i, 'results'] == expected[0]
+
+@pytest.mark.integrated
+def test_holding_period_matrix():
+    years, stock_rates, ratios=holding_period_matrix('LKR', annual_cost_frac=0.15/100, dividend_tax=0.15, 
+                                                     conversion_cost_frac=.02)
+    years=list(years)
+    for byr, syr in [(2001, 2021), (1990, 1991), (1965, 2020)]:
+        ret=get_return_value_in_local(1000, "LKR", byr, syr, annual_cost_frac=0.15/100, adjust_inflation=True, 
+                                      dividend_tax=0.15, conversion_cost_frac=.02)
+        assert stock_rates[years.index(byr), years.index(syr)] == pytest.approx(ret[1], rel=1e-9)
+        assert ratios[years.index(byr), years.index(syr)] == pytest.approx(ret[3], rel=1e-9)
+    assert np.isnan(stock_rates[years.index(2005), years.index(2005)])
+    assert np.isnan(stock_rates[years.index(2021), years.index(2005)])
+
+@pytest.mark.integrated
+def test_concurrent_scenarios(monkeypatch):
+    import random
+    import SandPCalc
+    from concurrent.futures import ThreadPoolExecutor
+    # a tiny cache, so threads keep evicting and recomputing each other's series
+    monkeypatch.setattr(SandPCalc, 'accumulation_cache', AccumulationCache(maxsize=2))
+    rng=random.Random(13)
+    scenarios=[]
+    for _ in range(300):
+        byr=rng.randint(1995, 2019)
+        scenarios.append(dict(curr=rng.choice(['LKR', 'EUR', 'INR', 'AUD']), bval=rng.choice([1e5, 2.3e7]), 
+                              sval=rng.choice([2e5, 5e7]), byr=byr, syr=rng.randint(byr+1, 2020), 
+                              annual_stock_cost_frac=rng.choice([0, 0.0015, 0.01, 0.02]), 
+                              dividend_tax=rng.choice([0, 0.15, 0.3]), 
+                              adjust_inflation=rng.choice([True, False])))
+    serial=[compare_investment(**s) for s in scenarios]
+    SandPCalc.accumulation_cache.clear()
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        concurrent=list(pool.map(lambda s: compare_investment(**s), scenarios))
+    assert concurrent == serial
+
+@pytest.mark.integrated
+def test_rolling_returns():
+    rolling=rolling_returns('LKR', 16, annual_cost_frac=0.15/100, dividend_tax=0.15)
+    years, stock_rates, ratios=holding_period_matrix('LKR', annual_cost_frac=0.15/100, dividend_tax=0.15)
+    years=list(years)
+    for byr in (1960, 1990, 2005):
+        assert rolling.loc[byr, 'total_stock_return_rate'] == pytest.approx(stock_rates[years.index(byr), years.index(byr+16)], rel=1e-9)
+        assert rolling.loc[byr, 'ratio_to_older_local'] == pytest.approx(ratios[years.index(byr), years.index(byr+16)], rel=1e-9)
+    assert rolling.index.max()+16 == max(years)
+    assert rolling_returns('LKR', 0).empty
+
+def test_inflation_ratios():
+    cpi=spdf['CPI']
+    assert inflation_ratio(2001, 2021) == pytest.approx(cpi[2001]/cpi[2021], rel=1e-12)
+    assert inflation_calc(2001, 2021) == inflation_ratio(2001, 2021)
+    with pytest.raises(KeyError):
+        inflation_ratio(1800, 2021)
+    ratios=inflation_ratio_batch([2001, 1990, 1800], [2021, 2000, 2021])
+    assert ratios[:2] == pytest.approx([cpi[2001]/cpi[2021], cpi[1990]/cpi[2000]], rel=1e-12)
+    assert np.isnan(ratios[2])
+    local=local_inflation_ratio('LKR', 2001, 2021)
+    assert local == pytest.approx(cpi[2001]/cpi[2021]*get_rate('LKR', 2001)/get_rate('LKR', 2021), rel=1e-12)
+    assert local_inflation_ratio('LKR', 2001, 2021, adjust_inflation=False) == pytest.approx(
+        get_rate('LKR', 2001)/get_rate('LKR', 2021), rel=1e-12)
+    batch=local_inflation_ratio_batch(['LKR', 'LKR', 'XXX'], [2001, 2001, 2001], [2021, 2021, 2021], 
+                                      adjust_inflation=[True, False, True])
+    assert batch[0] == pytest.approx(local, rel=1e-12)
+    assert batch[1] == pytest.approx(local_inflation_ratio('LKR', 2001, 2021, adjust_inflation=False), rel=1e-12)
+    assert np.isnan(batch[2])
+
+@pytest.mark.integrated
+def test_currency_leaderboard():
+    board=currency_leaderboard(2005, 2021, 0.05, bval=100000, annual_stock_cost_frac=0.002)
+    assert board['property_advantage'].is_monotonic_decreasing
+    assert 'EUR' in board.index and 'LKR' in board.index
+    assert board.loc['LKR', 'currency'] == 'Sri Lanka Rupee'
+    expected=compare_investment('LKR', 100000, 100000*1.05**16, 2005, 2021, annual_stock_cost_frac=0.002)
+    assert board.loc['LKR', 'property_inflation_adjusted_annual_return'] == pytest.approx(expected[6], rel=1e-9)
+    assert board.loc['LKR', 'stock_annual_rate_in_local_currency'] == pytest.approx(expected[8], rel=1e-9)
+    with pytest.raises(DataNotAvailableError):
+        currency_leaderboard(2021, 2005, 0.05)
+
+@pytest.mark.integrated
+def test_break_even_sell_price():
+    # closed forms (one year, no rent) and Newton
+    for byr, syr, rent in [(2020, 2021, 0.03), (2001, 2021, 0.0), (2005, 2021, 0.03), (1990, 1992, 0.05)]:
+        sval=break_even_sell_price('LKR', 100000, byr, syr, rental_income_frac=rent)
+        ret=compare_investment('LKR', 100000, sval, byr, syr, rental_income_frac=rent)
+        assert ret[6] == pytest.approx(ret[8], abs=1e-12)
+    years, prices=break_even_surface('LKR', 100000)
+    years=list(years)
+    assert prices[years.index(2005), years.index(2021)] == pytest.approx(break_even_sell_price('LKR', 100000, 2005, 2021), rel=1e-9)
+    assert np.isnan(prices[years.index(2021), years.index(2005)])
+
+@pytest.mark.integrated
+def test_sensitivity():
+    table=sensitivity('LKR', 100000, 200000, 2005, 2021, dividend_tax=0.02)
+    assert set(table.index) == set(SENSITIVITY_DELTAS)
+    base=compare_investment('LKR', 100000, 200000, 2005, 2021, dividend_tax=0.02)
+    low=compare_investment('LKR', 100000, 200000, 2005, 2021, dividend_tax=0.0)
+    assert table.loc['dividend_tax', 'low'] == 0.0
+    assert table.loc['dividend_tax', 'stocks_low'] == pytest.approx(low[8]-base[8], rel=1e-9)
+    assert table.loc['dividend_tax', 'property_low'] == 0.0
+    high=compare_investment('LKR', 100000, 200000, 2005, 2021, dividend_tax=0.02, rental_income_frac=0.04)
+    assert table.loc['rental_income_frac', 'property_high'] == pytest.approx(high[6]-base[6], rel=1e-9)
+    off=compare_investment('LKR', 100000, 200000, 2005, 2021, dividend_tax=0.02, adjust_inflation=False)
+    assert table.loc['adjust_inflation', 'property_low'] == pytest.approx(off[6]-base[6], rel=1e-9)
+    assert table.loc['adjust_inflation', 'stocks_high'] == 0.0
+    with pytest.raises(DataNotAvailableError):
+        sensitivity('LKR', 100000, 200000, 2021, 2005)
+
+def test_compare_investment_batch_errors():
+    scenarios={'curr': ['LKR', 'LKR', 'XXX'], 'bval': [100000]*3, 'sval': [200000]*3, 
+               'byr': [2001, 2021, 2001], 'syr': [2021, 2001, 2021]}
+    with pytest.raises(DataNotAvailableError):
+        compare_investment_batch(scenarios)
+    ret=compare_investment_batch(scenarios, errors="coerce")
+    assert ret['error'][0] is None
+    assert ret['error'][1] == "sell year must be after buy year"
+    assert ret['error'][2] == "unknown currency XXX"
+    assert ret.loc[1:, RESULT_COLUMNS].isna().all().all()
+
 def test_exchange_rate_df():
     df=get_rates('LKR',1998,2021)
     assert df.sum()[0] == pytest.approx(44209, rel=0.001)
     assert df.sum()[1] == pytest.approx(2641, rel=0.001)
 
+def test_rate_matrix_lookups():
+    assert get_rate('LKR', 2005) == pytest.approx(100.44, rel=0.001)
+    assert get_rate('LKR', '2005') == get_rate('LKR', 2005)
+    with pytest.raises(KeyError):
+        get_rate('LKR', 1881)
+    years=get_range('LKR')
+    assert years == sorted(years) and 2005 in years
+    ret=lookup_rates(['LKR', 'XXX', 'LKR', 'EUR'], [2005, 2005, 1881, 2010])
+    assert ret[0] == get_rate('LKR', 2005)
+    assert np.isnan(ret[1]) and np.isnan(ret[2])
+    assert ret[3] == get_rate('EUR', 2010)
+
+def test_rate_matrix_reloads_on_change(tmp_path, monkeypatch):
+    import shutil, os
+    database=str(tmp_path/"XRATES.db")
+    shutil.copy(readExchangeRates.DATABASE, database)
+    monkeypatch.setattr(readExchangeRates, "DATABASE", database)
+    monkeypatch.setattr(readExchangeRates, "MTIME_CHECK_INTERVAL", 0.0)
+    monkeypatch.setattr(readExchangeRates, "_rate_matrix", None)
+    assert get_rate('LKR', 2005) == pytest.approx(100.44, rel=0.001)
+    con=readExchangeRates.sqlite3.connect(database)
+    con.execute("UPDATE xrates SET rate=1.5 WHERE curr='LKR' AND year=2005")
+    con.commit()
+    con.close()
+    os.utime(database, (0, os.path.getmtime(database)+10))
+    assert get_rate('LKR', 2005) == 1.5
+
+def test_read_pool_queries():
+    assert readExchangeRates.fetch_rate('LKR', 2005) == get_rate('LKR', 2005)
+    assert readExchangeRates.fetch_range('LKR') == get_range('LKR')
+    assert readExchangeRates.fetch_rates('LKR', 1998, 2021).equals(get_rates('LKR', 1998, 2021))
+    pairs=[('LKR', 2005), ('XXX', 2005)]+[('EUR', y) for y in range(1990, 2021)]*20
+    ret=readExchangeRates.fetch_rate_pairs(pairs)
+    assert len(ret) == len(pairs)
+    assert ret[0] == get_rate('LKR', 2005) and ret[1] is None
+    assert ret[-1] == get_rate('EUR', 2020)
+    with pytest.raises(readExchangeRates.sqlite3.OperationalError):
+        readExchangeRates.read_pool().execute("DELETE FROM xrates")
+
+def test_year_pos_with_a_gap(monkeypatch):
+    import SandPCalc
+    arrays=SandPCalc.sandp_arrays()
+    years=np.array([2000, 2001, 2003, 2004])
+    monkeypatch.setattr(SandPCalc, "_sandp_arrays", arrays._replace(years=years))
+    assert [SandPCalc._year_pos(y) for y in (2000, 2003, 2004)] == [0, 2, 3]
+    for year in (1999, 2002, 2005):
+        with pytest.raises(KeyError):
+            SandPCalc._year_pos(year)
+
+def test_read_pool_immutable():
+    assert "immutable" not in readExchangeRates.ReadOnlyPool("x.db")._uri() # the file can be refreshed in place
+    assert readExchangeRates.ReadOnlyPool("x.db", immutable=True)._uri().endswith("?mode=ro&immutable=1")
+
+def test_update_sandp(tmp_path):
+    import shutil
+    path=str(tmp_path/"s_and_p_500.csv")
+    shutil.copy(SANDP_CSV, path)
+    original=open(path).read().splitlines()
+    new_rows=pd.DataFrame({'Year': [2021, 2022, 2023], 'DividendYield_percent': [0.0137, 0.0171, 0.015], 
+                           'Value': [3793.75, 4530.0, 4100.0], 'CPI': [263.70, 287.71, 300.0]})
+    assert update_sandp(new_rows, path) == 2 # 2021 unchanged, 2022 corrected, 2023 added
+    lines=open(path).read().splitlines()
+    assert lines[:-2] == original[:-1]
+    assert lines[-2:] == ["2022,0.0171,4530.0,287.71", "2023,0.015,4100.0,300.0"]
+    assert read_sandp(path).loc[2023, 'Value'] == 4100.0
+    assert update_sandp(new_rows, path) == 0
+
 
 if __name__=="__main__":
     #pytest.main()
@@ -1,19 +1,28 @@
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
 import dash_bootstrap_components as dbc
+import dash_table
 from dash.dependencies import Input, Output
-from dash_extensions.enrich import MultiplexerTransform, DashProxy
+from dash_extensions.enrich import DashProxy
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import plotly.express as px
 
 import readExchangeRates as rer
 import SandPCalc as sap
 import logging
+import json
+import math
+import time
+import uuid
 from urllib.parse import urlparse, parse_qs
 
+from flask import has_request_context, request, Response
+
+import metrics
+import monteCarlo
+import resultCache
+
 
 # ############ Initialize app ############
 
@@ -21,11 +30,32 @@ fontawe='https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.15.3/css/all.min.
 
 app = DashProxy(__name__, 
                 external_stylesheets=[dbc.themes.BOOTSTRAP, fontawe], 
-                transforms=[MultiplexerTransform()],
                 title="Property vs Stock Market")
 server = app.server
+metrics.install(server)
 
-currencies=[{"label":f"{y} ({x})", "value":y} for x,y in rer.currencylist.items()]
+# rendered results of update_results, keyed by the normalized inputs
+result_cache = resultCache.from_environment()
+metrics.register_cache("results", result_cache.stats)
+# numbers of API scenarios, apart so large API requests don't evict the rendered UI results
+number_cache = resultCache.from_environment("NUMBER_CACHE", maxsize=4096)
+metrics.register_cache("numbers", number_cache.stats)
+single_flight = resultCache.SingleFlight()
+metrics.register_cache("single_flight", single_flight.stats)
+# names of the inputs in the share URL, in the order of the update_results arguments
+URL_PARAMETERS = ['curr', 'byr', 'bval', 'syr', 'sval', 'scost', 'rfrac', 'rcost', 'ascf', 'sdt', 'ccf']
+# values of the inputs with a default (percentages, as entered)
+INPUT_DEFAULTS = {'scost': 5, 'rfrac': 3, 'rcost': 25, 'ascf': 0.15, 'sdt': 15, 'ccf': 2}
+# bootstrapped paths behind the "Simulated Outcomes" section (seeded, so results can be cached)
+SIMULATION_PATHS = 10000
+# sap.sensitivity() parameters as labelled in the tornado chart
+SENSITIVITY_LABELS = {'selling_cost_fraction': "Selling costs ±1%", 
+                      'rental_income_frac': "Income ±1%", 
+                      'rental_cost_fraction': "Costs ±5% of income", 
+                      'annual_stock_cost_frac': "Stock expense ratio ±0.1%", 
+                      'dividend_tax': "Stock dividend tax ±5%", 
+                      'conversion_cost_frac': "Forex mark-up ±1%", 
+                      'adjust_inflation': '"Inflation" adjustment off'}
 
 def CustomDropdown(id, options, label, **kwargs):
     return dbc.Card(
@@ -55,26 +85,31 @@ def CustomNumInput(id, value, label,  **kwargs):
             type="number",
             #placeholder="",
             value=value,
+            debounce=True, # update on enter or leaving the field, not on every key
             **kwargs,
             ),
         ],)
         ]
     )    
 
-controls = [
-    CustomDropdown('curr', currencies, "Currency", value="LKR"),   
-    CustomDropdown('byr', [], "Bought in"),  
-    CustomNumInput('bval', 100000, "Bought for"),    
-    CustomDropdown('syr', [], "Sold in"),   
-    CustomNumInput('sval', 200000, "Sold for"),  
-    CustomNumInput('scost', 5, "Selling costs(%)"),
-    CustomNumInput('rfrac', 3, "Income (% value)"),
-    CustomNumInput('rcost', 25, "Costs (% Income)"),
-    CustomNumInput('ascf', 0.15, "Stock expense ratio(%)"),
-    CustomNumInput('sdt', 15, "Stock dividend tax(%)"),
-    CustomNumInput('ccf', 2, "Forex mark-up(%)"),
-    #CustomNumInput('divi', 5, "Stock dividend tax(%)"),
-]
+def make_controls():
+    # the (lazily loaded) currency list is read when the layout is built, which Dash first
+    # does at import to validate the layout function
+    currencies=[{"label":f"{y} ({x})", "value":y} for x,y in rer.currencylist.items()]
+    return [
+        CustomDropdown('curr', currencies, "Currency", value="LKR"),   
+        CustomDropdown('byr', [], "Bought in"),  
+        CustomNumInput('bval', 100000, "Bought for"),    
+        CustomDropdown('syr', [], "Sold in"),   
+        CustomNumInput('sval', 200000, "Sold for"),  
+        CustomNumInput('scost', INPUT_DEFAULTS['scost'], "Selling costs(%)"),
+        CustomNumInput('rfrac', INPUT_DEFAULTS['rfrac'], "Income (% value)"),
+        CustomNumInput('rcost', INPUT_DEFAULTS['rcost'], "Costs (% Income)"),
+        CustomNumInput('ascf', INPUT_DEFAULTS['ascf'], "Stock expense ratio(%)"),
+        CustomNumInput('sdt', INPUT_DEFAULTS['sdt'], "Stock dividend tax(%)"),
+        CustomNumInput('ccf', INPUT_DEFAULTS['ccf'], "Forex mark-up(%)"),
+        #CustomNumInput('divi', 5, "Stock dividend tax(%)"),
+    ]
 
 def card_placeholder(id_,label):
     return dbc.Card(
@@ -90,6 +125,12 @@ def card_placeholder(id_,label):
 
 results=[card_placeholder("left", "The Story"),
          card_placeholder("right", "In Graphics")]
+
+# the same, computed in the browser (see assets/clientside.js)
+client_results=[dbc.Card([dbc.CardHeader("The Story"), dbc.CardBody(dcc.Markdown(id="client-markdown"))]),
+                dbc.Card([dbc.CardHeader("In Graphics"), 
+                          dbc.CardBody([dbc.Row(dbc.Card(dcc.Graph(id="client-fig1"))), 
+                                        dbc.Row(dbc.Card(dcc.Graph(id="client-fig2")))])])]
          
          
 ack=dcc.Markdown("""
@@ -126,20 +167,35 @@ headerdiv=dbc.Row([
                 ], justify='between')
 
 
-app.layout = dbc.Container([
-    dcc.Location(id="url", refresh=False),
-    dbc.Row(dbc.Col(dbc.CardGroup([dbc.Card(headerdiv)]), width=12), className="m-2"),
-    dbc.Row(dbc.Col(dbc.CardGroup(controls[0:1]), width=12), className="m-2") ,   
-    dbc.Row(dbc.Col(dbc.CardGroup(controls[1:3]), width=12), className="m-2") ,   
-    dbc.Row(dbc.Col(dbc.CardGroup(controls[3:5]), width=12), className="m-2") ,   
-    dbc.Row(dbc.Col(advbut, width="auto")),
-    dbc.Collapse([
-        dbc.Row(dbc.Col(dbc.CardGroup(controls[5:]), width=12), className="m-2") ,  
-        dbc.Row(dbc.Col(dbc.CardGroup([dbc.Input(id='urllabel', disabled=True)],),  width=12), className="m-2")
-        ], is_open=False, id="advanced",),
-    dbc.Row(dbc.Col(dbc.CardGroup(results), width=12), className="m-2"),
-    dbc.Row(dbc.Col(dbc.CardGroup(acknowlegements), width=12), className="m-2")
-], )
+def serve_layout():
+    controls=make_controls()
+    if has_request_context(): # not for the call validating the layout at import
+        metrics.count("page_views")
+    return dbc.Container([
+        dcc.Location(id="url", refresh=False),
+        dcc.Store(id="scenario"),
+        # identifies the page view in the logs of update_results
+        dcc.Store(id="page-view", data=uuid.uuid4().hex),
+        dcc.Store(id="payload"),
+        dbc.Row(dbc.Col(dbc.CardGroup([dbc.Card(headerdiv)]), width=12), className="m-2"),
+        dbc.Row(dbc.Col(dbc.CardGroup(controls[0:1]), width=12), className="m-2") ,   
+        dbc.Row(dbc.Col(dbc.CardGroup(controls[1:3]), width=12), className="m-2") ,   
+        dbc.Row(dbc.Col(dbc.CardGroup(controls[3:5]), width=12), className="m-2") ,   
+        dbc.Row(dbc.Col(advbut, width="auto")),
+        dbc.Collapse([
+            dbc.Row(dbc.Col(dbc.CardGroup(controls[5:]), width=12), className="m-2") ,  
+            dbc.Row(dbc.Col(dbc.CardGroup([dbc.Input(id='urllabel', disabled=True)],),  width=12), className="m-2"),
+            dbc.Row(dbc.Col(dbc.Checklist(id='client-mode', switch=True, value=[], 
+                                          options=[{"label": "Compute in the browser (fewer figures)", "value": "client"}]), 
+                            width=12), className="m-2"),
+            ], is_open=False, id="advanced",),
+        dbc.Row(dbc.Col(dbc.CardGroup(results), width=12), className="m-2", id="results-server"),
+        dbc.Row(dbc.Col(dbc.CardGroup(client_results), width=12), className="m-2", id="results-client", 
+                style={"display": "none"}),
+        dbc.Row(dbc.Col(dbc.CardGroup(acknowlegements), width=12), className="m-2")
+    ], )
+
+app.layout = serve_layout
 
 
 @app.callback(
@@ -149,6 +205,7 @@ app.layout = dbc.Container([
     [Input("advanced-button", "n_clicks")],
     [State("advanced", "is_open")],
 )
+@metrics.timed("toggle_collapse", metrics.CALLBACKS)
 def toggle_collapse(n, is_open):
     if n:
         if is_open: 
@@ -158,104 +215,189 @@ def toggle_collapse(n, is_open):
     return is_open, html.I(className="far fa-plus-square")
 
 
-@app.callback(
-    [Output(component_id='byr', component_property='options'),
-     Output(component_id='syr', component_property='options'),
-     Output(component_id='byr', component_property='value'),
-     Output(component_id='syr', component_property='value'),],    
-    [Input(component_id='curr', component_property='value')]
-)
-def update_output(curr):
+def year_options(curr, byr=None, syr=None):
+    """Dropdown options for the years with an exchange rate for curr, and the buy and sell 
+    years: byr and syr if curr has a rate for them, else the defaults."""
     yrs=rer.get_range(curr)
     years=[{"label":y, "value":y} for y in yrs]
-    if len(years):
+    if not len(years):
+        return years, None, None
+    if byr not in yrs:
         byr=yrs[0] if yrs[0]>2001 else 2001
+    if syr not in yrs:
         syr=yrs[-1]
-        return years, years, byr, syr
-    else:
-        return years, years, None, None
+    return years, byr, syr
+
+
+def url_values(search):
+    """Values of URL_PARAMETERS in a share URL query, None if one is missing or invalid."""
+    qs=parse_qs(urlparse(search or "").query)
+    try:
+        return [qs["curr"][0]]+[float(qs[x][0]) for x in URL_PARAMETERS[1:]]
+    except (KeyError, ValueError) as err:
+        logging.debug(f"Error {err}")
+        return None
+
 
+def control_values(triggered, search, curr, byr, syr):
+    """Values of the update_controls outputs: currency, year options (twice), then the other 
+    URL_PARAMETERS. The share URL sets them all on the page load (or when it changes); a new 
+    currency only changes the years that it has no exchange rate for. Anything unchanged is 
+    dash.no_update, so it does not trigger update_scenario again."""
+    values=url_values(search) if "curr.value" not in triggered else None
+    if values is not None:
+        options, _, _=year_options(values[0])
+        return [values[0], options, options]+values[1:]
+    options, newbyr, newsyr=year_options(curr, byr, syr)
+    unchanged=[dash.no_update]*(len(URL_PARAMETERS)-1)
+    unchanged[URL_PARAMETERS.index('byr')-1]=newbyr if newbyr != byr else dash.no_update
+    unchanged[URL_PARAMETERS.index('syr')-1]=newsyr if newsyr != syr else dash.no_update
+    return [dash.no_update, options, options]+unchanged
+
+
+# one callback (and one writer) per control, so one page load or control change updates 
+# the scenario once; see control_values
 @app.callback(
     [Output(component_id='curr', component_property='value'),
-     Output(component_id='byr',  component_property='value'),   
-     Output(component_id='bval', component_property='value'),
-     Output(component_id='syr',  component_property='value'),
-     Output(component_id='sval', component_property='value'),
-     Output(component_id='scost', component_property='value'),
-     Output(component_id='rfrac', component_property='value'),
-     Output(component_id='rcost', component_property='value'),
-     Output(component_id='ascf', component_property='value'),
-     Output(component_id='sdt',  component_property='value'),
-     Output(component_id='ccf',  component_property='value'),
-     #Output(component_id='divi', component_property='value'),
-],
-    Input(component_id='url', component_property='search')
+     Output(component_id='byr', component_property='options'),
+     Output(component_id='syr', component_property='options')]+
+    [Output(component_id=p, component_property='value') for p in URL_PARAMETERS[1:]],
+    [Input(component_id='url', component_property='search'),
+     Input(component_id='curr', component_property='value')],
+    [State(component_id='byr', component_property='value'),
+     State(component_id='syr', component_property='value')]
     )
-def update_gui(search):
-    
+@metrics.timed("update_controls", metrics.CALLBACKS)
+def update_controls(search, curr, byr, syr):
     logging.debug(f"SEARCH: {search}")
-    logging.getLogger().handlers[0].flush()
-    qs=parse_qs(urlparse(search).query)
-    #raise dash.exceptions.PreventUpdate()
-    try:
-        
-        returnvals=[qs["curr"]][0]
-        returnvals+=[float(qs[x][0]) for x in [
-            #'curr',
-            'byr',  
-            'bval', 
-            'syr',  
-            'sval', 
-            'scost',
-            'rfrac',
-            'rcost',
-            'ascf', 
-            'sdt',  
-            'ccf',]]
-    except KeyError as err:
-        logging.debug(f"Error {err}")
-        raise dash.exceptions.PreventUpdate()
-    
-    logging.debug(f"Return values: {returnvals}")
-    return returnvals
+    triggered=[t["prop_id"] for t in dash.callback_context.triggered]
+    return control_values(triggered, search, curr, byr, syr)
+
+
+@app.callback(
+    Output(component_id='scenario', component_property='data'),
+    [Input(component_id=p, component_property='value') for p in URL_PARAMETERS]+
+    [Input(component_id='client-mode', component_property='value')],
+    State(component_id='scenario', component_property='data')
+)
+@metrics.timed("update_scenario", metrics.CALLBACKS)
+def update_scenario(curr, byr, bval, syr, sval, scost, rfrac, rcost, ascf, sdt, ccf, mode, previous):
+    # coalesces the control changes: update_results only runs when the normalized scenario changes
+    if "client" in (mode or []): # the browser computes the results
+        raise dash.exceptions.PreventUpdate
+    scenario={"curr": curr, "inputs": None}
+    if byr and bval and syr and sval:
+        scenario["inputs"]=list(normalize_inputs(curr, byr, bval, syr, sval, scost, rfrac, rcost, ascf, sdt, ccf))
+    if scenario == previous:
+        raise dash.exceptions.PreventUpdate
+    return scenario
+
 
 @app.callback(
     [Output(component_id='left', component_property='children',),
-     Output(component_id='right', component_property='children',),
-     Output(component_id='urllabel', component_property='value')],    
-    [Input(component_id='curr', component_property='value'),
-     Input(component_id='byr',  component_property='value'),   
-     Input(component_id='bval', component_property='value'),
-     Input(component_id='syr',  component_property='value'),
-     Input(component_id='sval', component_property='value'),
-     Input(component_id='scost', component_property='value'),
-     Input(component_id='rfrac', component_property='value'),
-     Input(component_id='rcost', component_property='value'),
-     Input(component_id='ascf', component_property='value'),
-     Input(component_id='sdt',  component_property='value'),
-     Input(component_id='ccf',  component_property='value'),
-     #Input(component_id='divi', component_property='value'),
-]
+     Output(component_id='right', component_property='children',)],    
+    Input(component_id='scenario', component_property='data'),
+    State(component_id='page-view', component_property='data')
 )
-def update_results(curr, 
-byr,  
-bval, 
-syr,  
-sval, 
-scost,
-rfrac,
-rcost,
-ascf, 
-sdt,  
-ccf,  
-#divi, 
-):
-    logging.debug(f"byr={byr} bval={bval} syr={syr} sval={sval}")
-    if not (byr and bval and syr and sval):
+@metrics.timed("update_results", metrics.CALLBACKS)
+def update_results(scenario, page_view=None):
+    logging.debug(f"page view {page_view}: {scenario}")
+    metrics.count("results")
+    if not scenario["inputs"]:
         logging.debug(f"Not updating")
-        #raise dash.exceptions.PreventUpdate
-        return [dcc.Markdown(f"# No Data for {curr}")]*2+[f"#No Data for {curr}"]
+        return [dcc.Markdown(f"# No Data for {scenario['curr']}")]*2
     
+    inputs=normalize_inputs(*scenario["inputs"])
+    key=cache_key(inputs)
+    with metrics.timer("result_cache"):
+        result=result_cache.get(key)
+    if result is None:
+        # identical requests in flight at the same time (other tabs, other users) share one computation
+        result=single_flight.do(key, lambda: _compute_and_cache(key, inputs))
+    with metrics.timer("render"):
+        return render_results(result)
+
+
+# ############ Client-side mode ############
+
+@app.callback(
+    Output(component_id='payload', component_property='data'),
+    [Input(component_id='curr', component_property='value'),
+     Input(component_id='client-mode', component_property='value')],
+    State(component_id='payload', component_property='data')
+)
+@metrics.timed("load_payload", metrics.CALLBACKS)
+def load_payload(curr, mode, payload):
+    # the only server round trip in client-side mode, once per currency
+    if "client" not in (mode or []) or (payload and payload["currency"] == curr):
+        raise dash.exceptions.PreventUpdate
+    try:
+        return sap.currency_payload(curr)
+    except sap.DataNotAvailableError as ex:
+        # not None, so the browser can tell "no data" from "not loaded yet"
+        return {"currency": curr, "error": str(ex)}
+
+
+app.clientside_callback(
+    ClientsideFunction(namespace="rir", function_name="update_results"),
+    [Output(component_id='client-markdown', component_property='children'),
+     Output(component_id='client-fig1', component_property='figure'),
+     Output(component_id='client-fig2', component_property='figure')],
+    [Input(component_id=p, component_property='value') for p in URL_PARAMETERS]+
+    [Input(component_id='payload', component_property='data'),
+     Input(component_id='client-mode', component_property='value')]
+)
+
+# the share URL in both modes, from the controls (as share_url)
+app.clientside_callback(
+    ClientsideFunction(namespace="rir", function_name="share_url"),
+    Output(component_id='urllabel', component_property='value'),
+    [Input(component_id=p, component_property='value') for p in URL_PARAMETERS]
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace="rir", function_name="show_results"),
+    [Output(component_id='results-server', component_property='style'),
+     Output(component_id='results-client', component_property='style')],
+    Input(component_id='client-mode', component_property='value')
+)
+
+
+def cache_key(inputs, kind=None, version=None):
+    # with the data version, so results computed before a data refresh are not served after it
+    version=sap.data_version() if version is None else version
+    return json.dumps([kind, version, *inputs] if kind else [version, *inputs])
+
+
+def _compute_and_cache(key, inputs):
+    metrics.count("computations")
+    result=compute_results(*inputs)
+    result_cache.set(key, result)
+    return result
+
+
+def _num(x):
+    x=float(x)
+    return int(x) if x.is_integer() else x
+
+
+def normalize_inputs(curr, byr, bval, syr, sval, scost, rfrac, rcost, ascf, sdt, ccf):
+    # the same scenario arrives as 2005, 2005.0 or '2005' depending on where it came from
+    return (str(curr), *[_num(x) for x in (byr, bval, syr, sval, scost, rfrac, rcost, ascf, sdt, ccf)])
+
+
+def share_url(inputs):
+    """The share URL query of normalized inputs; rir.share_url in assets/clientside.js builds 
+    the same from the controls."""
+    return "?"+"&".join(f"{name}={value}" for name, value in zip(URL_PARAMETERS, inputs))
+
+
+def compute_results(curr, byr, bval, syr, sval, scost, rfrac, rcost, ascf, sdt, ccf):
+    """Numeric results (RESULT_COLUMNS), Markdown and figures (as plotly JSON) for a normalized 
+    scenario. The share URL is built in the browser (share_url)."""
+    # only needed here, imported on the first computation to keep worker start-up fast
+    from plotly.subplots import make_subplots
+    import plotly.express as px
     results, return_only_property_appreciation, \
     totalreturn_property, \
     value_from_property_income,\
@@ -279,81 +421,184 @@ ccf,
                            selling_cost_fraction=scost/100. )
     
     
-    colors = ['crimson',] * 2
-    colors[1] = 'blue'
+    with metrics.timer("break_even"):
+        break_even=float(sap.break_even_price(bval, syr-byr, stock_annual_rate_in_local_currency, 
+                                              ratio_to_older_local, 
+                                              rental_income_frac=rfrac/100., 
+                                              rental_cost_fraction=rcost/100., 
+                                              selling_cost_fraction=scost/100.))
+    if not math.isnan(break_even):
+        break_even_text=f"""To do as well as the stocks, the property bought for {bval} {curr} in {byr} would have 
+    had to sell for **{break_even:,.0f} {curr}** in {syr} (an appreciation of {(break_even/bval)**(1/(syr-byr))-1:.2%} a year)."""
+    else:
+        break_even_text="No selling price would have made the property do as well as the stocks."
+    break_even_markdown=f"""
+    ## Break-even
     
+    {break_even_text}
+    """
     
-    y=[propertyendvalue_inflation_adjusted, stock_local_currency_end_value*ratio_to_older_local]
-    x=['Property', 'Stocks', ]
-    fig = go.Figure(data=[go.Bar(
-        x=x,
-        y=y,
-        text=[f"{_:.0f}" for _ in y],
-        textposition='inside',        
-        marker_color=colors # marker color can be a single color value or an iterable
-    )])
-    fig.update_layout(title_text='"Inflation Adjusted" End Value',
-                      #xaxis_title="",
-                      yaxis_title=f"Return ({curr})", font=dict(
-            #family="Courier New, monospace",
-            size=18, )                     
-    )    
+    with metrics.timer("simulation"):
+        try:
+            outcome=monteCarlo.simulate_outcomes(curr, bval, sval, syr-byr, n_paths=SIMULATION_PATHS, 
+                                                 rental_income_frac=rfrac/100., 
+                                                 rental_cost_fraction=rcost/100., 
+                                                 conversion_cost_frac=ccf/100., 
+                                                 annual_stock_cost_frac=ascf/100., 
+                                                 dividend_tax=sdt/100., 
+                                                 selling_cost_fraction=scost/100., seed=0)
+            outcome_markdown=monteCarlo.outcome_markdown(outcome, curr)
+        except sap.DataNotAvailableError as ex:
+            outcome_markdown=f"""
+    ## Simulated Outcomes
+    
+    Not available ({ex}).
+    """
+    
+    with metrics.timer("bar_figures"):
+        colors = ['crimson',] * 2
+        colors[1] = 'blue'
+    
+    
+        y=[propertyendvalue_inflation_adjusted, stock_local_currency_end_value*ratio_to_older_local]
+        x=['Property', 'Stocks', ]
+        fig = go.Figure(data=[go.Bar(
+            x=x,
+            y=y,
+            text=[f"{_:.0f}" for _ in y],
+            textposition='inside',        
+            marker_color=colors # marker color can be a single color value or an iterable
+        )])
+        fig.update_layout(title_text='"Inflation Adjusted" End Value',
+                          #xaxis_title="",
+                          yaxis_title=f"Return ({curr})", font=dict(
+                #family="Courier New, monospace",
+                size=18, )                     
+        )    
     
-    y=[property_inflation_adjusted_annual_return*100, stock_annual_rate_in_local_currency*100]
-    fig2 = go.Figure(data=[go.Bar(
-        x=x,
-        y=y,
-        text=[f"{_:.3f}" for _ in y],
-        textposition='inside',        
-        marker_color=colors # marker color can be a single color value or an iterable
-    )])
-    fig2.update_layout(title_text=f'Rate of Return ({curr})',
-                      #xaxis_title="",
-                      yaxis_title=f"Annual Return {curr} (%)", font=dict(
-            #family="Courier New, monospace",
-            size=18, )                     
-                      )  
+        y=[property_inflation_adjusted_annual_return*100, stock_annual_rate_in_local_currency*100]
+        fig2 = go.Figure(data=[go.Bar(
+            x=x,
+            y=y,
+            text=[f"{_:.3f}" for _ in y],
+            textposition='inside',        
+            marker_color=colors # marker color can be a single color value or an iterable
+        )])
+        fig2.update_layout(title_text=f'Rate of Return ({curr})',
+                          #xaxis_title="",
+                          yaxis_title=f"Annual Return {curr} (%)", font=dict(
+                #family="Courier New, monospace",
+                size=18, )                     
+                          )  
     
       
-    # Create subplots: use 'domain' type for Pie subplot
-    fig3 = make_subplots(rows=1, cols=2, specs=[[{'type':'domain'}, {'type':'domain'}]])
-
-    fig3.add_trace(go.Pie(labels=['Residual', 'Loss'], values=[ratio_to_older_local, 1-ratio_to_older_local], name=f"{curr}", 
-                          textinfo='label+percent'),
-                  1, 1)
-    usr=ratio_to_older_local*xrate2/xrate1
-    fig3.add_trace(go.Pie(labels=['Residual', 'Loss'], values=[usr, 1-usr], name="USD",
-                          textinfo='label+percent'),
-                  1, 2)
+    with metrics.timer("inflation_figure"):
+        # Create subplots: use 'domain' type for Pie subplot
+        fig3 = make_subplots(rows=1, cols=2, specs=[[{'type':'domain'}, {'type':'domain'}]])
+
+        fig3.add_trace(go.Pie(labels=['Residual', 'Loss'], values=[ratio_to_older_local, 1-ratio_to_older_local], name=f"{curr}", 
+                              textinfo='label+percent'),
+                      1, 1)
+        usr=ratio_to_older_local*xrate2/xrate1
+        fig3.add_trace(go.Pie(labels=['Residual', 'Loss'], values=[usr, 1-usr], name="USD",
+                              textinfo='label+percent'),
+                      1, 2)
     
-    # Use `hole` to create a donut-like pie chart
-    fig3.update_traces(hole=.4, hoverinfo="label+percent+name")
+        # Use `hole` to create a donut-like pie chart
+        fig3.update_traces(hole=.4, hoverinfo="label+percent+name")
     
-    fig3.update_layout(
-        title_text=f'"Inflation" from {byr} to {syr}',
-        # Add annotations in the center of the donut pies.
-        annotations=[dict(text=f'{curr}', x=0.18, y=0.5, font_size=20, showarrow=False),
-                     dict(text='USD', x=0.82, y=0.5, font_size=20, showarrow=False)],
-        margin=go.layout.Margin(
-              l=0, #left margin
-              r=0, #right margin
-              b=0, #bottom margin
-              #t=0  #top margin
-          ),  
-        showlegend=False,
-    )
+        fig3.update_layout(
+            title_text=f'"Inflation" from {byr} to {syr}',
+            # Add annotations in the center of the donut pies.
+            annotations=[dict(text=f'{curr}', x=0.18, y=0.5, font_size=20, showarrow=False),
+                         dict(text='USD', x=0.82, y=0.5, font_size=20, showarrow=False)],
+            margin=go.layout.Margin(
+                  l=0, #left margin
+                  r=0, #right margin
+                  b=0, #bottom margin
+                  #t=0  #top margin
+              ),  
+            showlegend=False,
+        )
+    
+    with metrics.timer("xrate_figure"):
+        df=rer.get_rates(curr, byr, syr+1)
+        rate=f'USD.{curr}=x'
+        df.columns = ['Year', rate]
+        fig4=px.line(df, x='Year', y=rate, title="Exchange Rate over time")
     
-    df=rer.get_rates(curr, byr, syr+1)
-    rate=f'USD.{curr}=x'
-    df.columns = ['Year', rate]
-    fig4=px.line(df, x='Year', y=rate, title="Exchange Rate over time")
+    with metrics.timer("holding_period_figure"):
+        years, stock_rates, _ = sap.holding_period_matrix(curr, 
+                                                          annual_cost_frac=ascf/100., 
+                                                          dividend_tax=sdt/100., 
+                                                          conversion_cost_frac=ccf/100.)
+        fig5 = go.Figure(data=go.Heatmap(z=stock_rates*100, x=years, y=years, 
+                                         colorscale='RdYlGn', zmid=0,
+                                         hovertemplate="Bought %{y}, sold %{x}: %{z:.2f}%<extra></extra>"))
+        fig5.update_layout(title_text=f'Stocks: "Inflation" Adjusted Annual Return ({curr}, %)',
+                           xaxis_title="Sold in", yaxis_title="Bought in")
     
 
-    graphs=[dbc.Row(dbc.Card(dcc.Graph(figure=fig))),
-            dbc.Row(dbc.Card(dcc.Graph(figure=fig2))),
-            dbc.Row(dbc.Card(dcc.Graph(figure=fig3))),
-            dbc.Row(dbc.Card(dcc.Graph(figure=fig4))),
-            ]
+    with metrics.timer("rolling_figure"):
+        rolling=sap.rolling_returns(curr, syr-byr, 
+                                    annual_cost_frac=ascf/100., 
+                                    dividend_tax=sdt/100., 
+                                    conversion_cost_frac=ccf/100.)
+        fig6 = make_subplots(specs=[[{"secondary_y": True}]])
+        fig6.add_trace(go.Scatter(x=rolling.index, y=rolling['total_stock_return_rate']*100, 
+                                  name='Stocks annual return'), secondary_y=False)
+        fig6.add_trace(go.Scatter(x=rolling.index, y=(1-rolling['ratio_to_older_local'])*100, 
+                                  name='"Inflation" loss', line=dict(dash='dot')), secondary_y=True)
+        fig6.add_vline(x=byr, line_dash='dash', line_color='grey')
+        fig6.update_layout(title_text=f'Every {syr-byr} Year Holding Period ({curr})', 
+                           xaxis_title="Bought in")
+        fig6.update_yaxes(title_text='"Inflation" Adjusted Annual Return (%)', secondary_y=False)
+        fig6.update_yaxes(title_text='"Inflation" Loss (%)', secondary_y=True)
+
+    with metrics.timer("sensitivity"):
+        try:
+            table=sap.sensitivity(curr, bval, sval, byr, syr, 
+                                  rental_income_frac=rfrac/100., 
+                                  rental_cost_fraction=rcost/100., 
+                                  conversion_cost_frac=ccf/100., 
+                                  annual_stock_cost_frac=ascf/100., 
+                                  dividend_tax=sdt/100., 
+                                  selling_cost_fraction=scost/100.)[::-1] # largest at the top
+        except sap.DataNotAvailableError as ex:
+            fig7 = go.Figure()
+            fig7.update_layout(title_text=f'Sensitivity: not available ({ex})')
+        else:
+            labels=[SENSITIVITY_LABELS[p] for p in table.index]
+            fig7 = make_subplots(rows=1, cols=2, shared_yaxes=True, subplot_titles=('Property', 'Stocks'))
+            for col, side in ((1, 'property'), (2, 'stocks')):
+                for end, color in (('low', 'crimson'), ('high', 'blue')):
+                    fig7.add_trace(go.Bar(y=labels, x=table[f'{side}_{end}']*100, orientation='h', 
+                                          name=f'{end.capitalize()} value', marker_color=color, 
+                                          legendgroup=end, showlegend=col == 1, 
+                                          hovertemplate="%{y}: %{x:+.3f}%<extra></extra>"), 1, col)
+            fig7.update_layout(title_text=f'Sensitivity: Change in Annual Return ({curr}, % points)', 
+                               barmode='overlay')
+    
+    with metrics.timer("leaderboard"):
+        try:
+            # currency_leaderboard raises for syr <= byr, the appreciation is only needed otherwise
+            board=sap.currency_leaderboard(byr, syr, (sval/bval)**(1/(syr-byr))-1 if syr > byr else 0.0, bval=bval, 
+                                           rental_income_frac=rfrac/100., 
+                                           rental_cost_fraction=rcost/100., 
+                                           conversion_cost_frac=ccf/100., 
+                                           annual_stock_cost_frac=ascf/100., 
+                                           dividend_tax=sdt/100., 
+                                           selling_cost_fraction=scost/100.)
+        except sap.DataNotAvailableError:
+            leaderboard=[] # render_results leaves the table out
+        else:
+            percent=['property_inflation_adjusted_annual_return', 'stock_annual_rate_in_local_currency', 'property_advantage']
+            board[percent]=(board[percent]*100).round(2)
+            board['ratio_to_older_local']=((1-board['ratio_to_older_local'])*100).round(1)
+            leaderboard=board.reset_index()[['currency', 'code']+percent+['ratio_to_older_local']].to_dict('records')
+
+    with metrics.timer("to_json"):
+        figures=[f.to_json() for f in (fig, fig2, fig3, fig4, fig5, fig6, fig7)]
     
     smallprint=f"""
     ## Small Print
@@ -377,11 +622,176 @@ ccf,
     See [this for a good explaination](https://saylordotorg.github.io/text_international-economics-theory-and-policy/s20-purchasing-power-parity.html)
     """    
     
-    url=f"?curr={curr}&byr={byr}&bval={bval}&syr={syr}&sval={sval}&scost={scost}&rfrac={rfrac}&rcost={rcost}&ascf={ascf}&sdt={sdt}&ccf={ccf}"
-    logging.debug(f"URL: {url}")
+    logging.debug(f"URL: {share_url((curr, byr, bval, syr, sval, scost, rfrac, rcost, ascf, sdt, ccf))}")
 
     
-    return dcc.Markdown(results+'\n'+smallprint), graphs, url
+    numbers=dict(zip(sap.RESULT_COLUMNS, 
+                     [None if math.isnan(v) else float(v) for v in (return_only_property_appreciation, totalreturn_property, 
+                                         value_from_property_income, total_property_value, 
+                                         propertyendvalue_inflation_adjusted, 
+                                         property_inflation_adjusted_annual_return, 
+                                         stock_local_currency_end_value, stock_annual_rate_in_local_currency, 
+                                         stock_usd_end_value, ratio_to_older_local, xrate1, xrate2)]))
+    return {"numbers": numbers, "leaderboard": leaderboard, "markdown": results+'\n'+break_even_markdown+'\n'+outcome_markdown+'\n'+smallprint, "figures": figures}
+
+
+LEADERBOARD_COLUMNS = [{"name": "Currency", "id": "currency"}, {"name": "Code", "id": "code"}, 
+                       {"name": "Property (%/year)", "id": "property_inflation_adjusted_annual_return"}, 
+                       {"name": "Stocks (%/year)", "id": "stock_annual_rate_in_local_currency"}, 
+                       {"name": "Property - Stocks", "id": "property_advantage"}, 
+                       {"name": '"Inflation" Loss (%)', "id": "ratio_to_older_local"}]
+
+
+def render_results(result):
+    graphs=[dbc.Row(dbc.Card(dcc.Graph(figure=json.loads(f)))) for f in result["figures"]]
+    if result.get("leaderboard"):
+        graphs.append(dbc.Row(dbc.Card([
+            dbc.CardHeader('Same Property Appreciation in Every Currency ("Inflation" Adjusted Returns)'), 
+            dbc.CardBody(dash_table.DataTable(columns=LEADERBOARD_COLUMNS, data=result["leaderboard"], 
+                                              sort_action="native", filter_action="native", page_size=15))])))
+    return dcc.Markdown(result["markdown"]), graphs
+
+# ############ JSON API ############
+
+API_MAX_BYTES = 1 << 20
+API_MAX_SCENARIOS = 10000
+# responses with more scenarios than this are streamed as NDJSON
+API_STREAM_SCENARIOS = 100
+# scenarios computed (and streamed) together
+API_CHUNK_SCENARIOS = 1000
+# requests with more scenarios than this are computed without the caches
+API_CACHE_SCENARIOS = 1000
+
+
+def parse_scenario(item):
+    """Normalized inputs of an API scenario: a dict with the URL parameter names, the 
+    percentages as entered in the UI (INPUT_DEFAULTS for the ones left out)."""
+    if not isinstance(item, dict):
+        raise ValueError("a scenario must be an object")
+    values={**INPUT_DEFAULTS, **item}
+    missing=[p for p in URL_PARAMETERS if values.get(p) is None]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    try:
+        return normalize_inputs(*[values[p] for p in URL_PARAMETERS])
+    except (TypeError, ValueError):
+        raise ValueError("parameters must be numbers")
+
+
+def compute_numbers(scenarios, cache=True):
+    """Numeric results (a dict of RESULT_COLUMNS, with an 'error' if there is no data) for 
+    a list of normalized scenarios. With cache=True results already rendered for the UI 
+    (result_cache) or computed for an earlier API call (number_cache) are reused, and the 
+    new ones are added to number_cache; the rest are computed in one compare_investment_batch call."""
+    out=[None]*len(scenarios)
+    if cache:
+        version=sap.data_version()
+        keys=[cache_key(inputs, version=version) for inputs in scenarios]
+        rendered={key: value.get("numbers") for key, value in result_cache.get_many(keys).items()}
+        # prefixed, number_cache may share its SQLite file with result_cache
+        numbers=number_cache.get_many([cache_key(inputs, "numbers", version) for inputs, key in zip(scenarios, keys) 
+                                       if rendered.get(key) is None])
+        out=[rendered[key] if rendered.get(key) is not None else numbers.get(cache_key(inputs, "numbers", version)) 
+             for inputs, key in zip(scenarios, keys)]
+    misses=[i for i, numbers in enumerate(out) if numbers is None]
+    if misses:
+        curr, byr, bval, syr, sval, scost, rfrac, rcost, ascf, sdt, ccf=zip(*[scenarios[i] for i in misses])
+        percent=lambda values: [v/100. for v in values]
+        batch=sap.compare_investment_batch({'curr': curr, 'bval': bval, 'sval': sval, 'byr': byr, 'syr': syr, 
+                                            'rental_income_frac': percent(rfrac), 
+                                            'rental_cost_fraction': percent(rcost), 
+                                            'conversion_cost_frac': percent(ccf), 
+                                            'annual_stock_cost_frac': percent(ascf), 
+                                            'dividend_tax': percent(sdt), 
+                                            'selling_cost_fraction': percent(scost)}, errors="coerce")
+        for i, row in zip(misses, batch.itertuples(index=False)):
+            numbers={column: None if math.isnan(value) else float(value) 
+                     for column, value in zip(sap.RESULT_COLUMNS, row)}
+            if row.error is not None:
+                numbers['error']=row.error
+            out[i]=numbers
+        if cache:
+            number_cache.set_many({cache_key(scenarios[i], "numbers", version): out[i] for i in misses})
+    return out
+
+
+def iter_numbers(scenarios):
+    """compute_numbers for API_CHUNK_SCENARIOS scenarios at a time, yielding the results of 
+    each chunk once it is computed. The caches are only used up to API_CACHE_SCENARIOS."""
+    cache=len(scenarios) <= API_CACHE_SCENARIOS
+    for start in range(0, len(scenarios), API_CHUNK_SCENARIOS):
+        with metrics.timer("api_compute"):
+            numbers=compute_numbers(scenarios[start:start+API_CHUNK_SCENARIOS], cache)
+        yield from numbers
+
+
+def _api_error(status, message):
+    return Response(json.dumps({"error": message}), status=status, mimetype="application/json")
+
+
+@server.route("/api/compute", methods=["POST"])
+def api_compute():
+    """Numeric results for a JSON array (or NDJSON lines) of scenarios with the parameter 
+    names of the share URL, e.g. [{"curr": "LKR", "byr": 2005, "bval": 100000, "syr": 2021, 
+    "sval": 200000}]. One object per scenario, in order, with its parameters, the results 
+    and an error if it could not be computed."""
+    start=time.perf_counter()
+    if (request.content_length or 0) > API_MAX_BYTES:
+        return _api_error(413, f"request larger than {API_MAX_BYTES} bytes")
+    body=request.stream.read(API_MAX_BYTES+1)
+    if len(body) > API_MAX_BYTES:
+        return _api_error(413, f"request larger than {API_MAX_BYTES} bytes")
+    try:
+        if request.mimetype == "application/x-ndjson":
+            items=[json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            items=json.loads(body)
+            if isinstance(items, dict):
+                items=items.get("scenarios")
+            if not isinstance(items, list):
+                raise ValueError("expected an array of scenarios")
+    except ValueError as ex:
+        return _api_error(400, f"invalid request: {ex}")
+    if len(items) > API_MAX_SCENARIOS:
+        return _api_error(413, f"more than {API_MAX_SCENARIOS} scenarios")
+
+    scenarios, errors=[], {}
+    for i, item in enumerate(items):
+        try:
+            scenarios.append(parse_scenario(item))
+        except ValueError as ex:
+            errors[i]=str(ex)
+    parsed=time.perf_counter()
+    numbers=iter_numbers(scenarios)
+    inputs=iter(scenarios)
+    records=({"error": errors[i]} if i in errors else {**dict(zip(URL_PARAMETERS, next(inputs))), **next(numbers)} 
+             for i in range(len(items)))
+
+    headers={"X-Scenarios": str(len(items))}
+    if len(items) > API_STREAM_SCENARIOS or "application/x-ndjson" in request.headers.get("Accept", ""):
+        # streamed as computed, so Server-Timing only has the parsing
+        headers["Server-Timing"]=f"parse;dur={(parsed-start)*1000:.2f}"
+        lines=(json.dumps(record)+"\n" for record in records)
+        return Response(lines, mimetype="application/x-ndjson", headers=headers)
+    records=list(records)
+    computed=time.perf_counter()
+    headers["Server-Timing"]=f"parse;dur={(parsed-start)*1000:.2f}, compute;dur={(computed-parsed)*1000:.2f}"
+    return Response(json.dumps(records), mimetype="application/json", headers=headers)
+
+
+@server.route("/api/payload/<currency>")
+def api_payload(currency):
+    """sap.currency_payload as JSON, for computing the results on the client (as 
+    assets/clientside.js does). It only changes with the data, so it is cacheable."""
+    try:
+        payload=sap.currency_payload(currency)
+    except sap.DataNotAvailableError as ex:
+        return _api_error(404, str(ex))
+    response=Response(json.dumps(payload, separators=(",", ":")), mimetype="application/json", 
+                      headers={"Cache-Control": "public, max-age=3600"})
+    response.add_etag()
+    return response.make_conditional(request)
+
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
@@ -0,0 +1,161 @@
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import app
+
+SCENARIO = {"curr": "LKR", "byr": 2005, "bval": 100000, "syr": 2021, "sval": 200000}
+
+@pytest.fixture
+def client():
+    app.result_cache.clear()
+    return app.server.test_client()
+
+@pytest.mark.integrated
+def test_api_compute(client):
+    response=client.post("/api/compute", json=[SCENARIO, {**SCENARIO, "curr": "XXX"}, {"curr": "LKR"}])
+    assert response.status_code == 200
+    assert "compute;dur=" in response.headers["Server-Timing"]
+    first, unknown, incomplete=response.json
+    expected=app.sap.compare_investment('LKR', 100000, 200000, 2005, 2021, annual_stock_cost_frac=0.0015, 
+                                        dividend_tax=0.15, conversion_cost_frac=0.02)
+    assert [first[c] for c in app.sap.RESULT_COLUMNS] == pytest.approx(expected[1:], rel=1e-9)
+    assert first["scost"] == app.INPUT_DEFAULTS["scost"]
+    assert unknown["error"] == "unknown currency XXX" and unknown["xrate1"] is None
+    assert incomplete == {"error": "missing byr, bval, syr, sval"}
+
+@pytest.mark.integrated
+def test_api_shares_the_ui_cache(client):
+    inputs=app.normalize_inputs(*[{**app.INPUT_DEFAULTS, **SCENARIO}[p] for p in app.URL_PARAMETERS])
+    app.result_cache.set(app.cache_key(inputs), app.compute_results(*inputs))
+    hits=app.result_cache.stats()["hits"]
+    response=client.post("/api/compute", json={"scenarios": [SCENARIO]})
+    assert app.result_cache.stats()["hits"] == hits+1
+    assert response.json[0]["xrate2"] == pytest.approx(198.439, rel=1e-4)
+
+@pytest.mark.integrated
+def test_sell_year_before_buy_year():
+    result=app.compute_results(*app.normalize_inputs("LKR", 2021, 100000, 2005, 200000, 5, 3, 25, 0.15, 15, 2))
+    assert "Not available (sell year must be after buy year)" in result["markdown"]
+    assert len(result["figures"]) == 7
+    assert result["leaderboard"] == []
+
+def test_cache_key_has_the_data_version(monkeypatch):
+    inputs=app.normalize_inputs("LKR", 2005, 100000, 2021, 200000, 5, 3, 25, 0.15, 15, 2)
+    key=app.cache_key(inputs)
+    monkeypatch.setattr(app.sap, "_sandp_generation", app.sap._sandp_generation+1) # as reload_sandp does
+    assert app.cache_key(inputs) != key
+    assert app.cache_key(inputs, "numbers") != app.cache_key(inputs)
+
+def test_api_ndjson(client):
+    body="\n".join(json.dumps({**SCENARIO, "bval": 100000+i}) for i in range(3))
+    response=client.post("/api/compute", data=body, content_type="application/x-ndjson", 
+                         headers={"Accept": "application/x-ndjson"})
+    assert response.mimetype == "application/x-ndjson"
+    assert [json.loads(line)["bval"] for line in response.get_data(as_text=True).splitlines()] == [100000, 100001, 100002]
+
+def test_api_caches(client, monkeypatch):
+    app.number_cache.clear()
+    client.post("/api/compute", json=[SCENARIO])
+    assert app.number_cache.stats()["size"] == 1
+    assert app.result_cache.stats()["size"] == 0 # the UI results are left alone
+    client.post("/api/compute", json=[SCENARIO])
+    assert app.number_cache.stats()["hits"] == 1
+
+    monkeypatch.setattr(app, "API_CACHE_SCENARIOS", 2)
+    monkeypatch.setattr(app, "API_CHUNK_SCENARIOS", 2)
+    response=client.post("/api/compute", json=[{**SCENARIO, "bval": 100000+i} for i in range(5)], 
+                         headers={"Accept": "application/x-ndjson"})
+    assert [json.loads(line)["bval"] for line in response.get_data(as_text=True).splitlines()] == [100000+i for i in range(5)]
+    assert app.number_cache.stats()["size"] == 1 # too many scenarios to cache
+
+def test_api_limits(client):
+    assert client.post("/api/compute", data="[1,", content_type="application/json").status_code == 400
+    assert client.post("/api/compute", data=" "*(app.API_MAX_BYTES+1), content_type="application/json").status_code == 413
+    assert client.post("/api/compute", json=[SCENARIO]*(app.API_MAX_SCENARIOS+1)).status_code == 413
+
+def test_control_values():
+    search="?curr=EUR&byr=2002&bval=1&syr=2020&sval=2&scost=5&rfrac=3&rcost=25&ascf=0.15&sdt=15&ccf=2"
+    values=app.control_values(["."], search, "LKR", None, None)
+    assert values[0] == "EUR" and values[1] == values[2] and values[3:] == [2002, 1, 2020, 2, 5, 3, 25, 0.15, 15, 2]
+    # a new currency with rates for the chosen years changes nothing but the options
+    values=app.control_values(["curr.value"], search, "EUR", 2005, 2021)
+    assert values[0] is app.dash.no_update and values[1]
+    assert all(v is app.dash.no_update for v in values[3:])
+    # no share URL: default years
+    values=app.control_values(["."], "", "LKR", None, None)
+    years=app.rer.get_range("LKR")
+    assert values[3] == max(years[0], 2001) and values[5] == years[-1]
+
+def test_page_views():
+    app.metrics.enable()
+    app.metrics.EVENTS.clear()
+    try:
+        app.serve_layout()
+        assert 'page_views' not in "\n".join(app.metrics.EVENTS.render())
+        with app.server.test_request_context("/"):
+            app.serve_layout()
+        assert app.metrics.EVENTS.render()[-1] == 'rir_events_total{event="page_views"} 1'
+    finally:
+        app.metrics.enable(False)
+
+def test_update_scenario_coalesces():
+    update_scenario=next(c['f'] for c in app.app.callbacks if c['f'].__name__ == 'update_scenario')
+    inputs=("LKR", 2005, 100000, 2021, 200000, 5, 3, 25, 0.15, 15, 2)
+    scenario=update_scenario(*inputs, [], None)
+    assert scenario == {"curr": "LKR", "inputs": list(inputs)}
+    with pytest.raises(app.dash.exceptions.PreventUpdate):
+        update_scenario("LKR", 2005.0, "100000", 2021, 200000, 5, 3, 25, 0.15, 15, 2, [], scenario)
+    assert update_scenario("LKR", None, 100000, 2021, 200000, 5, 3, 25, 0.15, 15, 2, [], scenario)["inputs"] is None
+    with pytest.raises(app.dash.exceptions.PreventUpdate): # computed in the browser
+        update_scenario("EUR", 2005, 100000, 2021, 200000, 5, 3, 25, 0.15, 15, 2, ["client"], scenario)
+
+def test_api_payload(client):
+    response=client.get("/api/payload/LKR")
+    assert response.status_code == 200 and response.headers["Cache-Control"].startswith("public")
+    assert client.get("/api/payload/LKR", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    assert client.get("/api/payload/XXX").status_code == 404
+
+PARITY_SCENARIOS = [("LKR", 100000, 200000, 2005, 2021, {}), 
+                    ("LKR", 23000000, 46000000, 2001, 2021, {"dividend_tax": 0.3, "annual_stock_cost_frac": 0.005}), 
+                    ("EUR", 100000, 150000, 2002, 2020, {"adjust_inflation": False, "rental_income_frac": 0.05}), 
+                    ("EUR", 100000, 90000, 2019, 2020, {"conversion_cost_frac": 0, "selling_cost_fraction": 0.1}), 
+                    ("LKR", 100000, 200000, 2021, 2005, {})]
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+def test_clientside_parity(client):
+    # assets/clientside.js against compare_investment, on the payload the browser gets
+    payloads={curr: client.get(f"/api/payload/{curr}").json for curr in ("LKR", "EUR")}
+    cases=[[curr, bval, sval, byr, syr, {**app.sap.SCENARIO_DEFAULTS, **params}] 
+           for curr, bval, sval, byr, syr, params in PARITY_SCENARIOS]
+    script=os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "clientside.js")
+    program=f"""
+    const rir=require({json.dumps(script)});
+    const payloads={json.dumps(payloads)};
+    const cases={json.dumps(cases)};
+    console.log(JSON.stringify(cases.map(([curr, bval, sval, byr, syr, p]) => 
+        rir.compare_investment(payloads[curr], bval, sval, byr, syr, p))));
+    """
+    results=json.loads(subprocess.run(["node", "-e", program], capture_output=True, text=True, check=True).stdout)
+    for (curr, bval, sval, byr, syr, params), result in zip(PARITY_SCENARIOS[:-1], results):
+        expected=app.sap.compare_investment(curr, bval, sval, byr, syr, **params)
+        assert [result[c] for c in app.sap.RESULT_COLUMNS] == pytest.approx(expected[1:], rel=1e-9)
+    assert results[-1] == {"error": "sell year must be after buy year"}
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+def test_clientside_share_url_and_no_data():
+    values=["LKR", "2005", 100000, 2021, 200000.0, 5, 3, 25, 0.15, 15, 2.5]
+    script=os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "clientside.js")
+    program=f"""
+    const rir=require({json.dumps(script)});
+    const values={json.dumps(values)};
+    console.log(JSON.stringify([rir.share_url(...values), rir.share_url("LKR", null, ...values.slice(2)), 
+        rir.update_results("XXX", ...values.slice(1), {{"currency": "XXX", "error": "no exchange rates"}}, ["client"])]));
+    """
+    url, incomplete, no_data=json.loads(subprocess.run(["node", "-e", program], capture_output=True, text=True, check=True).stdout)
+    assert url == app.share_url(app.normalize_inputs(*values))
+    assert incomplete == "#No Data for LKR"
+    assert no_data == ["# No Data for XXX (no exchange rates)", {}, {}] # not the results of the previous currency
@@ -0,0 +1,152 @@
+/*
+ * Client-side mode: compare_investment (SandPCalc.py) and the first two figures, computed in
+ * the browser from the per-currency payload of SandPCalc.currency_payload. Keep in step with
+ * SandPCalc.py; app_test.py checks the numbers against compare_investment (with node).
+ */
+(function (root) {
+    function calc_interest(buy_price, sell_price, buy_year, sell_year) {
+        return Math.pow(1 + (sell_price - buy_price) / buy_price, 1 / (sell_year - buy_year)) - 1;
+    }
+
+    function pct(x, digits) {
+        return (x * 100).toFixed(digits) + '%';
+    }
+
+    // the RESULT_COLUMNS of compare_investment as an object, or {error: ...} without data
+    function compare_investment(payload, bval, sval, byr, syr, p) {
+        var ib = payload.years.indexOf(byr), is = payload.years.indexOf(syr);
+        if (!(syr > byr)) {
+            return {error: "sell year must be after buy year"};
+        }
+        if (ib < 0 || is < 0) {
+            return {error: "no data for these years"}; // the payload only has the years with a rate
+        }
+        var xrate1 = payload.xrate[ib], xrate2 = payload.xrate[is];
+        if (xrate1 === null || xrate2 === null) {
+            return {error: "no exchange rate for these years"};
+        }
+        var years = syr - byr;
+        // total return index growth (see accumulation_index)
+        var growth = payload.value[is] / payload.value[ib];
+        for (var k = ib + 1; k <= is; k++) {
+            growth *= (1 + payload.dividend[k] * (1 - p.dividend_tax)) * (1 - p.annual_stock_cost_frac);
+        }
+        var stock_usd_end_value = bval / xrate1 * (1 - p.conversion_cost_frac) * growth;
+        // see local_inflation_ratio
+        var ratio_to_older_local = xrate1 / xrate2 * (p.adjust_inflation ? payload.cpi[ib] / payload.cpi[is] : 1);
+        var local_currency_end_value = stock_usd_end_value * xrate2 * (1 - p.conversion_cost_frac) * ratio_to_older_local;
+
+        // see get_property_return
+        var appreciation = 1 + calc_interest(bval, sval, byr, syr);
+        var rent_years = Math.max(years - 1, 0);
+        var value_from_property_income = bval * p.rental_income_frac * Math.pow(appreciation, rent_years)
+            + rent_years * bval * p.rental_income_frac * (1 - p.rental_cost_fraction) * Math.pow(appreciation, rent_years + 1);
+        var propertyendvalue = value_from_property_income + sval * (1 - p.selling_cost_fraction);
+        var propertyendvalue_inflation_adjusted = propertyendvalue * ratio_to_older_local;
+        return {
+            return_only_property_appreciation: calc_interest(bval, sval * (1 - p.selling_cost_fraction), byr, syr),
+            totalreturn_property: calc_interest(bval, propertyendvalue, byr, syr),
+            value_from_property_income: value_from_property_income,
+            propertyendvalue: propertyendvalue,
+            propertyendvalue_inflation_adjusted: propertyendvalue_inflation_adjusted,
+            property_inflation_adjusted_annual_return: Math.pow(propertyendvalue_inflation_adjusted / bval, 1 / years) - 1,
+            stock_local_currency_end_value: stock_usd_end_value * (1 - p.conversion_cost_frac) * xrate2,
+            stock_annual_rate_in_local_currency: Math.pow(local_currency_end_value / bval, 1 / years) - 1,
+            stock_usd_end_value: stock_usd_end_value,
+            ratio_to_older_local: ratio_to_older_local,
+            xrate1: xrate1,
+            xrate2: xrate2
+        };
+    }
+
+    // a shorter results_markdown
+    function results_markdown(curr, bval, sval, byr, syr, r) {
+        return [
+            "## Property Investment",
+            "",
+            "* Bought in " + byr + " for " + bval + " " + curr + ", sold in " + syr + " for " + sval + " " + curr + ".",
+            "* Property value appreciated annually by " + pct(r.return_only_property_appreciation, 2) + " (after selling costs).",
+            "* The extra investment build-up due to rental income " + r.value_from_property_income.toFixed(0) + " " + curr + ".",
+            "* The USD." + curr + "=x rate in " + byr + "=" + r.xrate1.toFixed(2) + ", in " + syr + "=" + r.xrate2.toFixed(2) + ".",
+            "* The factor to bring " + syr + " " + curr + " to " + byr + " " + curr + " is x" + r.ratio_to_older_local.toFixed(5) + ".",
+            "* Adjusted for \"inflation\" (in " + byr + " " + curr + ") " + r.propertyendvalue_inflation_adjusted.toFixed(0) + " " + curr + ".",
+            "* Which is a real annual return of " + pct(r.property_inflation_adjusted_annual_return, 2) + ".",
+            "",
+            "## Alternative scenario:",
+            "",
+            "* The gross value of the S&P500 portfolio in " + syr + " will be " + r.stock_usd_end_value.toFixed(0) + " USD, " +
+                r.stock_local_currency_end_value.toFixed(0) + " " + curr + ".",
+            "* The 'inflation' adjusted value is " + (r.stock_local_currency_end_value * r.ratio_to_older_local).toFixed(0) + " " + curr + ".",
+            "* This represents a net annual (\"inflation\" adjusted) return in " + curr + " of " + pct(r.stock_annual_rate_in_local_currency, 2) + ".",
+            "",
+            "*Computed in the browser.*"
+        ].join("\n");
+    }
+
+    // app.URL_PARAMETERS
+    var URL_PARAMETERS = ['curr', 'byr', 'bval', 'syr', 'sval', 'scost', 'rfrac', 'rcost', 'ascf', 'sdt', 'ccf'];
+
+    function bar_figure(y, digits, title, yaxis) {
+        return {
+            data: [{type: 'bar', x: ['Property', 'Stocks'], y: y, text: y.map(function (v) { return v.toFixed(digits); }),
+                    textposition: 'inside', marker: {color: ['crimson', 'blue']}}],
+            layout: {title: {text: title}, yaxis: {title: {text: yaxis}}, font: {size: 18}}
+        };
+    }
+
+    var rir = {
+        compare_investment: compare_investment,
+
+        // clientside callback: the controls (as in app.URL_PARAMETERS), the payload and the mode
+        update_results: function (curr, byr, bval, syr, sval, scost, rfrac, rcost, ascf, sdt, ccf, payload, mode) {
+            var no_update = root.dash_clientside.no_update;
+            if (!mode || mode.indexOf("client") < 0 || !payload || payload.currency !== curr) {
+                return [no_update, no_update, no_update]; // the payload of curr is not loaded yet
+            }
+            if (payload.error) {
+                return ["# No Data for " + curr + " (" + payload.error + ")", {}, {}];
+            }
+            if (!(byr && bval && syr && sval)) {
+                return ["# No Data for " + curr, {}, {}];
+            }
+            byr = Number(byr); syr = Number(syr); bval = Number(bval); sval = Number(sval);
+            var r = compare_investment(payload, bval, sval, byr, syr, {
+                rental_income_frac: rfrac / 100, rental_cost_fraction: rcost / 100,
+                conversion_cost_frac: ccf / 100, annual_stock_cost_frac: ascf / 100,
+                adjust_inflation: true, dividend_tax: sdt / 100, selling_cost_fraction: scost / 100
+            });
+            if (r.error) {
+                return ["# No Data for " + curr + " (" + r.error + ")", {}, {}];
+            }
+            return [
+                results_markdown(curr, bval, sval, byr, syr, r),
+                bar_figure([r.propertyendvalue_inflation_adjusted, r.stock_local_currency_end_value * r.ratio_to_older_local],
+                           0, '"Inflation" Adjusted End Value', "Return (" + curr + ")"),
+                bar_figure([r.property_inflation_adjusted_annual_return * 100, r.stock_annual_rate_in_local_currency * 100],
+                           3, "Rate of Return (" + curr + ")", "Annual Return " + curr + " (%)")
+            ];
+        },
+
+        // clientside callback: the share URL of the controls, as app.share_url of the normalized inputs
+        share_url: function (curr, byr, bval, syr, sval, scost, rfrac, rcost, ascf, sdt, ccf) {
+            if (!(byr && bval && syr && sval)) {
+                return "#No Data for " + curr;
+            }
+            var values = [curr, byr, bval, syr, sval, scost, rfrac, rcost, ascf, sdt, ccf].map(function (v, i) {
+                return i ? Number(v) : v;
+            });
+            return "?" + URL_PARAMETERS.map(function (name, i) { return name + "=" + values[i]; }).join("&");
+        },
+
+        // clientside callback: styles of the server and the client results
+        show_results: function (mode) {
+            var client = mode && mode.indexOf("client") >= 0;
+            return [{display: client ? "none" : "flex"}, {display: client ? "flex" : "none"}];
+        }
+    };
+
+    root.dash_clientside = Object.assign({}, root.dash_clientside, {rir: rir});
+    if (typeof module !== 'undefined' && module.exports) {
+        module.exports = rir;
+    }
+})(typeof window !== 'undefined' ? window : globalThis);
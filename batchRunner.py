@@ -0,0 +1,125 @@
+"""
+Evaluate compare_investment for a file of scenarios, streaming the results.
+
+The input (CSV, Parquet or CSV on stdin) needs the columns curr, bval, sval, byr and syr and
+may have any other keyword argument of compare_investment (see SandPCalc.SCENARIO_DEFAULTS);
+other columns are copied to the output unchanged. adjust_inflation is only off for false, 0, no 
+or off (a blank cell keeps the default). It is read and evaluated in chunks with
+compare_investment_batch, optionally in a process pool, and written chunk by chunk as CSV
+or NDJSON, so memory use does not grow with the file. A row that cannot be evaluated gets
+an error message and empty results; the rest of the batch carries on.
+
+    python batchRunner.py scenarios.csv -o results.csv
+    cat scenarios.csv | python batchRunner.py - --format ndjson --workers 4 > results.ndjson
+"""
+import argparse
+import logging
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import SandPCalc as sap
+
+REQUIRED_COLUMNS = ['curr', 'bval', 'sval', 'byr', 'syr']
+NUMERIC_COLUMNS = ['bval', 'sval', 'byr', 'syr']+[k for k, v in sap.SCENARIO_DEFAULTS.items() if not isinstance(v, bool)]
+# adjust_inflation values (lower case) that mean False
+FALSE_VALUES = ['false', '0', '0.0', 'no', 'off']
+
+
+def read_chunks(path, chunksize=100000):
+    """DataFrames of at most chunksize rows from a CSV or Parquet file, or CSV on stdin ('-')."""
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq # optional, only needed for Parquet input
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(sys.stdin if path == '-' else path, chunksize=chunksize)
+
+
+def evaluate(chunk):
+    """The chunk's columns followed by RESULT_COLUMNS and 'error'."""
+    missing = [c for c in REQUIRED_COLUMNS if c not in chunk]
+    if missing:
+        raise ValueError(f"missing column(s): {', '.join(missing)}")
+    scenarios = chunk[[c for c in chunk if c in REQUIRED_COLUMNS or c in sap.SCENARIO_DEFAULTS]].copy()
+    invalid = np.full(len(chunk), None, dtype=object)
+    for column in NUMERIC_COLUMNS:
+        if column in scenarios:
+            values = pd.to_numeric(scenarios[column], errors='coerce')
+            invalid[values.isna().to_numpy() & pd.isna(invalid)] = f"missing or invalid {column}"
+            scenarios[column] = values
+    if 'adjust_inflation' in scenarios:
+        # only an explicit false switches it off, a blank cell keeps the default (True)
+        text = scenarios['adjust_inflation'].astype(str).str.strip().str.lower()
+        scenarios['adjust_inflation'] = ~text.isin(FALSE_VALUES).to_numpy()
+    results = sap.compare_investment_batch(scenarios, errors="coerce")
+    bad = pd.notna(invalid)
+    results.loc[bad, sap.RESULT_COLUMNS] = np.nan
+    results.loc[bad, 'error'] = invalid[bad]
+    return pd.concat([chunk, results], axis=1)
+
+
+def render(chunk, format='csv', header=True):
+    """evaluate() a chunk and format it; returns (text, rows, rows with errors). Formatting
+    (CSV in particular) takes longer than evaluating, so it is done in the worker too."""
+    results = evaluate(chunk)
+    if format == 'ndjson':
+        text = results.to_json(orient='records', lines=True).rstrip('\n')+'\n' if len(results) else ''
+    else:
+        text = results.to_csv(header=header, index=False)
+    return text, len(results), int(results['error'].notna().sum())
+
+
+def render_all(chunks, workers=1, **kwargs):
+    """render() each chunk, in order, the first with a header. With workers > 1 a few
+    chunks per worker are in flight in a process pool at a time."""
+    if workers <= 1:
+        for i, chunk in enumerate(chunks):
+            yield render(chunk, header=i == 0, **kwargs)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for i, chunk in enumerate(chunks):
+            pending.append(pool.submit(render, chunk, header=i == 0, **kwargs))
+            if len(pending) >= 2*workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="CSV or .parquet file, - for CSV on stdin")
+    parser.add_argument("-o", "--output", help="output file (default stdout)")
+    parser.add_argument("--format", choices=['csv', 'ndjson'], default='csv')
+    parser.add_argument("--chunksize", type=int, default=100000)
+    parser.add_argument("--workers", type=int, default=1, help="processes (default: evaluate in this process)")
+    args = parser.parse_args(argv)
+
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    start = time.perf_counter()
+    rows = errors = 0
+    try:
+        for text, n, failed in render_all(read_chunks(args.input, args.chunksize), args.workers, 
+                                          format=args.format):
+            out.write(text)
+            rows += n
+            errors += failed
+    except ValueError as ex:
+        logging.error(ex)
+        return 2
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter()-start
+    print(f"{rows} rows ({errors} with errors) in {elapsed:.2f} s, {rows/elapsed if elapsed else 0:.0f} rows/s",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import batchRunner
+from SandPCalc import compare_investment, RESULT_COLUMNS
+
+SCENARIOS = """id,curr,bval,sval,byr,syr,annual_stock_cost_frac,adjust_inflation
+a,LKR,100000,200000,2001,2021,0.0015,True
+b,XXX,100000,200000,2001,2021,0.0015,True
+c,LKR,100000,200000,2021,2001,0.0015,True
+d,LKR,lots,200000,2001,2021,0.0015,True
+e,EUR,100000,150000,2002,2020,0.0025,False
+"""
+
+@pytest.fixture
+def scenarios(tmp_path):
+    path=tmp_path/"scenarios.csv"
+    path.write_text(SCENARIOS)
+    return path
+
+@pytest.mark.integrated
+def test_csv(scenarios, tmp_path):
+    out=tmp_path/"out.csv"
+    assert batchRunner.main([str(scenarios), "-o", str(out), "--chunksize", "2"]) == 0
+    results=pd.read_csv(out)
+    assert list(results['id']) == ['a', 'b', 'c', 'd', 'e']
+    assert list(results.columns[-len(RESULT_COLUMNS)-1:]) == RESULT_COLUMNS+['error']
+    expected=compare_investment('LKR', 100000, 200000, 2001, 2021, annual_stock_cost_frac=0.0015)
+    assert results.loc[0, RESULT_COLUMNS].to_numpy(dtype=float) == pytest.approx(expected[1:], rel=1e-9)
+    expected=compare_investment('EUR', 100000, 150000, 2002, 2020, annual_stock_cost_frac=0.0025, adjust_inflation=False)
+    assert results.loc[4, RESULT_COLUMNS].to_numpy(dtype=float) == pytest.approx(expected[1:], rel=1e-9)
+    assert list(results['error'].fillna('')) == ['', "unknown currency XXX",
+                                                 "sell year must be after buy year", "missing or invalid bval", '']
+    assert results.loc[1:3, RESULT_COLUMNS].isna().all().all()
+
+def test_ndjson_with_workers(scenarios, tmp_path):
+    out=tmp_path/"out.ndjson"
+    assert batchRunner.main([str(scenarios), "-o", str(out), "--format", "ndjson", "--chunksize", "2", "--workers", "2"]) == 0
+    records=[json.loads(line) for line in out.read_text().splitlines()]
+    assert [r['id'] for r in records] == ['a', 'b', 'c', 'd', 'e']
+    assert records[0]['error'] is None and records[1]['xrate1'] is None
+
+def test_adjust_inflation_default():
+    chunk=pd.DataFrame({'curr': ['LKR']*4, 'bval': 100000, 'sval': 200000, 'byr': 2001, 'syr': 2021, 
+                        'adjust_inflation': [None, 'No', 'TRUE', False]})
+    results=batchRunner.evaluate(chunk)
+    expected=[compare_investment('LKR', 100000, 200000, 2001, 2021, adjust_inflation=adjust)[1:] 
+              for adjust in (True, False, True, False)]
+    assert results[RESULT_COLUMNS].to_numpy(dtype=float) == pytest.approx(np.array(expected, dtype=float), rel=1e-9)
+
+def test_missing_column(tmp_path):
+    path=tmp_path/"bad.csv"
+    path.write_text("curr,bval\nLKR,1\n")
+    assert batchRunner.main([str(path), "-o", str(tmp_path/"out.csv")]) == 2
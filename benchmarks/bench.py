@@ -0,0 +1,196 @@
+"""Benchmarks of the calculator, the exchange rate lookups and the update_results callback.
+
+Scalar functions are timed per call, the vectorised ones over batches of scenarios. Cases
+marked cold clear the caches involved before every call (outside the timed region). Only
+local data is used, nothing is fetched. Run from the repository root:
+
+    python benchmarks/bench.py [--sizes 1,100,10000,1000000] [--filter compare] [--output out.json]
+    python benchmarks/bench.py --compare baseline.json [--threshold 0.25]
+
+With --compare the exit status is 1 if any case is slower than in the baseline by more than
+the threshold (a fraction of the baseline median). It is also 1 if a case costs more calls of
+a reference case than BUDGETS allows (e.g. sensitivity against compare_investment).
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT) # the data paths are relative to the repository root
+
+import numpy as np
+import pandas as pd
+
+import dataBundle
+import SandPCalc as sap
+import readExchangeRates as rer
+
+CURRENCIES = ['LKR', 'EUR', 'INR', 'AUD']
+# the scenarios sap.sensitivity evaluates for the defaults, one compare_investment call each
+SENSITIVITY_VARIANTS = [{}]+[{name: value} for name, delta in sap.SENSITIVITY_DELTAS.items()
+                             for value in ((False, True) if delta is None else
+                                           (max(sap.SCENARIO_DEFAULTS[name]-delta, 0.0), sap.SCENARIO_DEFAULTS[name]+delta))]
+# (case, reference case, most it may cost in reference calls), checked when both are run
+BUDGETS = [("sensitivity", "compare_investment", 8),
+           ("sensitivity", "sensitivity as 15 compare_investment", 0.5)]
+SCENARIO = {"curr": "LKR", "inputs": ["LKR", 2005, 100000, 2021, 200000, 5, 3, 25, 0.15, 15, 2]} # as update_scenario passes it
+
+
+def measure(fn, setup=None, repeat=5, min_time=0.1):
+    """Median and best seconds per call of fn(). setup() runs before every call, untimed."""
+    times = []
+    for _ in range(repeat):
+        total, calls = 0.0, 0
+        while calls == 0 or total < min_time:
+            if setup is not None:
+                setup()
+            t = time.perf_counter()
+            fn()
+            total += time.perf_counter()-t
+            calls += 1
+        times.append(total/calls)
+    return {"median": statistics.median(times), "min": min(times), "repeat": repeat}
+
+
+def scenarios(n, seed=0):
+    rng = np.random.default_rng(seed)
+    byr = rng.integers(1995, 2020, n)
+    return pd.DataFrame({'curr': rng.choice(CURRENCIES, n),
+                         'bval': rng.uniform(1e5, 1e7, n),
+                         'sval': rng.uniform(1e5, 2e7, n),
+                         'byr': byr,
+                         'syr': byr+1+rng.integers(0, 2021-byr-1, n),
+                         'annual_stock_cost_frac': rng.choice([0.0015, 0.01], n),
+                         'dividend_tax': rng.choice([0., 0.15], n)})
+
+
+def clear_calculator():
+    sap.accumulation_cache.clear()
+    sap._holding_period_matrix.cache_clear()
+
+
+def clear_rates():
+    rer._rate_matrix = None
+    dataBundle._loaded.clear() # the memory-mapped bundle too, or "cold" only rebuilds the matrix from it
+
+
+def scalar_cases():
+    import app
+    update_results = next(c['f'] for c in app.app.callbacks if c['f'].__name__ == 'update_results')
+
+    def clear_app():
+        clear_calculator()
+        app.result_cache.clear()
+
+    spdf = sap.get_spdf().copy()
+    return {
+        "calc_ret": (lambda: sap.calc_ret(spdf, 0.0015, 0.15), None),
+        "sap500_end_value warm": (lambda: sap.sap500_end_value(1000, 2001, 2021, 0.0015, 0.15), None),
+        "sap500_end_value cold": (lambda: sap.sap500_end_value(1000, 2001, 2021, 0.0015, 0.15), clear_calculator),
+        "get_property_return": (lambda: sap.get_property_return(100000, 200000, 2001, 2021), None),
+        "get_return_value_in_local warm": (lambda: sap.get_return_value_in_local(1000, "LKR", 2001, 2021), None),
+        "get_return_value_in_local cold": (lambda: sap.get_return_value_in_local(1000, "LKR", 2001, 2021), clear_calculator),
+        "compare_investment": (lambda: sap.compare_investment("LKR", 100000, 200000, 2001, 2021), None),
+        "sensitivity": (lambda: sap.sensitivity("LKR", 100000, 200000, 2001, 2021), None),
+        "sensitivity as 15 compare_investment": (lambda: [sap.compare_investment("LKR", 100000, 200000, 2001, 2021, **params)
+                                                          for params in SENSITIVITY_VARIANTS], None),
+        "get_rate warm": (lambda: rer.get_rate("LKR", 2005), None),
+        "get_rate cold": (lambda: rer.get_rate("LKR", 2005), clear_rates),
+        "get_range": (lambda: rer.get_range("LKR"), None),
+        "get_rates": (lambda: rer.get_rates("LKR", 1998, 2021), None),
+        "update_results warm": (lambda: update_results(SCENARIO), None),
+        "update_results cold": (lambda: update_results(SCENARIO), clear_app),
+    }
+
+
+def batch_cases(n):
+    df = scenarios(n)
+    byr, syr = df['byr'].to_numpy(), df['syr'].to_numpy()
+    bval, sval = df['bval'].to_numpy(), df['sval'].to_numpy()
+    curr = df['curr'].to_numpy()
+    return {
+        f"get_property_return_batch n={n}": (lambda: sap.get_property_return_batch(bval, sval, byr, syr), None),
+        f"lookup_rates n={n}": (lambda: rer.lookup_rates(curr, byr), None),
+        f"compare_investment_batch warm n={n}": (lambda: sap.compare_investment_batch(df, errors="coerce"), None),
+        f"compare_investment_batch cold n={n}": (lambda: sap.compare_investment_batch(df, errors="coerce"), clear_calculator),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print current vs baseline medians; returns the names of the cases that regressed."""
+    regressed = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:45s} {result['median']*1e6:12.1f} us   (not in baseline)")
+            continue
+        ratio = result['median']/before['median']
+        flag = ""
+        if ratio > 1+threshold:
+            regressed.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:45s} {result['median']*1e6:12.1f} us {ratio:6.2f}x{flag}")
+    return regressed
+
+
+def check_budgets(results):
+    """Print the cost of each BUDGETS case in reference calls; returns the ones over budget."""
+    over = []
+    for name, reference, budget in BUDGETS:
+        if name in results and reference in results:
+            calls = results[name]['median']/results[reference]['median']
+            flag = ""
+            if calls > budget:
+                over.append(name)
+                flag = "  OVER BUDGET"
+            print(f"{name} = {calls:.2f} x {reference} (budget {budget}){flag}")
+    return over
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,100,10000,1000000", help="comma separated batch sizes")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.1, help="seconds per repeat")
+    parser.add_argument("--filter", help="only cases whose name contains this")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="a JSON file written by --output to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args()
+
+    cases = scalar_cases()
+    for n in (int(float(s)) for s in args.sizes.split(",")):
+        cases.update(batch_cases(n))
+    if args.filter:
+        cases = {name: case for name, case in cases.items() if args.filter in name}
+
+    results = {}
+    for name, (fn, setup) in cases.items():
+        fn() # first call loads the data and imports, which is what benchmarks/startup.py measures
+        results[name] = measure(fn, setup, repeat=args.repeat, min_time=args.min_time)
+        if not args.compare:
+            print(f"{name:45s} {results[name]['median']*1e6:12.1f} us")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+                       "machine": platform.machine(), "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "results": results}, f, indent=1)
+    over = check_budgets(results)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressed = compare(results, baseline, args.threshold)
+        if regressed:
+            print(f"{len(regressed)} regression(s) over {args.threshold:.0%}")
+            return 1
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
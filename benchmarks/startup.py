@@ -0,0 +1,71 @@
+"""Cold start budget: import time of the modules and time to the first response.
+
+Every measurement runs in a fresh interpreter, like a new gunicorn worker. Run from the
+repository root:
+
+    python benchmarks/startup.py [--repeat 5] [--budget 2.0]
+
+With --budget (seconds) the exit status is 1 if the median time to the first computed
+result exceeds it.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT = """
+import time
+t = time.perf_counter()
+import {module}
+print(time.perf_counter()-t)
+"""
+
+FIRST_RESPONSE = """
+import json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+client = app.server.test_client()
+assert client.get("/").status_code == 200
+assert client.get("/_dash-layout").status_code == 200
+t2 = time.perf_counter()
+app.compute_results(*app.normalize_inputs("LKR", 2005, 100000, 2021, 200000, 5, 3, 25, 0.15, 15, 2))
+t3 = time.perf_counter()
+print(json.dumps({"import": t1-t0, "first_page": t2-t1, "first_result": t3-t2, "total": t3-t0}))
+"""
+
+
+def run(code):
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True,
+                         capture_output=True, text=True).stdout
+    return out.strip().splitlines()[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget", type=float, help="seconds allowed for import + first result")
+    args = parser.parse_args()
+
+    report = {}
+    for module in ("readExchangeRates", "SandPCalc", "app"):
+        times = [float(run(IMPORT.format(module=module))) for _ in range(args.repeat)]
+        report[f"import {module}"] = statistics.median(times)
+    runs = [json.loads(run(FIRST_RESPONSE)) for _ in range(args.repeat)]
+    for key in runs[0]:
+        report[f"app {key}"] = statistics.median(r[key] for r in runs)
+
+    for key, value in report.items():
+        print(f"{key:30s} {value*1000:8.1f} ms")
+    if args.budget is not None and report["app total"] > args.budget:
+        print(f"Over budget: {report['app total']:.3f} s > {args.budget:.3f} s")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+Precompiled data bundle: s_and_p_500.csv, currency_codes.csv and the xrates/countries
+tables of XRATES.db as fixed-width columnar arrays in one file that is memory-mapped.
+
+Layout: MAGIC, version and header length (little endian uint32), a JSON header, then the
+arrays, each aligned to ALIGN bytes. The header lists every array (dtype, shape, offset),
+a sha256 of the payload and a sha256 of each source file. A bundle whose sources have
+changed since it was built is stale and is not used; callers fall back to the sources.
+
+Build it with
+
+    python dataBundle.py
+"""
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+
+import numpy as np
+
+BUNDLE_PATH = './data/bundle.bin'
+MAGIC = b'RIRBNDL\0'
+VERSION = 1
+ALIGN = 64
+
+
+def source_paths():
+    import SandPCalc
+    import readExchangeRates as rer
+    return {"sandp": SandPCalc.SANDP_CSV, "currency_codes": rer.CURRENCY_CODES, "xrates": rer.DATABASE}
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _fixed_width(strings):
+    width = max([len(s) for s in strings]+[1])
+    return np.array(strings, dtype=f'<U{width}')
+
+
+def collect_arrays():
+    """The bundle contents, read from the sources."""
+    import SandPCalc
+    import readExchangeRates as rer
+    spdf = SandPCalc.read_sandp()
+    currencylist = rer.read_currencylist()
+    matrix = rer.load_rate_matrix()
+    countries = rer.read_pool().execute(rer.SQL_CURRENCIES).fetchall()
+    return {
+        "sandp_year": spdf.index.to_numpy(dtype='<i8'),
+        "sandp_dividend": spdf['DividendYield_percent'].to_numpy(dtype='<f8'),
+        "sandp_value": spdf['Value'].to_numpy(dtype='<f8'),
+        "sandp_cpi": spdf['CPI'].to_numpy(dtype='<f8'),
+        "currency_name": _fixed_width(list(currencylist.keys())),
+        "currency_code": _fixed_width(list(currencylist.values())),
+        "xrate_code": _fixed_width(matrix.codes),
+        "xrate_first_year": np.array([matrix.first_year], dtype='<i8'),
+        "xrate_rate": matrix.rates.astype('<f8'),
+        "country_code": _fixed_width([c for c, _ in countries]),
+        "country_name": _fixed_width([n for _, n in countries]),
+    }
+
+
+def build_bundle(path=BUNDLE_PATH):
+    arrays = collect_arrays()
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        entries[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes//ALIGN)*ALIGN
+    payload = bytearray(offset)
+    for name, array in arrays.items():
+        start = entries[name]["offset"]
+        payload[start:start+array.nbytes] = np.ascontiguousarray(array).tobytes()
+    header = json.dumps({
+        "version": VERSION,
+        "arrays": entries,
+        "payload_sha256": hashlib.sha256(payload).hexdigest(),
+        "sources": {key: _sha256(source) for key, source in source_paths().items()},
+    }).encode()
+    preamble = len(MAGIC)+8+len(header)
+    header += b' '*(-preamble % ALIGN)
+    tmp = path+'.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC+struct.pack('<II', VERSION, len(header))+header)
+        f.write(payload)
+    os.replace(tmp, path)
+    logging.debug(f"Wrote {path}: {len(arrays)} arrays, {len(payload)} bytes")
+    return path
+
+
+def read_bundle(path=BUNDLE_PATH, verify_payload=False):
+    """(header, arrays) with the arrays as read-only views into a memory map of path."""
+    with open(path, 'rb') as f:
+        preamble = f.read(len(MAGIC)+8)
+        if preamble[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a data bundle")
+        version, header_length = struct.unpack('<II', preamble[len(MAGIC):])
+        if version != VERSION:
+            raise ValueError(f"{path} is bundle version {version}, expected {VERSION}")
+        header = json.loads(f.read(header_length))
+    start = len(MAGIC)+8+header_length
+    mm = np.memmap(path, dtype=np.uint8, mode='r')
+    if verify_payload and hashlib.sha256(mm[start:]).hexdigest() != header["payload_sha256"]:
+        raise ValueError(f"{path} is corrupt")
+    arrays = {}
+    for name, entry in header["arrays"].items():
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(entry["shape"], dtype=np.int64))
+        first = start+entry["offset"]
+        # a plain ndarray view (no copy), so results computed from it are not memmaps
+        arrays[name] = np.asarray(mm[first:first+count*dtype.itemsize]).view(dtype).reshape(entry["shape"])
+    return header, arrays
+
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+def load_bundle(path=BUNDLE_PATH):
+    """The bundle's arrays, or None if there is no bundle or it is stale (its sources changed
+    since it was built). Sources are hashed again only when their size or mtime changes."""
+    if not os.path.exists(path):
+        return None
+    sources = source_paths()
+    try:
+        stats = tuple((os.stat(p).st_size, os.stat(p).st_mtime_ns) for p in sources.values())+(os.stat(path).st_mtime_ns,)
+    except OSError:
+        return None
+    with _lock:
+        cached = _loaded.get(path)
+        if cached is not None and cached[0] == stats:
+            return cached[1]
+        try:
+            header, arrays = read_bundle(path)
+        except (ValueError, KeyError) as ex:
+            logging.warning(f"Ignoring data bundle: {ex}")
+            arrays = None
+        else:
+            if header["sources"] != {key: _sha256(p) for key, p in sources.items()}:
+                logging.warning(f"Ignoring stale data bundle {path}, run dataBundle.py to rebuild it")
+                arrays = None
+        _loaded[path] = (stats, arrays)
+        return arrays
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    build_bundle()
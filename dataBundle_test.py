@@ -0,0 +1,44 @@
+import shutil
+
+import numpy as np
+import pytest
+
+import dataBundle
+import SandPCalc
+import readExchangeRates
+
+@pytest.fixture
+def sources(tmp_path, monkeypatch):
+    # private copies of the sources, so they can be changed
+    for module, name in ((SandPCalc, "SANDP_CSV"), (readExchangeRates, "CURRENCY_CODES"),
+                         (readExchangeRates, "DATABASE")):
+        copy = str(tmp_path/getattr(module, name).split("/")[-1])
+        shutil.copy(getattr(module, name), copy)
+        monkeypatch.setattr(module, name, copy)
+    return tmp_path
+
+def test_bundle_contents(sources):
+    path = dataBundle.build_bundle(str(sources/"bundle.bin"))
+    header, arrays = dataBundle.read_bundle(path, verify_payload=True)
+    spdf = SandPCalc.read_sandp(SandPCalc.SANDP_CSV)
+    assert (arrays["sandp_year"] == spdf.index.to_numpy()).all()
+    assert (arrays["sandp_cpi"] == spdf["CPI"].to_numpy()).all()
+    matrix = readExchangeRates.load_rate_matrix()
+    assert arrays["xrate_code"].tolist() == matrix.codes
+    np.testing.assert_array_equal(arrays["xrate_rate"], matrix.rates)
+    names = arrays["currency_name"].tolist()
+    assert arrays["currency_code"][names.index("Sri Lanka Rupee")] == "LKR"
+    assert not arrays["sandp_value"].flags.owndata # a view into the memory map, not a copy
+    assert not arrays["sandp_value"].flags.writeable
+
+def test_stale_bundle(sources):
+    path = dataBundle.build_bundle(str(sources/"bundle.bin"))
+    assert dataBundle.load_bundle(path) is not None
+    with open(SandPCalc.SANDP_CSV, "a") as f:
+        f.write("2023,0.015,4100.0,300.0\n")
+    assert dataBundle.load_bundle(path) is None
+
+def test_missing_or_invalid_bundle(sources):
+    assert dataBundle.load_bundle(str(sources/"none.bin")) is None
+    (sources/"bad.bin").write_bytes(b"not a bundle")
+    assert dataBundle.load_bundle(str(sources/"bad.bin")) is None
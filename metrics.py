@@ -0,0 +1,177 @@
+"""
+Timing histograms for the stages of a computation and the Dash callbacks, event counters
+and cache hit/miss counters, in the Prometheus text format (see install() for the /metrics
+route).
+
+Timing is off unless the METRICS environment variable is set (e.g. METRICS=1). When it is
+off timer() returns a shared no-op context manager, timed() functions call straight
+through and count() does nothing, so the instrumented code pays a function call and a
+branch.
+"""
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+
+BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.)
+
+enabled = os.environ.get("METRICS", "").lower() not in ("", "0", "false", "no")
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+class Histogram:
+    """Cumulative histogram of durations (seconds) with one series per value of its label."""
+
+    def __init__(self, name, help, label, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label, value):
+        i = bisect_left(self.buckets, value) # buckets are inclusive upper bounds
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = [[0]*(len(self.buckets)+1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {label: (list(counts), total) for label, (counts, total) in self._series.items()}
+        for label, (counts, total) in sorted(series.items()):
+            tag = f'{self.label}="{label}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets+("+Inf",), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{tag},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{tag}}} {total}")
+            lines.append(f"{self.name}_count{{{tag}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Event counts with one series per value of its label."""
+
+    def __init__(self, name, help, label):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label, n=1):
+        with self._lock:
+            self._counts[label] = self._counts.get(label, 0)+n
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+    def render(self):
+        with self._lock:
+            counts = dict(self._counts)
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"] + \
+               [f'{self.name}{{{self.label}="{label}"}} {count}' for label, count in sorted(counts.items())]
+
+
+STAGES = Histogram("rir_stage_seconds", "Time spent in each stage of a computation", "stage")
+CALLBACKS = Histogram("rir_callback_seconds", "Time spent in each Dash callback", "callback")
+# page views, results shown and computations; computations per page view is their ratio
+EVENTS = Counter("rir_events_total", "Page views, results shown and computations", "event")
+
+_NULL = nullcontext()
+
+
+class _Timer:
+    __slots__ = ("histogram", "label", "start")
+
+    def __init__(self, histogram, label):
+        self.histogram = histogram
+        self.label = label
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(self.label, time.perf_counter()-self.start)
+        return False
+
+
+def timer(label, histogram=STAGES):
+    """Context manager that records the time spent in its block under label."""
+    if not enabled:
+        return _NULL
+    return _Timer(histogram, label)
+
+
+def count(label, counter=EVENTS):
+    if enabled:
+        counter.inc(label)
+
+
+def timed(label, histogram=STAGES):
+    """Decorator version of timer()."""
+    def decorate(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return f(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                histogram.observe(label, time.perf_counter()-start)
+        return wrapper
+    return decorate
+
+
+_caches = {}
+
+
+def register_cache(name, stats):
+    """stats() returns a dict with hits, misses and size; it is only called when rendering."""
+    _caches[name] = stats
+
+
+def lru_stats(cached_function):
+    """stats for register_cache of a functools.lru_cache function."""
+    def stats():
+        info = cached_function.cache_info()
+        return {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+    return stats
+
+
+def render():
+    lines = STAGES.render()+CALLBACKS.render()+EVENTS.render()
+    stats = {name: stats() for name, stats in sorted(_caches.items())}
+    for key, kind, help in (("hits", "counter", "Cache hits"), ("misses", "counter", "Cache misses"),
+                            ("size", "gauge", "Entries in the cache")):
+        name = f"rir_cache_{key}_total" if kind == "counter" else f"rir_cache_{key}"
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+        lines += [f'{name}{{cache="{cache}"}} {values[key]}' for cache, values in stats.items()]
+    return "\n".join(lines)+"\n"
+
+
+def install(server, path="/metrics"):
+    """Add the metrics route to a Flask server."""
+    from flask import Response
+
+    def metrics():
+        return Response(render(), mimetype="text/plain; version=0.0.4")
+    server.add_url_rule(path, "metrics", metrics)
@@ -0,0 +1,51 @@
+import pytest
+
+import metrics
+
+@pytest.fixture
+def enabled():
+    metrics.enable()
+    metrics.STAGES.clear()
+    metrics.CALLBACKS.clear()
+    metrics.EVENTS.clear()
+    yield
+    metrics.enable(False)
+
+def test_histogram_render():
+    histogram=metrics.Histogram("h_seconds", "help", "stage", buckets=(0.1, 1.))
+    histogram.observe("a", 0.05)
+    histogram.observe("a", 0.1)
+    histogram.observe("a", 5)
+    assert histogram.render() == ['# HELP h_seconds help', '# TYPE h_seconds histogram',
+                                  'h_seconds_bucket{stage="a",le="0.1"} 2',
+                                  'h_seconds_bucket{stage="a",le="1.0"} 2',
+                                  'h_seconds_bucket{stage="a",le="+Inf"} 3',
+                                  'h_seconds_sum{stage="a"} 5.15',
+                                  'h_seconds_count{stage="a"} 3']
+
+def test_count(enabled):
+    metrics.count("page_views")
+    metrics.count("computations")
+    metrics.count("page_views")
+    assert metrics.EVENTS.render()[2:] == ['rir_events_total{event="computations"} 1', 'rir_events_total{event="page_views"} 2']
+
+def test_disabled_is_a_no_op():
+    metrics.enable(False)
+    assert metrics.timer("x") is metrics.timer("y")
+    metrics.timed("f")(lambda: None)()
+    metrics.EVENTS.clear()
+    metrics.count("page_views")
+    assert 'stage="f"' not in metrics.render() and 'page_views' not in metrics.render()
+
+@pytest.mark.integrated
+def test_metrics_route(enabled):
+    import app
+    app.result_cache.clear()
+    app.compute_results(*app.normalize_inputs("LKR", 2005, 100000, 2021, 200000, 5, 3, 25, 0.15, 15, 2))
+    response=app.server.test_client().get("/metrics")
+    assert response.status_code == 200
+    text=response.get_data(as_text=True)
+    for stage in ("xrate", "sandp", "property", "markdown", "holding_period_figure", "to_json"):
+        assert f'rir_stage_seconds_count{{stage="{stage}"}} 1' in text
+    assert 'rir_cache_misses_total{cache="results"}' in text
+    assert 'rir_cache_hits_total{cache="accumulation"}' in text
@@ -0,0 +1,140 @@
+"""
+Distribution of outcomes for a holding period of N years, by block bootstrap of the
+historical annual changes of the S&P 500 total return index, the US CPI and the exchange
+rate of a currency.
+
+Blocks of consecutive years are drawn with replacement from the history the three series
+have in common (wrapping around at its end) and chained until the holding period is
+covered. A block takes the same years from all three series, so their joint behaviour
+(e.g. a falling currency in a bad year for stocks) is kept.
+"""
+import math
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import SandPCalc as sap
+from readExchangeRates import lookup_rates
+
+PERCENTILES = (5, 25, 50, 75, 95)
+BLOCK_YEARS = 5
+# paths per random stream; the streams do not depend on the number of workers, so a seed
+# gives the same paths with or without a process pool
+CHUNK_PATHS = 100000
+
+AnnualHistory = namedtuple('AnnualHistory', ['years', 'stock', 'cpi', 'fx'])
+SimulatedOutcome = namedtuple('SimulatedOutcome', ['percentiles', 'stocks_beat_property', 'n_paths',
+                                                   'years', 'history'])
+
+
+def annual_history(currency, annual_cost_frac=0.0, dividend_tax=0.0):
+    """Log changes from year t to t+1 of the S&P 500 total return index (after costs and
+    dividend tax), the CPI and the exchange rate (currency per USD), for every year t (in
+    years) where all of them are known."""
+    sandp = sap.sandp_arrays()
+    years = sandp.years
+    xrates = lookup_rates(np.full(len(years), currency), years)
+    total_return_index = sap.accumulation_cache.get(annual_cost_frac, dividend_tax)
+    keep = ~np.isnan(xrates[:-1]) & ~np.isnan(xrates[1:]) & (np.diff(years) == 1)
+    if not keep.any():
+        raise sap.DataNotAvailableError(f"no exchange rate history for {currency}")
+    return AnnualHistory(years[:-1][keep],
+                         np.diff(np.log(total_return_index))[keep],
+                         np.diff(np.log(sandp.cpi))[keep],
+                         np.diff(np.log(xrates))[keep])
+
+
+def _simulate_chunk(logs, years, n_paths, block, seed):
+    # sums over `years` bootstrapped years of the columns of logs, one row per path
+    rng = np.random.default_rng(seed)
+    history = len(logs)
+    repeats = math.ceil((history+block)/history) # a block may start at the last year and wrap
+    cumulative = np.vstack([np.zeros((1, logs.shape[1])), np.cumsum(np.tile(logs, (repeats, 1)), axis=0)])
+    n_blocks = math.ceil(years/block)
+    lengths = np.full(n_blocks, block)
+    lengths[-1] = years-block*(n_blocks-1)
+    starts = rng.integers(0, history, (n_paths, n_blocks))
+    return (cumulative[starts+lengths]-cumulative[starts]).sum(axis=1)
+
+
+def simulate(currency, years, n_paths=10000, block=BLOCK_YEARS, annual_cost_frac=0.0, dividend_tax=0.0,
+             seed=None, workers=None, history=None):
+    """Log changes of (stock total return index, CPI, exchange rate) over `years` years for
+    n_paths bootstrapped paths, an (n_paths, 3) array. With workers > 1 the paths are split
+    across a process pool."""
+    if history is None:
+        history = annual_history(currency, annual_cost_frac, dividend_tax)
+    logs = np.column_stack([history.stock, history.cpi, history.fx])
+    block = max(1, min(block, years))
+    sizes = [min(CHUNK_PATHS, n_paths-start) for start in range(0, n_paths, CHUNK_PATHS)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if workers is not None and workers > 1 and len(sizes) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_simulate_chunk, [logs]*len(sizes), [years]*len(sizes), sizes,
+                                  [block]*len(sizes), seeds))
+    else:
+        parts = [_simulate_chunk(logs, years, size, block, s) for size, s in zip(sizes, seeds)]
+    return np.vstack(parts) if parts else np.empty((0, 3))
+
+
+def simulate_outcomes(curr, bval, sval, years, n_paths=10000, block=BLOCK_YEARS, percentiles=PERCENTILES,
+                      rental_income_frac=0.03,
+                      rental_cost_fraction=0.25,
+                      conversion_cost_frac=0.02,
+                      annual_stock_cost_frac=0.0015,
+                      adjust_inflation=True, dividend_tax=0.15,
+                      selling_cost_fraction=0.05,
+                      seed=None, workers=None):
+    """Percentiles of the "inflation" adjusted end value in local currency of bval invested in
+    the S&P 500 for `years` years, next to those of the property bought for bval and sold for
+    sval (with rent as in compare_investment) under the same simulated "inflation". Raises
+    DataNotAvailableError for fewer than one year."""
+    if years < 1:
+        raise sap.DataNotAvailableError("sell year must be after buy year")
+    history = annual_history(curr, annual_stock_cost_frac, dividend_tax)
+    stock, cpi, fx = simulate(curr, years, n_paths, block, seed=seed, workers=workers, history=history).T
+    if not adjust_inflation:
+        cpi = np.zeros_like(cpi)
+    ratio_to_older_local = np.exp(-cpi-fx)
+    # the exchange rates cancel for stocks: converted to USD at the start and back at the end
+    stocks = bval*(1-conversion_cost_frac)**2*np.exp(stock-cpi)
+    _, _, value_from_property_income = sap.get_property_return(
+        bval, sval, 0, years,
+        rental_income_frac=rental_income_frac,
+        cost_fraction=rental_cost_fraction,
+        selling_cost_fraction=selling_cost_fraction)
+    property = (value_from_property_income+sval*(1-selling_cost_fraction))*ratio_to_older_local
+    table = pd.DataFrame({'stocks': np.percentile(stocks, percentiles),
+                          'property': np.percentile(property, percentiles)},
+                         index=pd.Index(percentiles, name='percentile'))
+    return SimulatedOutcome(table, float(np.mean(stocks > property)), n_paths, years,
+                            (int(history.years[0]), int(history.years[-1])+1))
+
+
+def outcome_markdown(outcome, curr, block=BLOCK_YEARS):
+    # indented like results_markdown, dcc.Markdown removes the common indentation
+    rows = "\n".join(f"    | {p}% | {row.stocks:,.0f} | {row.property:,.0f} |"
+                     for p, row in outcome.percentiles.iterrows())
+    return f"""
+    ## Simulated Outcomes
+
+    {outcome.n_paths:,} paths of {outcome.years} years, drawn in blocks of up to {block} years from the
+    S&P 500, US CPI and exchange rate history of {outcome.history[0]}-{outcome.history[1]}.
+    "Inflation" adjusted end value in {curr}:
+
+    | Percentile | Stocks | Property |
+    |---:|---:|---:|
+{rows}
+
+    Stocks end higher than the property in {outcome.stocks_beat_property:.0%} of the paths.
+    """
+
+
+if __name__ == "__main__":
+    import time
+    start = time.perf_counter()
+    outcome = simulate_outcomes("LKR", 100000, 200000, 16, n_paths=1000000, seed=0, workers=4)
+    print(outcome.percentiles)
+    print(f"stocks beat property in {outcome.stocks_beat_property:.1%}, {time.perf_counter()-start:.2f} s")
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+import monteCarlo
+from SandPCalc import DataNotAvailableError, compare_investment
+
+@pytest.mark.integrated
+def test_annual_history_matches_compare_investment():
+    history=monteCarlo.annual_history('LKR', annual_cost_frac=0.0015, dividend_tax=0.15)
+    window=(history.years >= 2001) & (history.years < 2021)
+    stock, cpi, fx=history.stock[window].sum(), history.cpi[window].sum(), history.fx[window].sum()
+    ret=compare_investment('LKR', 100000, 200000, 2001, 2021, conversion_cost_frac=0.02,
+                           annual_stock_cost_frac=0.0015, dividend_tax=0.15)
+    stock_local_currency_end_value, ratio_to_older_local=ret[7], ret[10]
+    assert np.exp(-cpi-fx) == pytest.approx(ratio_to_older_local, rel=1e-9)
+    assert 100000*0.98**2*np.exp(stock-cpi) == pytest.approx(stock_local_currency_end_value*ratio_to_older_local, rel=1e-9)
+
+def test_seeded_paths(monkeypatch):
+    monkeypatch.setattr(monteCarlo, 'CHUNK_PATHS', 1000)
+    paths=monteCarlo.simulate('LKR', 12, n_paths=2500, seed=7)
+    assert paths.shape == (2500, 3)
+    np.testing.assert_array_equal(paths, monteCarlo.simulate('LKR', 12, n_paths=2500, seed=7))
+    np.testing.assert_array_equal(paths, monteCarlo.simulate('LKR', 12, n_paths=2500, seed=7, workers=2))
+    assert not np.array_equal(paths, monteCarlo.simulate('LKR', 12, n_paths=2500, seed=8))
+
+def test_whole_history_block():
+    # one block as long as the holding period: every path is a historical window (or one that wraps)
+    history=monteCarlo.annual_history('EUR')
+    paths=monteCarlo.simulate('EUR', 3, n_paths=500, block=3, seed=1, history=history)
+    logs=np.tile(np.column_stack([history.stock, history.cpi, history.fx]), (2, 1))
+    windows=np.array([logs[i:i+3].sum(axis=0) for i in range(len(history.years))])
+    distance=np.abs(paths[:, np.newaxis, :]-windows[np.newaxis, :, :]).max(axis=2).min(axis=1)
+    assert distance.max() < 1e-12
+
+def test_simulate_outcomes():
+    outcome=monteCarlo.simulate_outcomes('LKR', 100000, 200000, 16, n_paths=10000, seed=0)
+    assert list(outcome.percentiles.index) == list(monteCarlo.PERCENTILES)
+    assert outcome.percentiles['stocks'].is_monotonic_increasing
+    assert outcome.percentiles['property'].is_monotonic_increasing
+    assert 0 <= outcome.stocks_beat_property <= 1
+    assert "| 50% |" in monteCarlo.outcome_markdown(outcome, 'LKR')
+    with pytest.raises(DataNotAvailableError):
+        monteCarlo.simulate_outcomes('LKR', 100000, 200000, -16)
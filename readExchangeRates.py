@@ -1,7 +1,17 @@
 import datetime
+import os
+import threading
+import time
+import numpy as np
 import pandas as pd
 import sqlite3
 import logging
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+import dataBundle
 
 
 DATABASE = "./data/XRATES.db"
@@ -12,47 +22,305 @@ YEAR_CN = "year"
 RATE_CN = "rate"
 COUNTRY_CN="country"
 
-df = pd.read_csv('./data/currency_codes.csv', encoding="ISO-8859-1")
-#remove null rows
-currencies=df[pd.to_numeric(df['Number'], errors='coerce').notnull()].copy()
-currencies['Number'] = currencies['Number'].astype(float)  
-currencies.drop(['Number','Country'],inplace=True, axis=1)
-currencylist=dict(currencies.values.tolist())
+CURRENCY_CODES = './data/currency_codes.csv'
+
+def read_currencylist(path=CURRENCY_CODES):
+    df = pd.read_csv(path, encoding="ISO-8859-1")
+    #remove null rows
+    currencies=df[pd.to_numeric(df['Number'], errors='coerce').notnull()].copy()
+    currencies['Number'] = currencies['Number'].astype(float)  
+    currencies.drop(['Number','Country'],inplace=True, axis=1)
+    return dict(currencies.values.tolist())
+
+class LazyCurrencyList(Mapping):
+    """Currency name -> code, read from CURRENCY_CODES on first access."""
+
+    def __init__(self):
+        self._data = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    bundle = dataBundle.load_bundle()
+                    if bundle is not None:
+                        self._data = dict(zip(bundle['currency_name'].tolist(), bundle['currency_code'].tolist()))
+                    else:
+                        self._data = read_currencylist()
+        return self._data
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+currencylist = LazyCurrencyList()
+
+_con = None
+
+def write_connection():
+    """The connection used by drop_table, create_table, writeDB and writeRec, opened on first use."""
+    global _con
+    if _con is None:
+        _con = sqlite3.connect(DATABASE, check_same_thread=False)
+    return _con
+
+def __getattr__(name):
+    if name == "con":
+        return write_connection()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# read queries, all parameterized so sqlite3's per connection statement cache can reuse them
+SQL_CURRENCIES = f"SELECT {CURR_CN}, {COUNTRY_CN} FROM {INDEXTABLEN}"
+SQL_ALL_RATES = f"SELECT {CURR_CN}, {YEAR_CN}, {RATE_CN} FROM {TABLENAME}"
+SQL_RANGE = f"SELECT {YEAR_CN} FROM {TABLENAME} WHERE {CURR_CN}=? ORDER BY {YEAR_CN}"
+SQL_RATES = f"SELECT {YEAR_CN}, {RATE_CN} FROM {TABLENAME} WHERE {CURR_CN}=? AND {YEAR_CN}<? AND {YEAR_CN}>? ORDER BY {YEAR_CN}"
+SQL_RATE = f"SELECT {RATE_CN} FROM {TABLENAME} WHERE {CURR_CN}=? AND {YEAR_CN}=?"
+# (currency, year) pairs per bulk query; short chunks are padded so the statement text never changes
+PAIRS_PER_QUERY = 250
+SQL_RATE_PAIRS = f"""WITH q(i, c, y) AS (VALUES {", ".join(["(?,?,?)"]*PAIRS_PER_QUERY)})
+                     SELECT q.i, x.{RATE_CN} FROM q JOIN {TABLENAME} x ON x.{CURR_CN}=q.c AND x.{YEAR_CN}=q.y"""
+
+# immutable=1 read connections, only safe when nothing writes the database while the app 
+# runs (no ingest_xrates/update_xrates against the live file)
+IMMUTABLE_DATABASE = os.environ.get("XRATES_IMMUTABLE", "").lower() not in ("", "0", "false", "no")
+
+class ReadOnlyPool:
+    """Per-thread read-only connections to a database file. 
+    
+    Connections are opened with mode=ro, and with immutable=1 if immutable is True. That 
+    skips SQLite's file locking and change detection, so it is only for a database nothing 
+    writes to while it is read; ingest_xrates and update_xrates rewrite the file in place. 
+    When the file's mtime changes every thread reconnects on its next query."""
+
+    def __init__(self, database, immutable=False, cached_statements=64):
+        self.database = database
+        self.immutable = immutable
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def _uri(self):
+        uri = f"file:{pathname2url(os.path.abspath(self.database))}?mode=ro"
+        return uri+"&immutable=1" if self.immutable else uri
 
-con = sqlite3.connect(DATABASE)
+    def connection(self):
+        mtime = os.path.getmtime(self.database)
+        con2 = getattr(self._local, "con", None)
+        if con2 is not None and self._local.mtime == mtime:
+            return con2
+        if con2 is not None:
+            self._discard(con2)
+        con2 = sqlite3.connect(self._uri(), uri=True, check_same_thread=False, 
+                               cached_statements=self.cached_statements)
+        self._local.con = con2
+        self._local.mtime = mtime
+        with self._lock:
+            self._connections.append(con2)
+        return con2
+
+    def _discard(self, con2):
+        with self._lock:
+            if con2 in self._connections:
+                self._connections.remove(con2)
+        con2.close()
+
+    def execute(self, sql, parameters=()):
+        return self.connection().execute(sql, parameters)
+
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for con2 in connections:
+            con2.close()
+        self._local = threading.local()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def read_pool(database=None):
+    database = DATABASE if database is None else database
+    with _pools_lock:
+        pool = _pools.get(database)
+        if pool is None:
+            pool = _pools[database] = ReadOnlyPool(database, immutable=IMMUTABLE_DATABASE)
+        return pool
 
 def get_currencies():
-    con2 = sqlite3.connect(DATABASE)
-    sql = f"""SELECT {CURR_CN}, {COUNTRY_CN} from {INDEXTABLEN} """
-    cur = con2.cursor()
-    ans=cur.execute(sql).fetchall()
-    return ans   
+    bundle = dataBundle.load_bundle()
+    if bundle is not None:
+        return list(zip(bundle['country_code'].tolist(), bundle['country_name'].tolist()))
+    return read_pool().execute(SQL_CURRENCIES).fetchall()
+
+def fetch_range(currency):
+    return [x[0] for x in read_pool().execute(SQL_RANGE, (currency,))]
+
+def fetch_rates(currency, fromy, toyear):
+    rows = read_pool().execute(SQL_RATES, (currency, int(toyear), int(fromy))).fetchall()
+    return pd.DataFrame(rows, columns=[YEAR_CN, RATE_CN])
+
+def fetch_rate(currency, year):
+    row = read_pool().execute(SQL_RATE, (currency, int(year))).fetchone()
+    if row is None:
+        raise KeyError(f"No exchange rate for {currency} in {year}")
+    return row[0]
+
+def fetch_rate_pairs(pairs):
+    """Rates for a list of (currency, year) pairs straight from the database, 
+    PAIRS_PER_QUERY pairs per query. None where there is no rate."""
+    pairs = list(pairs)
+    out = [None]*len(pairs)
+    pool = read_pool()
+    for start in range(0, len(pairs), PAIRS_PER_QUERY):
+        chunk = pairs[start:start+PAIRS_PER_QUERY]
+        params = []
+        for i, (currency, year) in enumerate(chunk):
+            params += [start+i, currency, int(year)]
+        params += [-1, None, None]*(PAIRS_PER_QUERY-len(chunk))
+        for i, rate in pool.execute(SQL_RATE_PAIRS, params):
+            out[i] = rate
+    return out
+
+class RateMatrix:
+    """The xrates table as a dense currency x year array of rates (nan where missing)."""
+
+    def __init__(self, codes, first_year, rates, mtime=None):
+        self.codes = list(codes)
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        self.first_year = first_year
+        self.years = np.arange(first_year, first_year+rates.shape[1])
+        self.rates = rates
+        self.mask = ~np.isnan(rates)
+        # any rate ratio between two years is one subtraction and an exp
+        with np.errstate(divide='ignore'): # a few rates are recorded as 0, their log is -inf
+            self.log_rates = np.log(rates)
+        self.mtime = mtime
+
+    @classmethod
+    def from_records(cls, currencies, years, rates, mtime=None):
+        codes, icode = np.unique(np.asarray(currencies, dtype=str), return_inverse=True)
+        years = np.asarray(years, dtype=int)
+        first_year = int(years.min()) if len(years) else 0
+        width = int(years.max())-first_year+1 if len(years) else 0
+        matrix = np.full((len(codes), width), np.nan)
+        matrix[icode.ravel(), years-first_year] = rates
+        return cls(codes, first_year, matrix, mtime)
+
+    def _year_pos(self, year):
+        pos = int(year)-self.first_year
+        return pos if 0 <= pos < len(self.years) else None
+
+    def rate(self, currency, year):
+        icode = self.code_index.get(currency)
+        pos = self._year_pos(year)
+        if icode is None or pos is None or not self.mask[icode, pos]:
+            raise KeyError(f"No exchange rate for {currency} in {year}")
+        return float(self.rates[icode, pos])
+
+    def range(self, currency):
+        icode = self.code_index.get(currency)
+        if icode is None:
+            return []
+        return self.years[self.mask[icode]].tolist()
+
+    def rates_between(self, currency, fromy, toyear):
+        # years strictly between fromy and toyear, like the original SQL query
+        icode = self.code_index.get(currency)
+        if icode is None:
+            return pd.DataFrame({YEAR_CN: np.array([], dtype=int), RATE_CN: np.array([], dtype=float)})
+        keep = self.mask[icode] & (self.years > int(fromy)) & (self.years < int(toyear))
+        return pd.DataFrame({YEAR_CN: self.years[keep], RATE_CN: self.rates[icode, keep]})
+
+    def log_rate(self, currency, year):
+        icode = self.code_index.get(currency)
+        pos = self._year_pos(year)
+        if icode is None or pos is None or not self.mask[icode, pos]:
+            raise KeyError(f"No exchange rate for {currency} in {year}")
+        return float(self.log_rates[icode, pos])
+
+    def lookup(self, currencies, years):
+        """Rates for arrays of currencies and years (nan where there is no rate)."""
+        return self.take(self.rates, self.cells(currencies, years))
+
+    def log_lookup(self, currencies, years):
+        """Like lookup, but the natural logs of the rates."""
+        return self.take(self.log_rates, self.cells(currencies, years))
+
+    def cells(self, currencies, years):
+        """(rows, columns) of arrays of currencies and years in rates, -1 where there is no rate."""
+        currencies = np.asarray(currencies, dtype=str)
+        years = np.asarray(years, dtype=float)
+        if not len(currencies) or not len(self.years):
+            return np.full(len(currencies), -1), np.full(len(currencies), -1)
+        codes, inverse = np.unique(currencies, return_inverse=True)
+        icode = np.array([self.code_index.get(c, -1) for c in codes])[inverse.ravel()]
+        pos = np.where(np.isfinite(years), years, -1).astype(int)-self.first_year
+        ok = (icode >= 0) & (pos >= 0) & (pos < len(self.years))
+        return np.where(ok, icode, -1), np.where(ok, pos, -1)
+
+    @staticmethod
+    def take(table, cells):
+        """Values of table (rates or log_rates) at cells, nan where the cell is -1."""
+        rows, columns = cells
+        out = np.full(len(rows), np.nan)
+        ok = rows >= 0
+        out[ok] = table[rows[ok], columns[ok]]
+        return out
+
+def load_rate_matrix(database=None):
+    database = DATABASE if database is None else database
+    mtime = os.path.getmtime(database)
+    rows = read_pool(database).execute(SQL_ALL_RATES).fetchall()
+    currs, years, rates = zip(*rows) if rows else ((), (), ())
+    return RateMatrix.from_records(currs, years, rates, mtime)
+
+# how often (seconds) rate_matrix() checks the database file for changes
+MTIME_CHECK_INTERVAL = 2.0
+_rate_matrix = None
+_rate_matrix_checked = 0.0
+_rate_matrix_lock = threading.Lock()
+
+def rate_matrix():
+    """The process wide RateMatrix, rebuilt when the database file's mtime changes."""
+    global _rate_matrix, _rate_matrix_checked
+    matrix = _rate_matrix
+    if matrix is not None and time.monotonic()-_rate_matrix_checked < MTIME_CHECK_INTERVAL:
+        return matrix
+    with _rate_matrix_lock:
+        mtime = os.path.getmtime(DATABASE)
+        if _rate_matrix is None or mtime != _rate_matrix.mtime:
+            bundle = dataBundle.load_bundle()
+            if bundle is not None:
+                _rate_matrix = RateMatrix(bundle['xrate_code'].tolist(), int(bundle['xrate_first_year'][0]), 
+                                          bundle['xrate_rate'], mtime)
+            else:
+                _rate_matrix = load_rate_matrix(DATABASE)
+            logging.debug(f"Loaded {len(_rate_matrix.codes)} currencies from {DATABASE}")
+        _rate_matrix_checked = time.monotonic()
+        return _rate_matrix
 
 def get_range(currecy):
-    con2 = sqlite3.connect(DATABASE)
-    sql = f"""SELECT {YEAR_CN} from {TABLENAME} WHERE {CURR_CN}='{currecy}'"""
-    cur = con2.cursor()
-    ans=cur.execute(sql).fetchall()
-    ans=[x[0] for x in ans]
-    return ans
+    return rate_matrix().range(currecy)
 
 def get_rates(currency, fromy, toyear):
-    con2 = sqlite3.connect(DATABASE)
-    sql = f"""SELECT {YEAR_CN}, {RATE_CN} from {TABLENAME} WHERE {CURR_CN}='{currency}' AND {YEAR_CN}<{toyear} AND {YEAR_CN} > {fromy}"""
-    df = pd.read_sql_query(sql, con2)    
-    return df
+    return rate_matrix().rates_between(currency, fromy, toyear)
 
 def get_rate(currecy, year):
-    con2 = sqlite3.connect(DATABASE)
-    sql = f"""SELECT {RATE_CN} from {TABLENAME} WHERE {CURR_CN}='{currecy}' AND {YEAR_CN}={year}"""
-    cur = con2.cursor()
-    ans=cur.execute(sql).fetchone()[0]  
-    con2.close()
-    return ans 
+    return rate_matrix().rate(currecy, year)
+
+def lookup_rates(currencies, years):
+    return rate_matrix().lookup(currencies, years)
 
 def drop_table():
     sql_drop1 = f""" drop table if exists {TABLENAME};"""
     sql_drop2 = f""" drop table if exists {INDEXTABLEN};"""    
+    con = write_connection()
     
     cur = con.cursor()
     cur.execute(sql_drop1)
@@ -61,51 +329,59 @@ def drop_table():
 
     
 
-def create_table():
-    sql_create_projects_table1 = f""" CREATE TABLE IF NOT EXISTS {TABLENAME} (
+def _create_tables(con2, tablename=TABLENAME, indextablen=INDEXTABLEN):
+    sql_create_projects_table1 = f""" CREATE TABLE IF NOT EXISTS {tablename} (
                                         {CURR_CN} text NOT NULL,
                                         {YEAR_CN} INTEGER NOT NULL,
                                         {RATE_CN} REAL NOT NULL,
                                         PRIMARY KEY ({CURR_CN}, {YEAR_CN})
                                         ); """     
-    sql_create_projects_table2 = f""" CREATE TABLE IF NOT EXISTS {INDEXTABLEN} (
+    sql_create_projects_table2 = f""" CREATE TABLE IF NOT EXISTS {indextablen} (
                                         {CURR_CN} text PRIMARY KEY NOT NULL,
                                         {COUNTRY_CN} text NOT NULL
                                       ); """    
-    sql_index=f"CREATE UNIQUE INDEX IF NOT EXISTS index_curr_year ON {TABLENAME}({CURR_CN},{YEAR_CN})"
-
-    cur = con.cursor()
+    cur = con2.cursor()
     cur.execute(sql_create_projects_table1)
     cur.execute(sql_create_projects_table2)
+
+def create_table():
+    con = write_connection()
+    _create_tables(con)
+    sql_index=f"CREATE UNIQUE INDEX IF NOT EXISTS index_curr_year ON {TABLENAME}({CURR_CN},{YEAR_CN})"
+    cur = con.cursor()
     cur.execute(sql_index)
     con.commit()    
 
-def get_xrate(currency):
+def fxtop_url(currency, from_year=0, today=None):
+    dt = datetime.datetime.today() if today is None else today
+    return (f"https://fxtop.com/en/historical-exchange-rates.php?A=1&C1=USD&C2={currency}&TR=1&MA=1"
+            f"&DD1=01&MM1=01&YYYY1={from_year:04}&B=1&P=&I=1&DD2={dt.day:02}&MM2={dt.month:02}&YYYY2={dt.year}&btnOK=Go%21")
+
+def get_xrate(currency, url=None, from_year=0):
     
     dt = datetime.datetime.today()    
     YEAR=dt.year
-    MONTH=f'{dt.month:02}'
-    DATE=f'{dt.day:02}'
     CURR=currency    
-    print(f"Getting {CURR} until {YEAR}-{MONTH}-{DATE}")
+    logging.info(f"Getting {CURR} from {from_year} until {dt:%Y-%m-%d}")
     if CURR=="USD":
-        dfavg=pd.DataFrame(range(1900,YEAR), columns=[YEAR_CN])
+        dfavg=pd.DataFrame(range(max(1900, from_year),YEAR), columns=[YEAR_CN])
         dfavg[CURR_CN]=CURR
         dfavg[RATE_CN]=1.0
         return dfavg
     
+    avgratename = f'Average USD/{CURR}='
     try:
-        ln=f"https://fxtop.com/en/historical-exchange-rates.php?A=1&C1=USD&C2={CURR}&TR=1&MA=1&DD1=01&MM1=01&YYYY1=0000&B=1&P=&I=1&DD2={DATE}&MM2={MONTH}&YYYY2={YEAR}&btnOK=Go%21"
+        ln=fxtop_url(CURR, from_year=from_year, today=dt) if url is None else url
         df_ = pd.read_html(
             ln, header=0)[-3]
         #months=[x.split("/")[0] for x in list(df['Month'])]
-        avgratename = f'Average USD/{CURR}='
         df = df_[["Month", avgratename]].copy()
         df.rename({avgratename: 'rate'}, axis=1, inplace=True)
-        df[['month', 'year']] = df['Month'].str.split('/', 1, expand=True)
+        df[['month', 'year']] = df['Month'].str.split('/', n=1, expand=True)
         df.drop(['Month'], axis=1, inplace=True )
         dfavg=df.groupby('year', as_index=False)['rate'].mean()
         dfavg['curr']=CURR
+        dfavg=dfavg[dfavg['year'].astype(int) >= from_year].reset_index(drop=True)
     except KeyError as ex:
         logging.error(f"Exception raised in getting exchange rate: {avgratename}\n"+
                       f"{ex}"
@@ -114,39 +390,213 @@ def get_xrate(currency):
         
     return dfavg
 
+def url_fetcher(url_template):
+    """A fetcher for ingest_xrates that reads fxtop-style pages from url_template 
+    (formatted with curr=<currency code>), e.g. saved HTML fixtures or a local test server."""
+    def fetcher(currency, from_year=0):
+        return get_xrate(currency, url=url_template.format(curr=currency), from_year=from_year)
+    return fetcher
+
 def writeDB(df):
+    con = write_connection()
     #cur = con.cursor()
     df.to_sql(TABLENAME, con, index=False, dtype={"year":"int"}, if_exists='append')
     con.commit()
 
     
 def writeRec(curr, country):
-    sql_insert=f"""insert into {INDEXTABLEN} ({CURR_CN}, {COUNTRY_CN}) values
-                                ("{curr}", "{country}");"""
+    sql_insert=f"""insert into {INDEXTABLEN} ({CURR_CN}, {COUNTRY_CN}) values (?, ?);"""
+    con = write_connection()
     cur = con.cursor()
-    cur.execute(sql_insert)    
+    cur.execute(sql_insert, (curr, country))    
     con.commit()
 
+STAGING_TABLENAME = TABLENAME+"_staging"
+STAGING_INDEXTABLEN = INDEXTABLEN+"_staging"
+# currencies already in the staging tables (with the number of rows fetched), to resume a run
+CHECKPOINT_TABLENAME = TABLENAME+"_checkpoint"
+
+def _fetch_with_retry(fetcher, currency, retries, backoff, **kwargs):
+    for attempt in range(retries+1):
+        try:
+            return fetcher(currency, **kwargs)
+        except Exception as ex:
+            if attempt == retries:
+                raise
+            logging.warning(f"Fetching {currency} failed ({ex}), retry {attempt+1} of {retries}")
+            time.sleep(backoff*2**attempt)
+
+def _require_rates(fetcher):
+    # an empty result (get_xrate's "Error" frame) counts as a failed fetch, so the currency is 
+    # retried and never checkpointed without rates
+    def fetch(currency, **kwargs):
+        df = fetcher(currency, **kwargs)
+        if not len(df) or RATE_CN not in df:
+            raise ValueError(f"no rates for {currency}")
+        return df
+    return fetch
+
+@contextmanager
+def _transaction(wcon, begin="BEGIN"):
+    # wcon is in autocommit mode (isolation_level=None), transactions are explicit
+    wcon.execute(begin)
+    try:
+        yield wcon
+    except Exception:
+        wcon.execute("ROLLBACK")
+        raise
+    wcon.execute("COMMIT")
+
+def _write_staging(wcon, fetched):
+    rows = []
+    for code, country, df in fetched:
+        if len(df) and RATE_CN in df:
+            rows += [(code, int(year), float(rate)) for year, rate in zip(df[YEAR_CN], df[RATE_CN])]
+    with _transaction(wcon):
+        wcon.executemany(f"INSERT OR REPLACE INTO {STAGING_TABLENAME} ({CURR_CN}, {YEAR_CN}, {RATE_CN}) VALUES (?, ?, ?)", rows)
+        wcon.executemany(f"INSERT OR REPLACE INTO {STAGING_INDEXTABLEN} ({CURR_CN}, {COUNTRY_CN}) VALUES (?, ?)", 
+                         [(code, country) for code, country, df in fetched if len(df) and RATE_CN in df])
+        wcon.executemany(f"INSERT OR REPLACE INTO {CHECKPOINT_TABLENAME} ({CURR_CN}, nrows) VALUES (?, ?)", 
+                         [(code, len(df)) for code, country, df in fetched])
+    return len(rows)
+
+def _swap_staging(wcon, keep=()):
+    # keep: currencies whose live rows are carried over into the new tables
+    with _transaction(wcon, "BEGIN IMMEDIATE"):
+        if keep:
+            marks = ", ".join("?"*len(keep))
+            _create_tables(wcon)
+            wcon.execute(f"INSERT OR IGNORE INTO {STAGING_TABLENAME} SELECT {CURR_CN}, {YEAR_CN}, {RATE_CN} FROM {TABLENAME} WHERE {CURR_CN} IN ({marks})", keep)
+            wcon.execute(f"INSERT OR IGNORE INTO {STAGING_INDEXTABLEN} SELECT {CURR_CN}, {COUNTRY_CN} FROM {INDEXTABLEN} WHERE {CURR_CN} IN ({marks})", keep)
+        for table, staging in ((TABLENAME, STAGING_TABLENAME), (INDEXTABLEN, STAGING_INDEXTABLEN)):
+            wcon.execute(f"DROP TABLE IF EXISTS {table}")
+            wcon.execute(f"ALTER TABLE {staging} RENAME TO {table}")
+        wcon.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS index_curr_year ON {TABLENAME}({CURR_CN},{YEAR_CN})")
+        wcon.execute(f"DROP TABLE {CHECKPOINT_TABLENAME}")
+
+def ingest_xrates(database=None, fetcher=get_xrate, currencies=None, workers=8, 
+                  retries=3, backoff=1.0, batch_size=20, resume=True, keep_failed=False):
+    """Fetch exchange rates for all currencies concurrently and replace the xrates and 
+    countries tables. 
+    
+    fetcher(code) returns a DataFrame with year, rate and curr columns (get_xrate, or see 
+    url_fetcher). Results are written in batches of batch_size currencies, one transaction 
+    each, to staging tables that double as a checkpoint: with resume=True a run that failed 
+    part way only fetches the missing currencies. Once every currency is fetched the staging 
+    tables are swapped into place in a single transaction; the live tables are untouched 
+    until then. Returns a summary dict; 'failed' lists currencies that still failed after 
+    retries. The swap is skipped if there are any, unless keep_failed=True: then the tables 
+    are swapped anyway, with the rows already in the live tables for the failed currencies."""
+    database = DATABASE if database is None else database
+    currencies = currencylist if currencies is None else currencies
+    wcon = sqlite3.connect(database, timeout=30, isolation_level=None)
+    try:
+        if not resume:
+            for table in (STAGING_TABLENAME, STAGING_INDEXTABLEN, CHECKPOINT_TABLENAME):
+                wcon.execute(f"DROP TABLE IF EXISTS {table}")
+        _create_tables(wcon, STAGING_TABLENAME, STAGING_INDEXTABLEN)
+        wcon.execute(f"CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLENAME} ({CURR_CN} text PRIMARY KEY NOT NULL, nrows INTEGER NOT NULL)")
+        done = {x[0] for x in wcon.execute(f"SELECT {CURR_CN} FROM {CHECKPOINT_TABLENAME}")}
+        todo = {}
+        for country, code in currencies.items():
+            if code not in done and code not in todo:
+                todo[code] = country
+        logging.debug(f"{len(done)} currencies already staged, fetching {len(todo)}")
+
+        summary = {"fetched": 0, "rows": 0, "failed": [], "swapped": False}
+        fetched = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_fetch_with_retry, _require_rates(fetcher), code, retries, backoff): code 
+                       for code in todo}
+            for future in as_completed(futures):
+                code = futures[future]
+                try:
+                    fetched.append((code, todo[code], future.result()))
+                except Exception as ex:
+                    logging.error(f"Giving up on {code}: {ex}")
+                    summary["failed"].append(code)
+                    continue
+                if len(fetched) >= batch_size:
+                    summary["rows"] += _write_staging(wcon, fetched)
+                    summary["fetched"] += len(fetched)
+                    fetched = []
+        if fetched:
+            summary["rows"] += _write_staging(wcon, fetched)
+            summary["fetched"] += len(fetched)
+        if keep_failed or not summary["failed"]:
+            _swap_staging(wcon, keep=summary["failed"])
+            summary["swapped"] = True
+        return summary
+    finally:
+        wcon.close()
+
+SQL_UPSERT_RATE = f"""INSERT INTO {TABLENAME} ({CURR_CN}, {YEAR_CN}, {RATE_CN}) VALUES (?, ?, ?)
+                      ON CONFLICT({CURR_CN}, {YEAR_CN}) DO UPDATE SET {RATE_CN}=excluded.{RATE_CN}
+                      WHERE {RATE_CN} <> excluded.{RATE_CN}"""
+
+def update_xrates(database=None, fetcher=get_xrate, currencies=None, workers=8, 
+                  retries=3, backoff=1.0):
+    """Incremental refresh: fetch each currency only from the last year already in xrates 
+    (that year is fetched again, it may have been incomplete) and upsert the new or changed 
+    rows in one transaction. Currencies not in the database yet are fetched in full. 
+    fetcher(code, from_year=...) is as for ingest_xrates. Returns a summary dict."""
+    database = DATABASE if database is None else database
+    currencies = currencylist if currencies is None else currencies
+    wcon = sqlite3.connect(database, timeout=30, isolation_level=None)
+    try:
+        _create_tables(wcon)
+        last_year = dict(wcon.execute(f"SELECT {CURR_CN}, MAX({YEAR_CN}) FROM {TABLENAME} GROUP BY {CURR_CN}"))
+        todo = {}
+        for country, code in currencies.items():
+            todo.setdefault(code, country)
+
+        summary = {"fetched": 0, "rows": 0, "failed": []}
+        fetched = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_fetch_with_retry, fetcher, code, retries, backoff, 
+                                       from_year=last_year.get(code, 0)): code for code in todo}
+            for future in as_completed(futures):
+                code = futures[future]
+                try:
+                    fetched.append((code, todo[code], future.result()))
+                except Exception as ex:
+                    logging.error(f"Giving up on {code}: {ex}")
+                    summary["failed"].append(code)
+        rows = [(code, int(year), float(rate)) for code, country, df in fetched if RATE_CN in df 
+                for year, rate in zip(df[YEAR_CN], df[RATE_CN])]
+        with _transaction(wcon, "BEGIN IMMEDIATE"):
+            changes = wcon.total_changes
+            wcon.executemany(SQL_UPSERT_RATE, rows)
+            summary["rows"] = wcon.total_changes-changes
+            wcon.executemany(f"INSERT OR IGNORE INTO {INDEXTABLEN} ({CURR_CN}, {COUNTRY_CN}) VALUES (?, ?)", 
+                             [(code, country) for code, country, df in fetched if len(df) and RATE_CN in df])
+        summary["fetched"] = len(fetched)
+        return summary
+    finally:
+        wcon.close()
+
 def get_xrates():
-    for key in currencylist:
-        logging.debug(f"Doing {key}")
-        code=currencylist[key]
-        df=get_xrate(code)
-        if not df.empty:
-            writeDB(df)
-            writeRec(code,key)
-        logging.debug(f"{len(df)} values written")
+    return ingest_xrates()
 
 if __name__=="__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Refresh the exchange rate database")
+    parser.add_argument("--full", action="store_true", 
+                        help="download the full history of every currency (default: only missing years)")
+    parser.add_argument("--keep-failed", action="store_true", 
+                        help="with --full, replace the tables even if some currencies fail, keeping their current rows")
+    args = parser.parse_args()
     logging.basicConfig(level=logging.DEBUG)
-    drop_table()
-    create_table()
-    #dfavg=get_xrate("LKR")
-    #writeDB(dfavg)
-    get_xrates()
+    summary = ingest_xrates(keep_failed=args.keep_failed) if args.full else update_xrates()
+    print(summary)
+    if summary["failed"]:
+        print(f"Failed: {', '.join(sorted(summary['failed']))}")
+        if args.full and not summary["swapped"]:
+            print("The tables were not replaced; run again, or use --keep-failed to keep the current rows of these currencies")
+    dataBundle.build_bundle()
     
     print(get_rate("LKR",1985))
     print(get_rate("LKR","2021"))
     print(get_range("LKR"))
     print(get_rate("LKR", str(get_range('LKR')[-1])))
-    #print(get_currencies())
\ No newline at end of file
+    #print(get_currencies())
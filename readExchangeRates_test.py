@@ -0,0 +1,117 @@
+import shutil
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import readExchangeRates
+from readExchangeRates import ingest_xrates, update_xrates, url_fetcher
+
+DUMMY_TABLE = "<table><tr><th>Info</th></tr><tr><td>-</td></tr></table>"
+
+def fxtop_page(curr, rates):
+    # the monthly averages are the third table from the end, like on fxtop.com
+    rows = "".join(f"<tr><td>{month}</td><td>{rate}</td></tr>" for month, rate in rates.items())
+    table = f"<table><tr><th>Month</th><th>Average USD/{curr}=</th></tr>{rows}</table>"
+    return f"<html><body>{DUMMY_TABLE}{table}{DUMMY_TABLE}{DUMMY_TABLE}</body></html>"
+
+FIXTURES = {
+    "LKR": {"01/2020": 180.0, "02/2020": 182.0, "01/2021": 190.0},
+    "EUR": {"01/2020": 0.9, "01/2021": 0.8, "02/2021": 0.84},
+    "GBP": {"06/2021": 0.7},
+}
+CURRENCIES = {"Sri Lanka Rupee": "LKR", "Euro": "EUR", "Pound Sterling": "GBP"}
+
+@pytest.fixture
+def fixture_fetcher(tmp_path):
+    for curr, rates in FIXTURES.items():
+        (tmp_path/f"{curr}.html").write_text(fxtop_page(curr, rates))
+    return url_fetcher(str(tmp_path/"{curr}.html"))
+
+@pytest.fixture
+def database(tmp_path):
+    database = str(tmp_path/"XRATES.db")
+    shutil.copy(readExchangeRates.DATABASE, database)
+    return database
+
+def read_table(database, sql):
+    con = sqlite3.connect(database)
+    try:
+        return con.execute(sql).fetchall()
+    finally:
+        con.close()
+
+def test_get_xrate_from_fixture(fixture_fetcher):
+    df = fixture_fetcher("LKR")
+    assert list(df['year']) == ['2020', '2021']
+    assert list(df['rate']) == pytest.approx([181.0, 190.0])
+
+def test_ingest_xrates(database, fixture_fetcher):
+    calls = []
+    def flaky(curr):
+        calls.append(curr)
+        if curr == "EUR" and calls.count("EUR") == 1:
+            raise IOError("connection reset")
+        return fixture_fetcher(curr)
+    ret = ingest_xrates(database, fetcher=flaky, currencies=CURRENCIES, workers=2, backoff=0, batch_size=2)
+    assert ret == {"fetched": 3, "rows": 5, "failed": [], "swapped": True}
+    assert calls.count("EUR") == 2
+    assert read_table(database, "SELECT curr, year, rate FROM xrates ORDER BY curr, year") == [
+        ("EUR", 2020, 0.9), ("EUR", 2021, pytest.approx(0.82)), ("GBP", 2021, 0.7),
+        ("LKR", 2020, 181.0), ("LKR", 2021, 190.0)]
+    assert sorted(read_table(database, "SELECT curr FROM countries")) == [("EUR",), ("GBP",), ("LKR",)]
+    tables = {x[0] for x in read_table(database, "SELECT name FROM sqlite_master WHERE type='table'")}
+    assert tables == {"xrates", "countries"}
+
+def test_ingest_xrates_resume(database, fixture_fetcher):
+    before = read_table(database, "SELECT count(*) FROM xrates")
+    def failing(curr):
+        if curr == "GBP":
+            raise IOError("timeout")
+        return fixture_fetcher(curr)
+    ret = ingest_xrates(database, fetcher=failing, currencies=CURRENCIES, retries=1, backoff=0)
+    assert ret["failed"] == ["GBP"] and not ret["swapped"]
+    assert read_table(database, "SELECT count(*) FROM xrates") == before # live table untouched
+
+    calls = []
+    def counting(curr):
+        calls.append(curr)
+        return fixture_fetcher(curr)
+    ret = ingest_xrates(database, fetcher=counting, currencies=CURRENCIES)
+    assert calls == ["GBP"]
+    assert ret["swapped"]
+    assert read_table(database, "SELECT count(*) FROM xrates") == [(5,)]
+
+def test_ingest_xrates_empty_fetch_fails(database, fixture_fetcher):
+    def empty(curr):
+        return pd.DataFrame(columns=["Error"]) if curr == "GBP" else fixture_fetcher(curr)
+    ret = ingest_xrates(database, fetcher=empty, currencies=CURRENCIES, retries=0)
+    assert ret["failed"] == ["GBP"] and not ret["swapped"]
+    assert read_table(database, "SELECT curr FROM xrates_checkpoint ORDER BY curr") == [("EUR",), ("LKR",)]
+
+def test_ingest_xrates_keep_failed(database, fixture_fetcher):
+    gbp = read_table(database, "SELECT curr, year, rate FROM xrates WHERE curr='GBP' ORDER BY year")
+    def failing(curr):
+        if curr == "GBP":
+            raise IOError("timeout")
+        return fixture_fetcher(curr)
+    ret = ingest_xrates(database, fetcher=failing, currencies=CURRENCIES, retries=0, keep_failed=True)
+    assert ret == {"fetched": 2, "rows": 4, "failed": ["GBP"], "swapped": True}
+    assert read_table(database, "SELECT curr, year, rate FROM xrates WHERE curr='GBP' ORDER BY year") == gbp
+    assert read_table(database, "SELECT count(*) FROM xrates") == [(4+len(gbp),)]
+    assert sorted(read_table(database, "SELECT curr FROM countries")) == [("EUR",), ("GBP",), ("LKR",)]
+
+def test_update_xrates(database, tmp_path, fixture_fetcher):
+    ingest_xrates(database, fetcher=fixture_fetcher, currencies=CURRENCIES)
+    (tmp_path/"LKR.html").write_text(fxtop_page("LKR", {"01/2020": 180.0, "01/2021": 191.0, "03/2022": 200.0}))
+    (tmp_path/"JPY.html").write_text(fxtop_page("JPY", {"01/2021": 110.0}))
+    calls = {}
+    def recording(curr, from_year=0):
+        calls[curr] = from_year
+        return fixture_fetcher(curr, from_year=from_year)
+    ret = update_xrates(database, fetcher=recording, currencies={**CURRENCIES, "Yen": "JPY"})
+    assert calls == {"LKR": 2021, "EUR": 2021, "GBP": 2021, "JPY": 0}
+    assert ret == {"fetched": 4, "rows": 3, "failed": []} # LKR 2021 changed, LKR 2022 and JPY 2021 added
+    assert read_table(database, "SELECT year, rate FROM xrates WHERE curr='LKR' ORDER BY year") == [
+        (2020, 181.0), (2021, 191.0), (2022, 200.0)]
+    assert read_table(database, "SELECT country FROM countries WHERE curr='JPY'") == [("Yen",)]
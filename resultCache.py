@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class SQLiteBackend:
+    """Results shared between processes (e.g. all gunicorn workers) in a SQLite file.
+    Values are stored as JSON."""
+
+    def __init__(self, path, ttl=3600., maxsize=10000):
+        self.path = path
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        con = self._connection()
+        with con:
+            con.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)")
+
+    def _connection(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=5)
+            con.execute("PRAGMA journal_mode=WAL")
+            self._local.con = con
+        return con
+
+    def get(self, key):
+        item = self.get_many([key]).get(key)
+        return None if item is None else item[0]
+
+    def get_many(self, keys):
+        """(value, age in seconds) of the unexpired keys (a dict), in one select per 500 keys."""
+        keys = list(keys)
+        con = self._connection()
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start+500]
+            rows = con.execute(f"SELECT key, value, created FROM results WHERE key IN ({', '.join('?'*len(chunk))})", chunk)
+            now = time.time()
+            found.update({key: (json.loads(value), max(now-created, 0.0)) for key, value, created in rows 
+                          if now-created <= self.ttl})
+        return found
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, items):
+        """Stores a dict of values in one transaction."""
+        con = self._connection()
+        now = time.time()
+        with con:
+            con.executemany("INSERT OR REPLACE INTO results (key, value, created) VALUES (?, ?, ?)",
+                            [(key, json.dumps(value), now) for key, value in items.items()])
+        with self._writes_lock:
+            prune = (self._writes+len(items))//100 > self._writes//100
+            self._writes += len(items)
+        if prune:
+            self.prune()
+
+    def prune(self):
+        con = self._connection()
+        with con:
+            con.execute("DELETE FROM results WHERE created < ?", (time.time()-self.ttl,))
+            con.execute("""DELETE FROM results WHERE key NOT IN
+                           (SELECT key FROM results ORDER BY created DESC LIMIT ?)""", (self.maxsize,))
+
+    def clear(self):
+        con = self._connection()
+        with con:
+            con.execute("DELETE FROM results")
+
+
+class ResultCache:
+    """Size bounded LRU cache with a time to live, optionally backed by a shared store
+    (SQLiteBackend) that is consulted on local misses. Keys are strings. Thread safe."""
+
+    def __init__(self, maxsize=256, ttl=3600., backend=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and time.monotonic()-item[1] <= self.ttl:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            if item is not None:
+                del self._items[key]
+        item = None
+        if self.backend is not None:
+            try:
+                item = self.backend.get_many([key]).get(key)
+            except sqlite3.Error as ex:
+                logging.warning(f"Result cache backend failed: {ex}")
+        with self._lock:
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # kept locally only for what is left of its time to live
+        self._store_many({key: item[0]}, {key: item[1]})
+        return item[0]
+
+    def get_many(self, keys):
+        """The cached values of keys (a dict), like get() but consulting the backend once for
+        all local misses."""
+        found, missing = {}, []
+        with self._lock:
+            for key in keys:
+                item = self._items.get(key)
+                if item is not None and time.monotonic()-item[1] <= self.ttl:
+                    self._items.move_to_end(key)
+                    found[key] = item[0]
+                else:
+                    if item is not None:
+                        del self._items[key]
+                    missing.append(key)
+        shared = {}
+        if self.backend is not None and missing:
+            try:
+                shared = self.backend.get_many(missing)
+            except sqlite3.Error as ex:
+                logging.warning(f"Result cache backend failed: {ex}")
+        with self._lock:
+            self.hits += len(found)+len(shared)
+            self.misses += len(missing)-len(shared)
+        values = {key: value for key, (value, age) in shared.items()}
+        self._store_many(values, {key: age for key, (value, age) in shared.items()})
+        return {**found, **values}
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, items):
+        """Stores a dict of values, in one backend transaction."""
+        self._store_many(items)
+        if self.backend is not None and items:
+            try:
+                self.backend.set_many(items)
+            except sqlite3.Error as ex:
+                logging.warning(f"Result cache backend failed: {ex}")
+
+    def _store_many(self, items, ages=None):
+        # ages: seconds since the items were computed, if not just now
+        ages = ages or {}
+        with self._lock:
+            now = time.monotonic()
+            for key, value in items.items():
+                self._items[key] = (value, now-ages.get(key, 0.0))
+                self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self._items), "maxsize": self.maxsize}
+
+
+class SingleFlight:
+    """Runs a function once for concurrent calls with the same key: the first caller computes,
+    the others wait for and share its result (or exception). Thread safe."""
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = {"done": threading.Event()}
+                self.calls += 1
+            else:
+                self.shared += 1
+        if leader:
+            try:
+                flight["value"] = function()
+            except BaseException as ex:
+                flight["error"] = ex
+                raise
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight["done"].set()
+            return flight["value"]
+        flight["done"].wait()
+        if "error" in flight:
+            raise flight["error"]
+        return flight["value"]
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.shared, "misses": self.calls, "size": len(self._flights)}
+
+
+def from_environment(prefix="RESULT_CACHE", maxsize=256):
+    """A ResultCache configured from <prefix>_SIZE (default maxsize), <prefix>_TTL (seconds) 
+    and <prefix>_PATH (a SQLite file shared by all workers; in-process only if not set)."""
+    ttl = float(os.environ.get(f"{prefix}_TTL", 3600))
+    path = os.environ.get(f"{prefix}_PATH")
+    backend = SQLiteBackend(path, ttl=ttl) if path else None
+    return ResultCache(maxsize=int(os.environ.get(f"{prefix}_SIZE", maxsize)), ttl=ttl, backend=backend)
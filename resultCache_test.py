@@ -0,0 +1,77 @@
+import threading
+import time
+
+from resultCache import ResultCache, SingleFlight, SQLiteBackend
+
+def test_lru_eviction():
+    cache = ResultCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3) # evicts b, the least recently used
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.stats() == {"hits": 2, "misses": 1, "size": 2, "maxsize": 2}
+
+def test_ttl():
+    cache = ResultCache(ttl=0.05)
+    cache.set("a", {"markdown": "x"})
+    assert cache.get("a") == {"markdown": "x"}
+    time.sleep(0.1)
+    assert cache.get("a") is None
+
+def test_shared_backend(tmp_path):
+    path = str(tmp_path/"results.db")
+    worker1 = ResultCache(backend=SQLiteBackend(path))
+    worker2 = ResultCache(backend=SQLiteBackend(path))
+    worker1.set("key", {"markdown": "text", "figures": ["{}"], "url": "?curr=LKR"})
+    assert worker2.get("key") == {"markdown": "text", "figures": ["{}"], "url": "?curr=LKR"}
+    assert worker2.stats()["size"] == 1 # kept locally after the first hit
+    expired = ResultCache(backend=SQLiteBackend(path, ttl=0))
+    assert expired.get("key") is None
+
+def test_backend_hit_keeps_its_age(tmp_path):
+    path = str(tmp_path/"results.db")
+    ResultCache(backend=SQLiteBackend(path)).set("key", 1)
+    time.sleep(0.1)
+    worker = ResultCache(ttl=0.15, backend=SQLiteBackend(path, ttl=0.15))
+    assert worker.get("key") == 1
+    time.sleep(0.1) # expired locally too, though it was only fetched 0.1 s ago
+    assert worker.get("key") is None
+
+def test_many(tmp_path):
+    path = str(tmp_path/"results.db")
+    worker1 = ResultCache(backend=SQLiteBackend(path))
+    worker2 = ResultCache(maxsize=3, backend=SQLiteBackend(path))
+    worker1.set_many({str(i): i for i in range(1000)})
+    worker2.set("local", 0)
+    assert worker2.get_many(["local", "1", "999", "x"]) == {"local": 0, "1": 1, "999": 999}
+    assert worker2.stats() == {"hits": 3, "misses": 1, "size": 3, "maxsize": 3}
+    assert len(worker2.get_many([str(i) for i in range(1000)])) == 1000 # more keys than one select
+
+def test_single_flight():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"markdown": "x"}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("a", compute)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do("a", compute))) for _ in range(3)]
+    for f in followers:
+        f.start()
+    while flight.stats()["hits"] < 3:
+        time.sleep(0.001)
+    release.set()
+    for t in [leader]+followers:
+        t.join()
+    assert len(calls) == 1 and results == [{"markdown": "x"}]*4
+    assert flight.stats() == {"hits": 3, "misses": 1, "size": 0}
+    assert flight.do("a", lambda: 2) == 2 # nothing in flight any more